@@ -0,0 +1,18 @@
+"""
+Utilidades de caché en memoria (por proceso) para datos de referencia
+"""
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+
+def copia_desacoplada(obj):
+    """Crear una copia sin sesión (solo columnas) apta para guardarse en caché"""
+    mapper = inspect(obj).mapper
+    copia = mapper.class_(**{attr.key: getattr(obj, attr.key) for attr in mapper.column_attrs})
+    make_transient_to_detached(copia)
+    return copia
+
+
+def adjuntar(db: Session, obj):
+    """Adjuntar a la sesión una copia de un objeto cacheado sin consultar la base de datos"""
+    return db.merge(obj, load=False)
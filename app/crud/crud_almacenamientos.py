@@ -2,79 +2,98 @@
 Operaciones CRUD para gestión de almacenamientos
 """
 from typing import List, Optional
-from sqlalchemy.orm import Session
+from sqlalchemy import bindparam, insert, or_, select, update
+from sqlalchemy.orm import Session, raiseload
+from database import ENV_STATE
 from models.models import Almacenamientos
 from schemas.schemas import AlmacenamientoCreate, AlmacenamientoUpdate
 
+# AlmacenamientoResponse no serializa relaciones, por lo que los listados no
+# necesitan eager loading. Fuera de producción cualquier lazy load accidental
+# lanza una excepción en lugar de generar consultas N+1 silenciosas.
+_LIST_OPTIONS = [raiseload('*')] if ENV_STATE != 'production' else []
+
+# Sentencias de búsqueda construidas una sola vez; los términos se pasan como
+# parámetros para reutilizar la compilación cacheada entre peticiones
+_SEARCH_STMT = select(Almacenamientos).options(*_LIST_OPTIONS).where(
+    Almacenamientos.activo == 1,
+    or_(
+        Almacenamientos.codigo.ilike(bindparam("patron")),
+        Almacenamientos.nombre.ilike(bindparam("patron")),
+        Almacenamientos.descripcion.ilike(bindparam("patron")),
+        Almacenamientos.ubicacion_fisica.ilike(bindparam("patron"))
+    )
+).offset(bindparam("skip")).limit(bindparam("limit"))
+
 
 def get_almacenamientos(db: Session, skip: int = 0, limit: int = 100) -> List[Almacenamientos]:
     """Obtener lista de almacenamientos con paginación"""
-    return db.query(Almacenamientos).filter(Almacenamientos.activo == 1).offset(skip).limit(limit).all()
+    return db.scalars(select(Almacenamientos).options(*_LIST_OPTIONS).where(
+        Almacenamientos.activo == 1
+    ).offset(skip).limit(limit)).all()
 
 
 def get_almacenamiento_by_id(db: Session, almacenamiento_id: int) -> Optional[Almacenamientos]:
     """Obtener un almacenamiento por su ID"""
-    return db.query(Almacenamientos).filter(
-        Almacenamientos.id == almacenamiento_id,
-        Almacenamientos.activo == 1
-    ).first()
+    db_almacenamiento = db.get(Almacenamientos, almacenamiento_id)
+    if db_almacenamiento and db_almacenamiento.activo == 1:
+        return db_almacenamiento
+    return None
 
 
 def get_almacenamiento_by_codigo(db: Session, codigo: str) -> Optional[Almacenamientos]:
     """Obtener un almacenamiento por su código único"""
-    return db.query(Almacenamientos).filter(
+    return db.scalars(select(Almacenamientos).where(
         Almacenamientos.codigo == codigo,
         Almacenamientos.activo == 1
-    ).first()
+    )).first()
 
 
 def create_almacenamiento(db: Session, almacenamiento: AlmacenamientoCreate) -> Almacenamientos:
     """Crear un nuevo almacenamiento"""
-    db_almacenamiento = Almacenamientos(**almacenamiento.dict())
-    db.add(db_almacenamiento)
+    # INSERT ... RETURNING: el registro completo vuelve en el mismo viaje
+    db_almacenamiento = db.execute(
+        insert(Almacenamientos).values(**almacenamiento.dict()).returning(Almacenamientos)
+    ).scalar_one()
     db.commit()
-    db.refresh(db_almacenamiento)
     return db_almacenamiento
 
 
 def update_almacenamiento(db: Session, almacenamiento_id: int, almacenamiento_update: AlmacenamientoUpdate) -> Optional[Almacenamientos]:
-    """Actualizar un almacenamiento existente"""
-    db_almacenamiento = get_almacenamiento_by_id(db, almacenamiento_id)
-    if not db_almacenamiento:
-        return None
-    
+    """Actualizar un almacenamiento existente con un único UPDATE ... RETURNING"""
     update_data = almacenamiento_update.dict(exclude_unset=True)
-    for field, value in update_data.items():
-        setattr(db_almacenamiento, field, value)
-    
+    if not update_data:
+        return get_almacenamiento_by_id(db, almacenamiento_id)
+
+    # La fila actualizada vuelve en el propio UPDATE, sin SELECT posterior
+    stmt = (
+        update(Almacenamientos)
+        .where(Almacenamientos.id == almacenamiento_id, Almacenamientos.activo == 1)
+        .values(**update_data)
+        .returning(Almacenamientos)
+        .execution_options(synchronize_session=False, populate_existing=True)
+    )
+    db_almacenamiento = db.execute(stmt).scalars().first()
     db.commit()
-    db.refresh(db_almacenamiento)
     return db_almacenamiento
 
 
 def delete_almacenamiento(db: Session, almacenamiento_id: int) -> bool:
     """Eliminar (desactivar) un almacenamiento"""
-    db_almacenamiento = get_almacenamiento_by_id(db, almacenamiento_id)
-    if not db_almacenamiento:
-        return False
-    
-    # Soft delete: marcar como inactivo
-    db_almacenamiento.activo = 0
+    # Soft delete: marcar como inactivo en un único UPDATE
+    rows = db.query(Almacenamientos).filter(
+        Almacenamientos.id == almacenamiento_id,
+        Almacenamientos.activo == 1
+    ).update({"activo": 0}, synchronize_session=False)
     db.commit()
-    return True
+    return rows > 0
 
 
 def search_almacenamientos(db: Session, search_term: str = "", skip: int = 0, limit: int = 100) -> List[Almacenamientos]:
     """Buscar almacenamientos por término de búsqueda"""
-    query = db.query(Almacenamientos).filter(Almacenamientos.activo == 1)
-    
-    if search_term:
-        search_filter = f"%{search_term}%"
-        query = query.filter(
-            (Almacenamientos.codigo.ilike(search_filter)) |
-            (Almacenamientos.nombre.ilike(search_filter)) |
-            (Almacenamientos.descripcion.ilike(search_filter)) |
-            (Almacenamientos.ubicacion_fisica.ilike(search_filter))
-        )
+    if not search_term:
+        return get_almacenamientos(db, skip=skip, limit=limit)
     
-    return query.offset(skip).limit(limit).all()
\ No newline at end of file
+    # ILIKE '%term%' en las cuatro columnas (índices trigram en init_db)
+    params = {"patron": f"%{search_term}%", "skip": skip, "limit": limit}
+    return db.execute(_SEARCH_STMT, params).scalars().all()
@@ -2,31 +2,62 @@
 Operaciones CRUD para archivos de órdenes de trabajo
 """
 import os
-import uuid
-from typing import List, Optional
+import secrets
+import time
+from typing import List, Optional, Tuple
+from sqlalchemy import delete
 from sqlalchemy.orm import Session, joinedload
 from models.models import ArchivosOT, ArchivosComentarioOT
 from fastapi import UploadFile
-import shutil
 from datetime import datetime
 
+# Tamaño de bloque para copiar archivos subidos a disco (1 MB)
+CHUNK_SIZE = 1024 * 1024
+
+# Directorios de subida ya creados en este proceso
+_directorios_creados = set()
+
+
+def _guardar_archivo(archivo: UploadFile, upload_dir: str) -> Tuple[str, str, int]:
+    """Guardar archivo subido en disco y devolver (nombre único, ruta, tamaño en bytes)"""
+    # Generar nombre único ordenable por fecha de subida: timestamp en ns + sufijo aleatorio
+    file_extension = os.path.splitext(archivo.filename)[1] if archivo.filename else ""
+    sufijo = secrets.token_hex(4)
+    unique_filename = f"{time.time_ns():016x}{sufijo}{file_extension}"
+    
+    # Repartir en subdirectorios (ab/cd/) según el sufijo aleatorio para no
+    # acumular todos los archivos en un único directorio
+    subdir = os.path.join(upload_dir, sufijo[:2], sufijo[2:4])
+    if subdir not in _directorios_creados:
+        os.makedirs(subdir, exist_ok=True)
+        _directorios_creados.add(subdir)
+    file_path = os.path.join(subdir, unique_filename)
+    
+    # Copiar por bloques contando los bytes escritos
+    tamaño_bytes = 0
+    with open(file_path, "wb") as buffer:
+        while chunk := archivo.file.read(CHUNK_SIZE):
+            buffer.write(chunk)
+            tamaño_bytes += len(chunk)
+    
+    return unique_filename, file_path, tamaño_bytes
+
+
+def _eliminar_archivo_disco(ruta_archivo: str) -> None:
+    """Eliminar archivo del disco ignorando si ya no existe"""
+    try:
+        os.unlink(ruta_archivo)
+    except FileNotFoundError:
+        pass
+
 
 class CRUDArchivoOT:
     """CRUD operations para archivos de órdenes de trabajo"""
     
     def create(self, db: Session, *, archivo: UploadFile, orden_trabajo_id: int, usuario_id: int, upload_dir: str = "uploads/ot/") -> ArchivosOT:
         """Guardar archivo de orden de trabajo"""
-        # Crear directorio si no existe
-        os.makedirs(upload_dir, exist_ok=True)
-        
-        # Generar nombre único para el archivo
-        file_extension = os.path.splitext(archivo.filename)[1] if archivo.filename else ""
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
-        file_path = os.path.join(upload_dir, unique_filename)
-        
         # Guardar archivo en disco
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(archivo.file, buffer)
+        unique_filename, file_path, tamaño_bytes = _guardar_archivo(archivo, upload_dir)
         
         # Crear registro en base de datos
         db_obj = ArchivosOT(
@@ -36,11 +67,10 @@ class CRUDArchivoOT:
             nombre_archivo_sistema=unique_filename,
             ruta_archivo=file_path,
             tipo_mime=archivo.content_type or "application/octet-stream",
-            tamaño_bytes=os.path.getsize(file_path)
+            tamaño_bytes=tamaño_bytes
         )
         db.add(db_obj)
         db.commit()
-        db.refresh(db_obj)
         return db_obj
     
     def get_by_orden_trabajo(self, db: Session, orden_trabajo_id: int) -> List[ArchivosOT]:
@@ -57,17 +87,17 @@ class CRUDArchivoOT:
     
     def delete(self, db: Session, id: int) -> bool:
         """Eliminar archivo"""
-        db_obj = db.query(ArchivosOT).filter(ArchivosOT.id == id).first()
-        if db_obj:
-            # Eliminar archivo del disco
-            if os.path.exists(db_obj.ruta_archivo):
-                os.remove(db_obj.ruta_archivo)
-            
-            # Eliminar registro de la base de datos
-            db.delete(db_obj)
-            db.commit()
-            return True
-        return False
+        # Eliminar registro de la base de datos obteniendo la ruta en la misma sentencia
+        row = db.execute(
+            delete(ArchivosOT).where(ArchivosOT.id == id).returning(ArchivosOT.ruta_archivo)
+        ).first()
+        if not row:
+            return False
+        db.commit()
+        
+        # Eliminar archivo del disco solo después de confirmar la transacción
+        _eliminar_archivo_disco(row.ruta_archivo)
+        return True
 
 
 class CRUDArchivoComentarioOT:
@@ -75,17 +105,8 @@ class CRUDArchivoComentarioOT:
     
     def create(self, db: Session, *, archivo: UploadFile, comentario_id: int, usuario_id: int, upload_dir: str = "uploads/comentarios/") -> ArchivosComentarioOT:
         """Guardar archivo de comentario"""
-        # Crear directorio si no existe
-        os.makedirs(upload_dir, exist_ok=True)
-        
-        # Generar nombre único para el archivo
-        file_extension = os.path.splitext(archivo.filename)[1] if archivo.filename else ""
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
-        file_path = os.path.join(upload_dir, unique_filename)
-        
         # Guardar archivo en disco
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(archivo.file, buffer)
+        unique_filename, file_path, tamaño_bytes = _guardar_archivo(archivo, upload_dir)
         
         # Crear registro en base de datos
         db_obj = ArchivosComentarioOT(
@@ -95,11 +116,10 @@ class CRUDArchivoComentarioOT:
             nombre_archivo_sistema=unique_filename,
             ruta_archivo=file_path,
             tipo_mime=archivo.content_type or "application/octet-stream",
-            tamaño_bytes=os.path.getsize(file_path)
+            tamaño_bytes=tamaño_bytes
         )
         db.add(db_obj)
         db.commit()
-        db.refresh(db_obj)
         return db_obj
     
     def get_by_comentario(self, db: Session, comentario_id: int) -> List[ArchivosComentarioOT]:
@@ -116,17 +136,17 @@ class CRUDArchivoComentarioOT:
     
     def delete(self, db: Session, id: int) -> bool:
         """Eliminar archivo"""
-        db_obj = db.query(ArchivosComentarioOT).filter(ArchivosComentarioOT.id == id).first()
-        if db_obj:
-            # Eliminar archivo del disco
-            if os.path.exists(db_obj.ruta_archivo):
-                os.remove(db_obj.ruta_archivo)
-            
-            # Eliminar registro de la base de datos
-            db.delete(db_obj)
-            db.commit()
-            return True
-        return False
+        # Eliminar registro de la base de datos obteniendo la ruta en la misma sentencia
+        row = db.execute(
+            delete(ArchivosComentarioOT).where(ArchivosComentarioOT.id == id).returning(ArchivosComentarioOT.ruta_archivo)
+        ).first()
+        if not row:
+            return False
+        db.commit()
+        
+        # Eliminar archivo del disco solo después de confirmar la transacción
+        _eliminar_archivo_disco(row.ruta_archivo)
+        return True
 
 
 # Instancias globales
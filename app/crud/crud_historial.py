@@ -1,131 +1,216 @@
 """
 Operaciones CRUD para Historial de Repuestos
 """
-from typing import List, Optional
+from typing import Iterator, List, Optional
+from collections import defaultdict
 from datetime import datetime, date
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import and_
+from sqlalchemy.orm import Session, contains_eager, joinedload, selectinload
+from sqlalchemy import and_, case, delete, func, insert, select, update
 from models.models import HistorialRepuestos, Repuestos, Maquinas, ModelosMaquinas
 from schemas.schemas import HistorialRepuestoCreate, HistorialRepuestoUpdate
 
 
+def _select_historial_con_relaciones():
+    """Consulta base de historial con máquina y modelo en un único JOIN explícito y repuesto vía IN"""
+    return select(HistorialRepuestos).join(
+        HistorialRepuestos.maquina
+    ).outerjoin(
+        Maquinas.modelo
+    ).options(
+        contains_eager(HistorialRepuestos.maquina).contains_eager(Maquinas.modelo),
+        selectinload(HistorialRepuestos.repuesto)
+    )
+
+
 def get_historial_repuestos(db: Session, skip: int = 0, limit: int = 100) -> List[HistorialRepuestos]:
     """Obtener lista de historial con paginación incluyendo repuesto y máquina ordenado por fecha descendente"""
-    return db.query(HistorialRepuestos).options(
-        joinedload(HistorialRepuestos.repuesto),
-        joinedload(HistorialRepuestos.maquina).joinedload(Maquinas.modelo)
-    ).order_by(HistorialRepuestos.fecha.desc()).offset(skip).limit(limit).all()
+    stmt = _select_historial_con_relaciones().order_by(HistorialRepuestos.fecha.desc()).offset(skip).limit(limit)
+    return db.scalars(stmt).all()
 
 
 def get_historial_repuesto(db: Session, historial_id: int) -> Optional[HistorialRepuestos]:
     """Obtener historial por ID incluyendo relaciones"""
-    return db.query(HistorialRepuestos).options(
+    return db.get(HistorialRepuestos, historial_id, options=[
         joinedload(HistorialRepuestos.repuesto),
         joinedload(HistorialRepuestos.maquina).joinedload(Maquinas.modelo)
-    ).filter(HistorialRepuestos.id == historial_id).first()
+    ])
 
 
 def get_historial_by_repuesto(db: Session, repuesto_id: int) -> List[HistorialRepuestos]:
     """Obtener historial por repuesto ordenado por fecha descendente"""
-    return db.query(HistorialRepuestos).options(
-        joinedload(HistorialRepuestos.repuesto),
-        joinedload(HistorialRepuestos.maquina).joinedload(Maquinas.modelo)
-    ).filter(HistorialRepuestos.repuesto_id == repuesto_id).order_by(HistorialRepuestos.fecha.desc()).all()
+    stmt = _select_historial_con_relaciones().where(HistorialRepuestos.repuesto_id == repuesto_id).order_by(HistorialRepuestos.fecha.desc())
+    return db.scalars(stmt).all()
 
 
 def get_historial_by_maquina(db: Session, maquina_id: int) -> List[HistorialRepuestos]:
     """Obtener historial por máquina ordenado por fecha descendente"""
-    return db.query(HistorialRepuestos).options(
-        joinedload(HistorialRepuestos.repuesto),
-        joinedload(HistorialRepuestos.maquina).joinedload(Maquinas.modelo)
-    ).filter(HistorialRepuestos.maquina_id == maquina_id).order_by(HistorialRepuestos.fecha.desc()).all()
+    stmt = _select_historial_con_relaciones().where(HistorialRepuestos.maquina_id == maquina_id).order_by(HistorialRepuestos.fecha.desc())
+    return db.scalars(stmt).all()
 
 
 def get_historial_by_fecha_rango(db: Session, fecha_inicio: date, fecha_fin: date) -> List[HistorialRepuestos]:
     """Obtener historial por rango de fechas ordenado por fecha descendente"""
-    return db.query(HistorialRepuestos).options(
-        joinedload(HistorialRepuestos.repuesto),
-        joinedload(HistorialRepuestos.maquina).joinedload(Maquinas.modelo)
-    ).filter(
+    stmt = _select_historial_con_relaciones().where(
+        and_(
+            HistorialRepuestos.fecha >= fecha_inicio,
+            HistorialRepuestos.fecha <= fecha_fin
+        )
+    ).order_by(HistorialRepuestos.fecha.desc())
+    return db.scalars(stmt).all()
+
+
+def iter_historial_by_fecha_rango(db: Session, fecha_inicio: date, fecha_fin: date, batch_size: int = 1000) -> Iterator[HistorialRepuestos]:
+    """Recorrer historial por rango de fechas en lotes (cursor del servidor) para exportaciones"""
+    stmt = _select_historial_con_relaciones().where(
         and_(
             HistorialRepuestos.fecha >= fecha_inicio,
             HistorialRepuestos.fecha <= fecha_fin
         )
-    ).order_by(HistorialRepuestos.fecha.desc()).all()
+    ).order_by(HistorialRepuestos.fecha.desc()).execution_options(yield_per=batch_size)
+    yield from db.scalars(stmt)
 
 
 def create_historial_repuesto(db: Session, historial: HistorialRepuestoCreate) -> HistorialRepuestos:
     """Crear nuevo registro de historial y actualizar stock del repuesto"""
-    # Verificar que el repuesto tenga stock suficiente
-    repuesto = db.query(Repuestos).filter(Repuestos.id == historial.repuesto_id).first()
-    if not repuesto:
-        raise ValueError("Repuesto no encontrado")
+    # Validar y descontar stock en un único UPDATE atómico (check-and-decrement)
+    result = db.execute(
+        update(Repuestos)
+        .where(Repuestos.id == historial.repuesto_id, Repuestos.cantidad >= historial.cantidad_usada)
+        .values(cantidad=Repuestos.cantidad - historial.cantidad_usada)
+        .returning(Repuestos.cantidad)
+    )
+    if result.first() is None:
+        # Solo en el camino de error se consulta el stock para informar el motivo
+        disponible = db.query(Repuestos.cantidad).filter(Repuestos.id == historial.repuesto_id).scalar()
+        db.rollback()
+        if disponible is None:
+            raise ValueError("Repuesto no encontrado")
+        raise ValueError(f"Stock insuficiente. Disponible: {disponible}, Solicitado: {historial.cantidad_usada}")
+    
+    # Crear registro de historial en la misma transacción
+    db_historial = db.execute(
+        insert(HistorialRepuestos).values(**historial.model_dump()).returning(HistorialRepuestos)
+    ).scalar_one()
     
-    if repuesto.cantidad < historial.cantidad_usada:
-        raise ValueError(f"Stock insuficiente. Disponible: {repuesto.cantidad}, Solicitado: {historial.cantidad_usada}")
+    db.commit()
+    return db_historial
+
+
+def create_historial_repuestos_bulk(db: Session, items: List[HistorialRepuestoCreate], batch_size: int = 10000) -> int:
+    """Crear registros de historial en lote y descontar el stock en una sola transacción.
+
+    Valida repuestos, máquinas y stock con una consulta por tabla, inserta los
+    registros en lotes de batch_size y descuenta el stock con un único UPDATE.
+    Devuelve la cantidad de registros creados.
+    """
+    if not items:
+        return 0
     
-    # Crear registro de historial
-    db_historial = HistorialRepuestos(**historial.model_dump())
-    db.add(db_historial)
+    # Consumo total por repuesto (un repuesto puede aparecer en varios registros)
+    consumo = defaultdict(int)
+    for item in items:
+        consumo[item.repuesto_id] += item.cantidad_usada
     
-    # Actualizar stock del repuesto
-    repuesto.cantidad -= historial.cantidad_usada
+    repuestos = {
+        r.id: r for r in db.query(Repuestos).filter(Repuestos.id.in_(consumo)).with_for_update().all()
+    }
+    for repuesto_id, cantidad_total in consumo.items():
+        repuesto = repuestos.get(repuesto_id)
+        if not repuesto:
+            raise ValueError(f"Repuesto {repuesto_id} no encontrado")
+        if repuesto.cantidad < cantidad_total:
+            raise ValueError(
+                f"Stock insuficiente para el repuesto {repuesto.codigo}. "
+                f"Disponible: {repuesto.cantidad}, Solicitado: {cantidad_total}"
+            )
+    
+    maquina_ids = {item.maquina_id for item in items}
+    maquinas_existentes = {m_id for (m_id,) in db.query(Maquinas.id).filter(Maquinas.id.in_(maquina_ids))}
+    faltantes = maquina_ids - maquinas_existentes
+    if faltantes:
+        raise ValueError(f"Máquinas no encontradas: {sorted(faltantes)}")
+    
+    registros = [item.model_dump() for item in items]
+    for inicio in range(0, len(registros), batch_size):
+        db.execute(insert(HistorialRepuestos), registros[inicio:inicio + batch_size])
+    
+    # Descontar el stock de todos los repuestos en un único UPDATE
+    db.execute(
+        update(Repuestos)
+        .where(Repuestos.id.in_(consumo))
+        .values(cantidad=Repuestos.cantidad - case(dict(consumo), value=Repuestos.id))
+        .execution_options(synchronize_session=False)
+    )
     
     db.commit()
-    db.refresh(db_historial)
-    return db_historial
+    return len(registros)
 
 
 def update_historial_repuesto(db: Session, historial_id: int, historial: HistorialRepuestoUpdate) -> Optional[HistorialRepuestos]:
     """Actualizar historial existente"""
-    db_historial = db.query(HistorialRepuestos).filter(HistorialRepuestos.id == historial_id).first()
+    db_historial = db.get(HistorialRepuestos, historial_id)
     if db_historial:
+        update_data = historial.model_dump(exclude_unset=True)
+        
         # Si se actualiza la cantidad usada, ajustar el stock
-        if 'cantidad_usada' in historial.model_dump(exclude_unset=True):
+        if 'cantidad_usada' in update_data:
             diferencia = historial.cantidad_usada - db_historial.cantidad_usada
-            repuesto = db.query(Repuestos).filter(Repuestos.id == db_historial.repuesto_id).first()
-            if repuesto:
-                if repuesto.cantidad < diferencia:
-                    raise ValueError(f"Stock insuficiente para el ajuste. Disponible: {repuesto.cantidad}")
-                repuesto.cantidad -= diferencia
+            if diferencia:
+                # Ajuste atómico: solo descuenta si hay stock suficiente
+                result = db.execute(
+                    update(Repuestos)
+                    .where(Repuestos.id == db_historial.repuesto_id, Repuestos.cantidad >= diferencia)
+                    .values(cantidad=Repuestos.cantidad - diferencia)
+                )
+                if result.rowcount == 0:
+                    disponible = db.query(Repuestos.cantidad).filter(Repuestos.id == db_historial.repuesto_id).scalar()
+                    if disponible is not None:
+                        raise ValueError(f"Stock insuficiente para el ajuste. Disponible: {disponible}")
         
-        update_data = historial.model_dump(exclude_unset=True)
         for field, value in update_data.items():
             setattr(db_historial, field, value)
         
         db.commit()
-        db.refresh(db_historial)
     return db_historial
 
 
 def delete_historial_repuesto(db: Session, historial_id: int) -> bool:
     """Eliminar historial y restaurar stock"""
-    db_historial = db.query(HistorialRepuestos).filter(HistorialRepuestos.id == historial_id).first()
-    if db_historial:
-        # Restaurar stock al repuesto
-        repuesto = db.query(Repuestos).filter(Repuestos.id == db_historial.repuesto_id).first()
-        if repuesto:
-            repuesto.cantidad += db_historial.cantidad_usada
-        
-        db.delete(db_historial)
-        db.commit()
-        return True
-    return False
+    eliminado = db.execute(
+        delete(HistorialRepuestos)
+        .where(HistorialRepuestos.id == historial_id)
+        .returning(HistorialRepuestos.repuesto_id, HistorialRepuestos.cantidad_usada)
+    ).first()
+    if not eliminado:
+        return False
+    
+    # Restaurar stock al repuesto en la misma transacción
+    db.execute(
+        update(Repuestos)
+        .where(Repuestos.id == eliminado.repuesto_id)
+        .values(cantidad=Repuestos.cantidad + eliminado.cantidad_usada)
+    )
+    db.commit()
+    return True
 
 
 def get_consumo_por_repuesto(db: Session, repuesto_id: int, fecha_inicio: date = None, fecha_fin: date = None) -> dict:
-    """Obtener estadísticas de consumo por repuesto"""
-    query = db.query(HistorialRepuestos).filter(HistorialRepuestos.repuesto_id == repuesto_id)
+    """Obtener estadísticas de consumo por repuesto (agregadas en la base de datos)"""
+    query = db.query(
+        func.sum(HistorialRepuestos.cantidad_usada),
+        func.count(HistorialRepuestos.id),
+        func.avg(HistorialRepuestos.cantidad_usada)
+    ).filter(HistorialRepuestos.repuesto_id == repuesto_id)
     
     if fecha_inicio:
         query = query.filter(HistorialRepuestos.fecha >= fecha_inicio)
     if fecha_fin:
         query = query.filter(HistorialRepuestos.fecha <= fecha_fin)
     
-    registros = query.all()
+    total_usado, usos, promedio = query.one()
     
     return {
-        "total_usado": sum(r.cantidad_usada for r in registros),
-        "usos": len(registros),
-        "promedio_por_uso": sum(r.cantidad_usada for r in registros) / len(registros) if registros else 0
-    }
\ No newline at end of file
+        "total_usado": total_usado or 0,
+        "usos": usos,
+        "promedio_por_uso": float(promedio) if promedio is not None else 0
+    }
@@ -2,62 +2,89 @@
 Operaciones CRUD para Máquinas
 """
 from typing import List, Optional
-from sqlalchemy.orm import Session, joinedload
-from models.models import Maquinas
+from cachetools import TTLCache
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session, joinedload, selectinload
+from models.models import HistorialRepuestos, Maquinas
 from schemas.schemas import MaquinaCreate, MaquinaUpdate
+from crud.cache import adjuntar, copia_desacoplada
+
+# Caché de máquinas por número de serie
+_maquina_serie_cache = TTLCache(maxsize=1024, ttl=300)
 
 
 def get_maquinas(db: Session, skip: int = 0, limit: int = 100) -> List[Maquinas]:
     """Obtener lista de máquinas con paginación incluyendo modelo"""
-    return db.query(Maquinas).options(joinedload(Maquinas.modelo)).offset(skip).limit(limit).all()
+    return db.scalars(select(Maquinas).options(joinedload(Maquinas.modelo)).offset(skip).limit(limit)).all()
 
 
 def get_maquina(db: Session, maquina_id: int) -> Optional[Maquinas]:
     """Obtener máquina por ID incluyendo modelo"""
-    return db.query(Maquinas).options(joinedload(Maquinas.modelo)).filter(Maquinas.id == maquina_id).first()
+    return db.get(Maquinas, maquina_id, options=[joinedload(Maquinas.modelo)])
 
 
 def get_maquina_by_numero_serie(db: Session, numero_serie: str) -> Optional[Maquinas]:
-    """Obtener máquina por número de serie"""
-    return db.query(Maquinas).filter(Maquinas.numero_serie == numero_serie).first()
+    """Obtener máquina por número de serie (con caché en memoria)"""
+    cacheado = _maquina_serie_cache.get(numero_serie)
+    if cacheado is not None:
+        return adjuntar(db, cacheado)
+    db_maquina = db.scalars(select(Maquinas).where(Maquinas.numero_serie == numero_serie)).first()
+    if db_maquina:
+        _maquina_serie_cache[numero_serie] = copia_desacoplada(db_maquina)
+    return db_maquina
 
 
 def get_maquina_by_alias(db: Session, alias: str) -> Optional[Maquinas]:
     """Obtener máquina por alias"""
-    return db.query(Maquinas).options(joinedload(Maquinas.modelo)).filter(Maquinas.alias == alias).first()
+    return db.scalars(select(Maquinas).options(joinedload(Maquinas.modelo)).where(Maquinas.alias == alias)).first()
 
 
 def get_maquinas_by_modelo(db: Session, modelo_id: int) -> List[Maquinas]:
     """Obtener máquinas por modelo"""
-    return db.query(Maquinas).options(joinedload(Maquinas.modelo)).filter(Maquinas.modelo_id == modelo_id).all()
+    return db.scalars(select(Maquinas).options(joinedload(Maquinas.modelo)).where(Maquinas.modelo_id == modelo_id)).all()
+
+
+def get_maquinas_with_historial(db: Session, modelo_id: Optional[int] = None) -> List[Maquinas]:
+    """Obtener máquinas con modelo (JOIN) e historial de repuestos (consulta IN separada)"""
+    stmt = select(Maquinas).options(
+        joinedload(Maquinas.modelo),
+        selectinload(Maquinas.historial_repuestos).joinedload(HistorialRepuestos.repuesto)
+    )
+    if modelo_id is not None:
+        stmt = stmt.where(Maquinas.modelo_id == modelo_id)
+    return db.scalars(stmt).all()
 
 
 def create_maquina(db: Session, maquina: MaquinaCreate) -> Maquinas:
     """Crear nueva máquina"""
-    db_maquina = Maquinas(**maquina.model_dump())
-    db.add(db_maquina)
+    # INSERT ... RETURNING: el registro completo vuelve en el mismo viaje
+    db_maquina = db.execute(
+        insert(Maquinas).values(**maquina.model_dump()).returning(Maquinas)
+    ).scalar_one()
     db.commit()
-    db.refresh(db_maquina)
     return db_maquina
 
 
 def update_maquina(db: Session, maquina_id: int, maquina: MaquinaUpdate) -> Optional[Maquinas]:
     """Actualizar máquina existente"""
-    db_maquina = db.query(Maquinas).filter(Maquinas.id == maquina_id).first()
+    db_maquina = db.get(Maquinas, maquina_id)
     if db_maquina:
+        serie_anterior = db_maquina.numero_serie
         update_data = maquina.model_dump(exclude_unset=True)
         for field, value in update_data.items():
             setattr(db_maquina, field, value)
         db.commit()
-        db.refresh(db_maquina)
+        _maquina_serie_cache.pop(serie_anterior, None)
     return db_maquina
 
 
 def delete_maquina(db: Session, maquina_id: int) -> bool:
     """Eliminar máquina"""
-    db_maquina = db.query(Maquinas).filter(Maquinas.id == maquina_id).first()
+    db_maquina = db.get(Maquinas, maquina_id)
     if db_maquina:
+        serie = db_maquina.numero_serie
         db.delete(db_maquina)
         db.commit()
+        _maquina_serie_cache.pop(serie, None)
         return True
     return False
\ No newline at end of file
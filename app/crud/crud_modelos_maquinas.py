@@ -2,55 +2,69 @@
 Operaciones CRUD para Modelos de Máquinas
 """
 from typing import List, Optional
+from sqlalchemy import insert, select
+from cachetools import TTLCache
 from sqlalchemy.orm import Session
 from models.models import ModelosMaquinas
 from schemas.schemas import ModeloMaquinaCreate, ModeloMaquinaUpdate
+from crud.cache import adjuntar, copia_desacoplada
+
+# Caché de modelos por id (datos de referencia que casi no cambian)
+_modelo_cache = TTLCache(maxsize=1024, ttl=300)
 
 
 def get_modelos_maquinas(db: Session, skip: int = 0, limit: int = 100) -> List[ModelosMaquinas]:
     """Obtener lista de modelos de máquinas con paginación"""
-    return db.query(ModelosMaquinas).offset(skip).limit(limit).all()
+    return db.scalars(select(ModelosMaquinas).offset(skip).limit(limit)).all()
 
 
 def get_modelo_maquina(db: Session, modelo_id: int) -> Optional[ModelosMaquinas]:
-    """Obtener modelo de máquina por ID"""
-    return db.query(ModelosMaquinas).filter(ModelosMaquinas.id == modelo_id).first()
+    """Obtener modelo de máquina por ID (con caché en memoria)"""
+    cacheado = _modelo_cache.get(modelo_id)
+    if cacheado is not None:
+        return adjuntar(db, cacheado)
+    db_modelo = db.get(ModelosMaquinas, modelo_id)
+    if db_modelo:
+        _modelo_cache[modelo_id] = copia_desacoplada(db_modelo)
+    return db_modelo
 
 
 def get_modelo_by_fabricante_modelo(db: Session, fabricante: str, modelo: str) -> Optional[ModelosMaquinas]:
     """Obtener modelo por fabricante y modelo"""
-    return db.query(ModelosMaquinas).filter(
+    return db.scalars(select(ModelosMaquinas).where(
         ModelosMaquinas.fabricante == fabricante,
         ModelosMaquinas.modelo == modelo
-    ).first()
+    )).first()
 
 
 def create_modelo_maquina(db: Session, modelo: ModeloMaquinaCreate) -> ModelosMaquinas:
     """Crear nuevo modelo de máquina"""
-    db_modelo = ModelosMaquinas(**modelo.model_dump())
-    db.add(db_modelo)
+    # INSERT ... RETURNING: el registro completo vuelve en el mismo viaje
+    db_modelo = db.execute(
+        insert(ModelosMaquinas).values(**modelo.model_dump()).returning(ModelosMaquinas)
+    ).scalar_one()
     db.commit()
-    db.refresh(db_modelo)
     return db_modelo
 
 
 def update_modelo_maquina(db: Session, modelo_id: int, modelo: ModeloMaquinaUpdate) -> Optional[ModelosMaquinas]:
     """Actualizar modelo de máquina existente"""
-    db_modelo = db.query(ModelosMaquinas).filter(ModelosMaquinas.id == modelo_id).first()
+    db_modelo = db.get(ModelosMaquinas, modelo_id)
     if db_modelo:
         update_data = modelo.model_dump(exclude_unset=True)
         for field, value in update_data.items():
             setattr(db_modelo, field, value)
         db.commit()
-        db.refresh(db_modelo)
+        _modelo_cache.pop(modelo_id, None)
     return db_modelo
 
 
 def delete_modelo_maquina(db: Session, modelo_id: int) -> bool:
     """Eliminar modelo de máquina"""
-    db_modelo = db.query(ModelosMaquinas).filter(ModelosMaquinas.id == modelo_id).first()
+    db_modelo = db.get(ModelosMaquinas, modelo_id)
     if db_modelo:
         db.delete(db_modelo)
         db.commit()
+        _modelo_cache.pop(modelo_id, None)
         return True
     return False
\ No newline at end of file
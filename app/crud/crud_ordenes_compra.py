@@ -1,35 +1,219 @@
 """
 Operaciones CRUD para Órdenes de Compra
 """
+import logging
 from typing import List, Optional
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import func, and_
+from cachetools import TTLCache
+from sqlalchemy.orm import Session, joinedload, load_only, noload, selectinload, undefer
+from sqlalchemy.orm.interfaces import MANYTOONE
+from sqlalchemy import and_, bindparam, delete, func, inspect, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from models.models import (
     OrdenesCompra, 
     ItemsOrdenCompra, 
     DocumentosOrden, 
     Repuestos,
-    Proveedores
+    Proveedores,
+    Almacenamientos
 )
 from schemas.schemas import (
     OrdenCompraCreate, 
     OrdenCompraUpdate, 
+    OrdenCompraResponse,
     ItemOrdenCreate,
     ItemOrdenUpdate,
+    ItemOrdenResponse,
+    DocumentoOrdenResponse,
+    RepuestoResponse,
+    ProveedorResponse,
+    AlmacenamientoResponse,
     ConfirmarLlegadaRequest
 )
 
+logger = logging.getLogger(__name__)
+
+# Estadísticas de órdenes: toleran unos segundos de desfase y se invalidan
+# cuando se crea, modifica o elimina una orden
+_estadisticas_cache = TTLCache(maxsize=1, ttl=5)
+
+
+# Transiciones de estado permitidas para las órdenes de compra (frozenset: pertenencia O(1))
+TRANSICIONES_ESTADO = {
+    'borrador': frozenset({'cotizado'}),
+    'cotizado': frozenset({'confirmado'}),
+    'confirmado': frozenset({'completado'}),
+    'completado': frozenset()  # No se puede cambiar desde completado
+}
+
+# Estados desde los que se puede llegar a cada estado (para validar en el WHERE del UPDATE)
+_ESTADOS_PREVIOS = {
+    siguiente: frozenset(previo for previo, siguientes in TRANSICIONES_ESTADO.items() if siguiente in siguientes)
+    for siguiente in frozenset().union(*TRANSICIONES_ESTADO.values())
+}
+
+# Estados en los que la orden ya no admite eliminación ni cambios en sus items
+ESTADOS_NO_EDITABLES = ('confirmado', 'completado')
+
 
 # === ÓRDENES DE COMPRA ===
 
-def get_ordenes_compra(db: Session, skip: int = 0, limit: int = 100, estado: Optional[str] = None) -> List[OrdenesCompra]:
-    """Obtener lista de órdenes de compra con paginación y filtro por estado"""
-    query = db.query(OrdenesCompra).options(
-        joinedload(OrdenesCompra.proveedor),
-        joinedload(OrdenesCompra.usuario_creador),
-        joinedload(OrdenesCompra.items).joinedload(ItemsOrdenCompra.repuesto),
-        joinedload(OrdenesCompra.documentos)
-    )
+# Relaciones de la orden que serializa OrdenCompraResponse
+RELACIONES_ORDEN = ("proveedor", "items", "documentos")
+
+# El listado no trae los documentos por defecto: expone solo documentos_count
+RELACIONES_LISTADO = ("proveedor", "items")
+
+
+# Consulta precompilada: se construye una sola vez y reutiliza la entrada de la caché de compilación
+_ORDEN_POR_REQUISICION = select(OrdenesCompra).where(
+    OrdenesCompra.numero_requisicion == bindparam('numero_requisicion')
+)
+
+
+# Esquema de respuesta de cada entidad alcanzable desde fields: define las columnas y
+# relaciones que se pueden pedir y las que se devuelven cuando no se eligen columnas
+_ESQUEMAS_CAMPOS = {
+    OrdenesCompra: OrdenCompraResponse,
+    ItemsOrdenCompra: ItemOrdenResponse,
+    DocumentosOrden: DocumentoOrdenResponse,
+    Repuestos: RepuestoResponse,
+    Proveedores: ProveedorResponse,
+    Almacenamientos: AlmacenamientoResponse,
+}
+
+
+def arbol_campos(fields: str, entidad=OrdenesCompra) -> dict:
+    """Convertir fields en un árbol {columna: None, relación: {...}} validado contra los esquemas.
+
+    fields es una lista separada por comas de rutas con puntos, por ejemplo
+    "id,estado,proveedor.nombre,items.cantidad_pedida,items.repuesto.codigo".
+    Una relación sin subcampos se devuelve completa (como en su esquema de respuesta) y
+    un nivel sin columnas pedidas devuelve todas sus columnas. El id se incluye siempre.
+    """
+    arbol = {}
+    for ruta in fields.split(","):
+        nodo = arbol
+        for parte in ruta.split("."):
+            if parte.strip():
+                nodo = nodo.setdefault(parte.strip(), {})
+    return _completar_arbol(entidad, arbol, "")
+
+
+def _completar_arbol(entidad, arbol: dict, prefijo: str) -> dict:
+    """Validar un nivel del árbol de campos y completar las columnas por defecto"""
+    esquema = _ESQUEMAS_CAMPOS[entidad]
+    relaciones = inspect(entidad).relationships
+    desconocidos = [nombre for nombre in arbol if nombre not in esquema.model_fields]
+    if desconocidos:
+        permitidos = ", ".join(prefijo + nombre for nombre in esquema.model_fields)
+        raise ValueError(
+            f"Campos no válidos: {', '.join(prefijo + nombre for nombre in desconocidos)}. Permitidos: {permitidos}"
+        )
+    
+    if not arbol:
+        # Relación pedida sin subcampos: todo lo que serializa su esquema
+        arbol = {nombre: {} for nombre in esquema.model_fields}
+    elif all(nombre in relaciones for nombre in arbol):
+        arbol = {**{nombre: {} for nombre in esquema.model_fields if nombre not in relaciones}, **arbol}
+    
+    completo = {"id": None}
+    for nombre, subcampos in arbol.items():
+        if nombre in relaciones:
+            completo[nombre] = _completar_arbol(
+                relaciones[nombre].mapper.class_, subcampos, f"{prefijo}{nombre}."
+            )
+        elif subcampos:
+            raise ValueError(f"{prefijo}{nombre} no es una relación")
+        else:
+            completo[nombre] = None
+    return completo
+
+
+def _opciones_campos(entidad, arbol: dict) -> list:
+    """load_only con las columnas del árbol y una carga (con sus propias columnas) por relación"""
+    mapper = inspect(entidad)
+    columnas = [getattr(entidad, nombre) for nombre, subcampos in arbol.items() if subcampos is None]
+    opciones = []
+    for nombre, subcampos in arbol.items():
+        if subcampos is None:
+            continue
+        relacion = mapper.relationships[nombre]
+        if relacion.direction is MANYTOONE:
+            # La clave foránea debe cargarse para asociar el objeto relacionado
+            columnas.extend(
+                getattr(entidad, mapper.get_property_by_column(columna).key)
+                for columna in relacion.local_columns
+            )
+        # Colecciones en consultas IN separadas; relaciones a-uno en la misma consulta
+        cargador = selectinload if relacion.uselist else joinedload
+        opciones.append(
+            cargador(getattr(entidad, nombre)).options(*_opciones_campos(relacion.mapper.class_, subcampos))
+        )
+    return [load_only(*columnas)] + opciones
+
+
+def _proyectar(obj, arbol: dict) -> dict:
+    """Diccionario con solo los campos del árbol (los que cargó _opciones_campos)"""
+    datos = {}
+    for nombre, subcampos in arbol.items():
+        valor = getattr(obj, nombre)
+        if subcampos is None:
+            datos[nombre] = valor
+        elif isinstance(valor, list):
+            datos[nombre] = [_proyectar(elemento, subcampos) for elemento in valor]
+        else:
+            datos[nombre] = None if valor is None else _proyectar(valor, subcampos)
+    return datos
+
+
+def proyectar_ordenes(ordenes: List[OrdenesCompra], fields: str) -> List[dict]:
+    """Serializar las órdenes obtenidas con fields devolviendo solo los campos pedidos"""
+    arbol = arbol_campos(fields)
+    return [_proyectar(orden, arbol) for orden in ordenes]
+
+
+def _opciones_carga_orden(fields: Optional[str] = None, por_defecto: tuple = RELACIONES_ORDEN) -> list:
+    """Generar opciones de carga para la orden.
+
+    Sin fields se cargan todas las columnas y las relaciones de por_defecto (las demás
+    no se cargan; usuario_creador nunca, la respuesta solo expone usuario_creador_id).
+    Con fields solo se leen las columnas y relaciones pedidas (ver arbol_campos).
+    """
+    if fields:
+        return _opciones_campos(OrdenesCompra, arbol_campos(fields))
+    
+    opciones = []
+    if "proveedor" in por_defecto:
+        opciones.append(joinedload(OrdenesCompra.proveedor))
+    else:
+        opciones.append(noload(OrdenesCompra.proveedor))
+    
+    if "items" in por_defecto:
+        # RepuestoResponse serializa proveedor y almacenamiento: cargarlos en la misma consulta de items
+        opciones.append(
+            selectinload(OrdenesCompra.items).joinedload(ItemsOrdenCompra.repuesto).options(
+                joinedload(Repuestos.proveedor),
+                joinedload(Repuestos.almacenamiento)
+            )
+        )
+    else:
+        opciones.append(noload(OrdenesCompra.items))
+    
+    if "documentos" in por_defecto:
+        opciones.append(selectinload(OrdenesCompra.documentos))
+    else:
+        opciones.append(noload(OrdenesCompra.documentos))
+    
+    # Subconsulta escalar en la misma consulta de la orden (la respuesta siempre la serializa)
+    opciones.append(undefer(OrdenesCompra.documentos_count))
+    
+    return opciones
+
+
+def get_ordenes_compra(db: Session, skip: int = 0, limit: int = 100, estado: Optional[str] = None,
+                       fields: Optional[str] = None) -> List[OrdenesCompra]:
+    """Obtener lista de órdenes de compra con paginación y filtro por estado (sin documentos salvo que se pidan)"""
+    query = db.query(OrdenesCompra).options(*_opciones_carga_orden(fields, RELACIONES_LISTADO))
     
     if estado:
         query = query.filter(OrdenesCompra.estado == estado)
@@ -37,23 +221,30 @@ def get_ordenes_compra(db: Session, skip: int = 0, limit: int = 100, estado: Opt
     return query.order_by(OrdenesCompra.fecha_creacion.desc()).offset(skip).limit(limit).all()
 
 
-def get_orden_compra(db: Session, orden_id: int) -> Optional[OrdenesCompra]:
-    """Obtener orden de compra por ID con todas las relaciones"""
+def get_orden_compra(db: Session, orden_id: int, fields: Optional[str] = None) -> Optional[OrdenesCompra]:
+    """Obtener orden de compra por ID con las relaciones pedidas (por defecto todas)"""
     return db.query(OrdenesCompra).options(
-        joinedload(OrdenesCompra.proveedor),
-        joinedload(OrdenesCompra.usuario_creador),
-        joinedload(OrdenesCompra.items).joinedload(ItemsOrdenCompra.repuesto),
-        joinedload(OrdenesCompra.documentos)
+        *_opciones_carga_orden(fields)
     ).filter(OrdenesCompra.id == orden_id).first()
 
 
 def get_orden_by_numero_requisicion(db: Session, numero_requisicion: str) -> Optional[OrdenesCompra]:
     """Obtener orden por número de requisición"""
-    return db.query(OrdenesCompra).filter(OrdenesCompra.numero_requisicion == numero_requisicion).first()
+    return db.scalars(_ORDEN_POR_REQUISICION, {'numero_requisicion': numero_requisicion}).first()
 
 
 def create_orden_compra(db: Session, orden: OrdenCompraCreate, usuario_id: int) -> OrdenesCompra:
     """Crear nueva orden de compra con items"""
+    # El índice único (orden_id, codigo_manual) de items manuales rechazaría el INSERT por lotes:
+    # validar antes para responder 400 en lugar de un IntegrityError
+    codigos_manuales = set()
+    for item_data in orden.items:
+        codigo = getattr(item_data, 'codigo_manual', None)
+        if getattr(item_data, 'es_item_manual', False) and codigo:
+            if codigo in codigos_manuales:
+                raise ValueError(f"Código de item manual duplicado en la orden: '{codigo}'")
+            codigos_manuales.add(codigo)
+    
     db_orden = OrdenesCompra(
         proveedor_id=orden.proveedor_id,
         observaciones=orden.observaciones,
@@ -64,41 +255,39 @@ def create_orden_compra(db: Session, orden: OrdenCompraCreate, usuario_id: int)
     db.add(db_orden)
     db.flush()  # Para obtener el ID antes del commit
     
-    # Crear items de la orden
-    for item_data in orden.items:
-        db_item = ItemsOrdenCompra(
-            orden_id=db_orden.id,
-            repuesto_id=item_data.repuesto_id,
-            cantidad_pedida=item_data.cantidad_pedida,
-            descripcion_aduana=item_data.descripcion_aduana,
-            precio_unitario=item_data.precio_unitario,
+    # Crear items de la orden en un único INSERT ... VALUES (...), (...) (insertmanyvalues de psycopg2)
+    items_rows = [
+        {
+            "orden_id": db_orden.id,
+            "repuesto_id": item_data.repuesto_id,
+            "cantidad_pedida": item_data.cantidad_pedida,
+            "descripcion_aduana": item_data.descripcion_aduana,
+            "precio_unitario": item_data.precio_unitario,
             # Campos para items manuales
-            es_item_manual=getattr(item_data, 'es_item_manual', False),
-            nombre_manual=getattr(item_data, 'nombre_manual', None),
-            codigo_manual=getattr(item_data, 'codigo_manual', None),
-            detalle_manual=getattr(item_data, 'detalle_manual', None),
-            cantidad_minima_manual=getattr(item_data, 'cantidad_minima_manual', None)
-        )
-        db.add(db_item)
+            "es_item_manual": getattr(item_data, 'es_item_manual', False),
+            "nombre_manual": getattr(item_data, 'nombre_manual', None),
+            "codigo_manual": getattr(item_data, 'codigo_manual', None),
+            "detalle_manual": getattr(item_data, 'detalle_manual', None),
+            "cantidad_minima_manual": getattr(item_data, 'cantidad_minima_manual', None)
+        }
+        for item_data in orden.items
+    ]
+    if items_rows:
+        db.execute(pg_insert(ItemsOrdenCompra), items_rows)
     
     db.commit()
-    db.refresh(db_orden)
+    _estadisticas_cache.clear()
     
-    # Cargar relaciones
+    # Una única consulta carga las relaciones de la orden (los items se insertaron fuera del ORM)
     return get_orden_compra(db, db_orden.id)
 
 
 def update_orden_compra(db: Session, orden_id: int, orden: OrdenCompraUpdate) -> Optional[OrdenesCompra]:
-    """Actualizar orden de compra"""
-    db_orden = db.query(OrdenesCompra).filter(OrdenesCompra.id == orden_id).first()
-    if not db_orden:
-        return None
+    """Actualizar orden de compra con un UPDATE condicional que valida la transición de estado"""
+    condiciones = [OrdenesCompra.id == orden_id]
     
     # Validar cambios de estado
     if orden.estado:
-        if not _validar_cambio_estado(db_orden.estado, orden.estado):
-            raise ValueError(f"Cambio de estado no válido: {db_orden.estado} -> {orden.estado}")
-        
         # Si cambia a cotizado, debe tener numero_requisicion
         if orden.estado == 'cotizado' and not orden.numero_requisicion:
             raise ValueError("Debe proporcionar un número de requisición para cambiar a estado 'cotizado'")
@@ -106,29 +295,48 @@ def update_orden_compra(db: Session, orden_id: int, orden: OrdenCompraUpdate) ->
         # Si cambia a confirmado, debe tener legajo
         if orden.estado == 'confirmado' and not orden.legajo:
             raise ValueError("Debe proporcionar un legajo para cambiar a estado 'confirmado'")
+        
+        # La transición se valida en el propio WHERE: solo actualiza si el estado actual la permite
+        condiciones.append(OrdenesCompra.estado.in_(_ESTADOS_PREVIOS.get(orden.estado, ())))
     
     # Actualizar campos
     update_data = orden.model_dump(exclude_unset=True)
-    for field, value in update_data.items():
-        setattr(db_orden, field, value)
-    
-    db.commit()
-    db.refresh(db_orden)
+    if update_data:
+        result = db.execute(update(OrdenesCompra).where(*condiciones).values(**update_data))
+        if result.rowcount == 0:
+            db.rollback()
+            # Distinguir orden inexistente de transición inválida solo en el camino de error
+            estado_actual = db.scalar(select(OrdenesCompra.estado).where(OrdenesCompra.id == orden_id))
+            if estado_actual is None:
+                return None
+            raise ValueError(f"Cambio de estado no válido: {estado_actual} -> {orden.estado}")
+        
+        db.commit()
+        _estadisticas_cache.clear()
     
+    # Una única consulta recarga la orden con sus relaciones
     return get_orden_compra(db, orden_id)
 
 
 def delete_orden_compra(db: Session, orden_id: int) -> bool:
     """Eliminar orden de compra (solo si no está confirmada)"""
-    db_orden = db.query(OrdenesCompra).filter(OrdenesCompra.id == orden_id).first()
-    if not db_orden:
-        return False
+    eliminable = and_(OrdenesCompra.id == orden_id, OrdenesCompra.estado.notin_(ESTADOS_NO_EDITABLES))
+    orden_eliminable = select(OrdenesCompra.id).where(eliminable)
+    
+    # Items y documentos primero (sus FK no tienen ON DELETE CASCADE), solo si la orden es eliminable
+    db.execute(delete(ItemsOrdenCompra).where(ItemsOrdenCompra.orden_id.in_(orden_eliminable)))
+    db.execute(delete(DocumentosOrden).where(DocumentosOrden.orden_id.in_(orden_eliminable)))
+    result = db.execute(delete(OrdenesCompra).where(eliminable))
     
-    if db_orden.estado in ['confirmado', 'completado']:
+    if result.rowcount == 0:
+        db.rollback()
+        # Distinguir orden inexistente de orden bloqueada solo en el camino de error
+        if db.scalar(select(OrdenesCompra.id).where(OrdenesCompra.id == orden_id)) is None:
+            return False
         raise ValueError("No se pueden eliminar órdenes confirmadas o completadas")
     
-    db.delete(db_orden)
     db.commit()
+    _estadisticas_cache.clear()
     return True
 
 
@@ -143,30 +351,15 @@ def get_items_orden(db: Session, orden_id: int) -> List[ItemsOrdenCompra]:
 
 def add_item_orden(db: Session, orden_id: int, item: ItemOrdenCreate) -> Optional[ItemsOrdenCompra]:
     """Agregar item a una orden existente"""
-    # Verificar que la orden existe y está editable
-    orden = db.query(OrdenesCompra).filter(OrdenesCompra.id == orden_id).first()
-    if not orden:
+    # Verificar que la orden existe y está editable (solo se lee la columna estado)
+    estado = db.scalar(select(OrdenesCompra.estado).where(OrdenesCompra.id == orden_id))
+    if estado is None:
         return None
     
-    if orden.estado in ['confirmado', 'completado']:
+    if estado in ESTADOS_NO_EDITABLES:
         raise ValueError("No se pueden agregar items a órdenes confirmadas o completadas")
     
-    # Validar item manual
-    if item.es_item_manual:
-        if not item.nombre_manual or not item.codigo_manual:
-            raise ValueError("Items manuales requieren nombre y código")
-        
-        # Verificar que no existe otro item manual con el mismo código en la orden
-        existing_manual = db.query(ItemsOrdenCompra).filter(
-            ItemsOrdenCompra.orden_id == orden_id,
-            ItemsOrdenCompra.es_item_manual == True,
-            ItemsOrdenCompra.codigo_manual == item.codigo_manual
-        ).first()
-        
-        if existing_manual:
-            raise ValueError(f"Ya existe un item manual con código '{item.codigo_manual}' en esta orden")
-    
-    db_item = ItemsOrdenCompra(
+    valores = dict(
         orden_id=orden_id,
         repuesto_id=item.repuesto_id,
         cantidad_pedida=item.cantidad_pedida,
@@ -178,37 +371,55 @@ def add_item_orden(db: Session, orden_id: int, item: ItemOrdenCreate) -> Optiona
         detalle_manual=item.detalle_manual,
         cantidad_minima_manual=item.cantidad_minima_manual
     )
+    stmt = pg_insert(ItemsOrdenCompra).values(**valores)
+    
+    # Validar item manual
+    if item.es_item_manual:
+        if not item.nombre_manual or not item.codigo_manual:
+            raise ValueError("Items manuales requieren nombre y código")
+        
+        # El índice único parcial detecta el código repetido en la orden en el mismo INSERT
+        stmt = stmt.on_conflict_do_nothing(
+            index_elements=[ItemsOrdenCompra.orden_id, ItemsOrdenCompra.codigo_manual],
+            index_where=ItemsOrdenCompra.es_item_manual == True
+        )
+    
+    item_id = db.execute(stmt.returning(ItemsOrdenCompra.id)).scalar()
+    if item_id is None:
+        db.rollback()
+        raise ValueError(f"Ya existe un item manual con código '{item.codigo_manual}' en esta orden")
     
-    db.add(db_item)
     db.commit()
-    db.refresh(db_item)
     
+    # Una única consulta recarga el item con su repuesto
     return db.query(ItemsOrdenCompra).options(
         joinedload(ItemsOrdenCompra.repuesto)
-    ).filter(ItemsOrdenCompra.id == db_item.id).first()
+    ).filter(ItemsOrdenCompra.id == item_id).first()
 
 
 def update_item_orden(db: Session, item_id: int, item: ItemOrdenUpdate) -> Optional[ItemsOrdenCompra]:
     """Actualizar item de orden"""
-    db_item = db.query(ItemsOrdenCompra).filter(ItemsOrdenCompra.id == item_id).first()
+    db_item = db.get(ItemsOrdenCompra, item_id)
     if not db_item:
         return None
     
+    # Serializar una sola vez: se usa para validar y para aplicar los cambios
+    update_data = item.model_dump(exclude_unset=True)
+    
     # Verificar que la orden está editable (excepto para cantidad_recibida)
-    orden = db.query(OrdenesCompra).filter(OrdenesCompra.id == db_item.orden_id).first()
-    if orden.estado == 'confirmado':
+    estado = db.scalar(select(OrdenesCompra.estado).where(OrdenesCompra.id == db_item.orden_id))
+    if estado == 'confirmado':
         # Solo permitir actualizar cantidad_recibida
         restricted_fields = ['repuesto_id', 'cantidad_pedida', 'descripcion_aduana', 'precio_unitario']
-        if any(field in item.model_dump(exclude_unset=True) for field in restricted_fields):
+        if any(field in update_data for field in restricted_fields):
             raise ValueError("Solo se puede actualizar cantidad_recibida en órdenes en estado 'confirmado'")
     
-    update_data = item.model_dump(exclude_unset=True)
     for field, value in update_data.items():
         setattr(db_item, field, value)
     
     db.commit()
-    db.refresh(db_item)
     
+    # Una única consulta recarga el item con su repuesto
     return db.query(ItemsOrdenCompra).options(
         joinedload(ItemsOrdenCompra.repuesto)
     ).filter(ItemsOrdenCompra.id == item_id).first()
@@ -216,16 +427,22 @@ def update_item_orden(db: Session, item_id: int, item: ItemOrdenUpdate) -> Optio
 
 def delete_item_orden(db: Session, item_id: int) -> bool:
     """Eliminar item de orden"""
-    db_item = db.query(ItemsOrdenCompra).filter(ItemsOrdenCompra.id == item_id).first()
-    if not db_item:
-        return False
+    # Un único DELETE que además verifica que la orden está editable
+    result = db.execute(
+        delete(ItemsOrdenCompra).where(
+            ItemsOrdenCompra.id == item_id,
+            ItemsOrdenCompra.orden_id.in_(
+                select(OrdenesCompra.id).where(OrdenesCompra.estado.notin_(ESTADOS_NO_EDITABLES))
+            )
+        )
+    )
     
-    # Verificar que la orden está editable
-    orden = db.query(OrdenesCompra).filter(OrdenesCompra.id == db_item.orden_id).first()
-    if orden.estado in ['confirmado', 'completado']:
+    if result.rowcount == 0:
+        db.rollback()
+        if db.scalar(select(ItemsOrdenCompra.id).where(ItemsOrdenCompra.id == item_id)) is None:
+            return False
         raise ValueError("No se pueden eliminar items de órdenes confirmadas o completadas")
     
-    db.delete(db_item)
     db.commit()
     return True
 
@@ -251,15 +468,16 @@ def add_documento_orden(db: Session, orden_id: int, nombre_archivo: str, ruta_ar
     return db_documento
 
 
-def delete_documento_orden(db: Session, documento_id: int) -> bool:
-    """Eliminar documento de orden"""
-    db_documento = db.query(DocumentosOrden).filter(DocumentosOrden.id == documento_id).first()
-    if not db_documento:
-        return False
+def delete_documento_orden(db: Session, documento_id: int) -> Optional[str]:
+    """Eliminar documento de orden y devolver la ruta de su archivo (None si no existe)"""
+    ruta_archivo = db.execute(
+        delete(DocumentosOrden).where(DocumentosOrden.id == documento_id).returning(DocumentosOrden.ruta_archivo)
+    ).scalar()
+    if ruta_archivo is None:
+        return None
     
-    db.delete(db_documento)
     db.commit()
-    return True
+    return ruta_archivo
 
 
 # === FUNCIONES ESPECIALES ===
@@ -275,180 +493,173 @@ def confirmar_llegada_repuestos(db: Session, orden_id: int, llegada: ConfirmarLl
     
     try:
         # Actualizar cantidades recibidas y agregar al inventario
-        print(f"Procesando {len(llegada.items_recibidos)} items recibidos para orden {orden_id}")
+        logger.debug("Procesando %s items recibidos para orden %s", len(llegada.items_recibidos), orden_id)
+        
+        # Los items (con su repuesto) ya vienen cargados con la orden
+        items_orden = {item.id: item for item in orden.items}
         
-        for item_recibido in llegada.items_recibidos:
-            # Manejar tanto dict como object
-            if isinstance(item_recibido, dict):
-                item_id = item_recibido.get('item_id')
-                cantidad_recibida = item_recibido.get('cantidad_recibida', 0)
-            else:
-                item_id = getattr(item_recibido, 'item_id', None)
-                cantidad_recibida = getattr(item_recibido, 'cantidad_recibida', 0)
+        # Sin autoflush: la consulta de repuestos no debe vaciar la sesión a mitad del proceso
+        # (la sesión de la app ya usa autoflush=False, pero la función no depende de ello)
+        with db.no_autoflush:
+            items_con_llegada = []
+            for item_recibido in llegada.items_recibidos:
+                # Los items ya llegan validados como ItemRecibido desde el esquema
+                item_id = item_recibido.item_id
+                cantidad_recibida = item_recibido.cantidad_recibida
+            
+                logger.debug("Procesando item %s con cantidad %s", item_id, cantidad_recibida)
             
-            print(f"Procesando item {item_id} con cantidad {cantidad_recibida}")
+                # Actualizar item de la orden
+                db_item = items_orden.get(item_id)
+                if not db_item:
+                    logger.warning("Item %s no encontrado en la orden %s", item_id, orden_id)
+                    continue
             
-            # Actualizar item de la orden
-            db_item = db.query(ItemsOrdenCompra).filter(ItemsOrdenCompra.id == item_id).first()
-            if not db_item:
-                print(f"WARNING: Item {item_id} no encontrado en la orden")
-                continue
+                logger.debug(
+                    "Item encontrado: %s, es_manual: %s, repuesto_id: %s, cantidad pedida: %s",
+                    db_item.id, db_item.es_item_manual, db_item.repuesto_id, db_item.cantidad_pedida
+                )
+                db_item.cantidad_recibida = cantidad_recibida
+                if cantidad_recibida > 0:
+                    items_con_llegada.append((db_item, cantidad_recibida))
             
-            print(f"Item encontrado: {db_item.id}, es_manual: {db_item.es_item_manual}, repuesto_id: {db_item.repuesto_id}")
-            try:
-                print(f"  --> Descripción aduana: {db_item.descripcion_aduana}")
-                print(f"  --> Cantidad pedida: {db_item.cantidad_pedida}")
-            except Exception as e:
-                print(f"  --> ERROR al acceder a propiedades del item: {e}")
-            if db_item.es_item_manual:
-                print(f"  --> Datos manuales - Código: {db_item.codigo_manual}, Nombre: {db_item.nombre_manual}")
-                print(f"  --> Detalle manual: {db_item.detalle_manual}")
-                print(f"  --> Cantidad mínima manual: {db_item.cantidad_minima_manual}")
-            db_item.cantidad_recibida = cantidad_recibida
+            # Repuestos existentes para los códigos de items manuales en una sola consulta
+            codigos_manuales = {
+                db_item.codigo_manual for db_item, _ in items_con_llegada
+                if db_item.es_item_manual and db_item.codigo_manual
+            }
+            repuestos_por_codigo = {}
+            if codigos_manuales:
+                repuestos_por_codigo = {
+                    r.codigo: r for r in db.query(Repuestos).filter(Repuestos.codigo.in_(codigos_manuales))
+                }
             
-            if cantidad_recibida > 0:
-                if db_item.es_item_manual:
-                    # Para items manuales, crear nuevo repuesto o buscar existente por código
-                    if not db_item.codigo_manual or not db_item.nombre_manual:
-                        print(f"ERROR: Item manual {item_id} no tiene código ({db_item.codigo_manual}) o nombre ({db_item.nombre_manual})")
-                        continue
-                    
-                    repuesto_existente = None
-                    if db_item.codigo_manual:
-                        repuesto_existente = db.query(Repuestos).filter(
-                            Repuestos.codigo == db_item.codigo_manual
-                        ).first()
-                    
-                    if repuesto_existente:
-                        # Actualizar repuesto existente
-                        repuesto_existente.cantidad += cantidad_recibida
-                        print(f"Agregando {cantidad_recibida} unidades al repuesto existente {repuesto_existente.codigo}")
-                    else:
-                        # Crear nuevo repuesto desde item manual
-                        print(f"Creando nuevo repuesto: código={db_item.codigo_manual}, nombre={db_item.nombre_manual}")
-                        nuevo_repuesto = Repuestos(
-                            codigo=db_item.codigo_manual,
-                            nombre=db_item.nombre_manual,
-                            detalle=db_item.detalle_manual or '',
-                            cantidad=cantidad_recibida,
-                            cantidad_minima=db_item.cantidad_minima_manual,
-                            proveedor_id=orden.proveedor_id,
-                            descripcion_aduana=db_item.descripcion_aduana  # Guardar descripción de aduana
-                        )
-                        print(f"ANTES DE db.add() - Repuesto: {nuevo_repuesto.codigo}")
-                        db.add(nuevo_repuesto)
-                        print(f"DESPUÉS DE db.add() - Antes de flush()")
-                        db.flush()  # Para obtener el ID
-                        print(f"DESPUÉS DE flush() - Nuevo repuesto ID: {nuevo_repuesto.id}")
-                        
-                        # Vincular el item con el nuevo repuesto
-                        db_item.repuesto_id = nuevo_repuesto.id
-                        print(f"CREADO Y VINCULADO repuesto ID:{nuevo_repuesto.id}, Código:{nuevo_repuesto.codigo} con {cantidad_recibida} unidades")
-                        
-                elif db_item.repuesto_id:
-                    # Para items con repuesto existente
-                    repuesto = db.query(Repuestos).filter(Repuestos.id == db_item.repuesto_id).first()
-                    if repuesto:
-                        repuesto.cantidad += cantidad_recibida
-                        print(f"Agregando {cantidad_recibida} unidades al repuesto {repuesto.codigo}")
-                    else:
-                        print(f"WARNING: Repuesto con ID {db_item.repuesto_id} no encontrado")
-                else:
-                    # Item sin repuesto_id y no manual - crear repuesto automáticamente
-                    print(f"WARNING: Item {item_id} no tiene repuesto_id ni es manual - creando repuesto automático")
-                    
-                    # Generar código único basado en timestamp y orden
-                    import time
-                    codigo_generado = f"AUTO-{orden_id}-{item_id}-{int(time.time())}"
-                    
-                    # Usar descripción aduana si existe, sino crear nombre genérico
-                    nombre_repuesto = f"Item de orden {orden_id}"
-                    detalle_repuesto = f"Creado automáticamente desde orden {orden_id}, item {item_id}"
-                    
-                    if hasattr(db_item, 'descripcion_aduana') and db_item.descripcion_aduana:
-                        nombre_repuesto = db_item.descripcion_aduana
-                        detalle_repuesto += f" - Descripción: {db_item.descripcion_aduana}"
-                        print(f"  --> Usando descripción aduana: {db_item.descripcion_aduana}")
-                    else:
-                        print(f"  --> Sin descripción aduana, usando nombre genérico")
-                    
-                    # Crear nuevo repuesto
-                    nuevo_repuesto = Repuestos(
-                        codigo=codigo_generado,
-                        nombre=nombre_repuesto,
-                        detalle=detalle_repuesto,
-                        cantidad=cantidad_recibida,
-                        proveedor_id=orden.proveedor_id,
-                        descripcion_aduana=db_item.descripcion_aduana  # Guardar descripción de aduana
-                    )
-                    print(f"ANTES DE db.add() - Repuesto automático: {nuevo_repuesto.codigo}")
-                    db.add(nuevo_repuesto)
-                    print(f"DESPUÉS DE db.add() - Antes de flush() automático")
-                    db.flush()  # Para obtener el ID
-                    print(f"DESPUÉS DE flush() - Nuevo repuesto automático ID: {nuevo_repuesto.id}")
-                    
-                    # Vincular el item con el nuevo repuesto
-                    db_item.repuesto_id = nuevo_repuesto.id
-                    print(f"CREADO repuesto automático ID:{nuevo_repuesto.id}, Código:{nuevo_repuesto.codigo}, Nombre:{nuevo_repuesto.nombre} con {cantidad_recibida} unidades")
+            # Los cambios se acumulan en la sesión y se envían en un único flush al hacer commit
+            for db_item, cantidad_recibida in items_con_llegada:
+                _ensure_repuesto(db, db_item, orden, cantidad_recibida, repuestos_por_codigo)
         
         # Cambiar estado de la orden a completado
         orden.estado = 'completado'
         
-        print(f"ANTES DEL COMMIT - Orden {orden_id} estado: {orden.estado}")
         db.commit()
-        db.refresh(orden)
-        print(f"DESPUÉS DEL COMMIT - Orden {orden_id} completada exitosamente")
+        _estadisticas_cache.clear()
+        logger.debug("Orden %s completada exitosamente", orden_id)
         
-        # Verificar repuestos después del commit
-        print("=== VERIFICACIÓN FINAL DE REPUESTOS ===")
-        total_repuestos = db.query(Repuestos).count()
-        print(f"Total de repuestos después de confirmar llegada: {total_repuestos}")
+        # Verificación de repuestos solo cuando el nivel DEBUG está activo (evita un COUNT por llamada)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Total de repuestos después de confirmar llegada: %s", db.query(Repuestos).count())
         
         return get_orden_compra(db, orden_id)
         
     except Exception as e:
         db.rollback()
-        print(f"ERROR en confirmar_llegada_repuestos: {e}")
+        logger.error("Error en confirmar_llegada_repuestos para orden %s: %s", orden_id, e)
         raise e
 
 
-def reset_orden_estado(db: Session, orden_id: int, nuevo_estado: str) -> Optional[OrdenesCompra]:
+def reset_orden_estado(db: Session, orden_id: int, nuevo_estado: str) -> bool:
     """Función temporal para resetear el estado de una orden para pruebas"""
-    orden = db.query(OrdenesCompra).filter(OrdenesCompra.id == orden_id).first()
-    if orden:
-        orden.estado = nuevo_estado
-        db.commit()
-        db.refresh(orden)
-        print(f"Orden {orden_id} cambiada a estado: {nuevo_estado}")
-    return orden
+    result = db.execute(
+        update(OrdenesCompra).where(OrdenesCompra.id == orden_id).values(estado=nuevo_estado)
+    )
+    db.commit()
+    if result.rowcount == 0:
+        return False
+    
+    _estadisticas_cache.clear()
+    logger.info("Orden %s cambiada a estado: %s", orden_id, nuevo_estado)
+    return True
 
 
 def get_estadisticas_ordenes(db: Session) -> dict:
-    """Obtener estadísticas de órdenes de compra"""
-    total = db.query(OrdenesCompra).count()
-    borradores = db.query(OrdenesCompra).filter(OrdenesCompra.estado == 'borrador').count()
-    cotizados = db.query(OrdenesCompra).filter(OrdenesCompra.estado == 'cotizado').count()
-    confirmados = db.query(OrdenesCompra).filter(OrdenesCompra.estado == 'confirmado').count()
-    completados = db.query(OrdenesCompra).filter(OrdenesCompra.estado == 'completado').count()
+    """Obtener estadísticas de órdenes de compra (cacheadas unos segundos)"""
+    estadisticas = _estadisticas_cache.get('ordenes')
+    if estadisticas is None:
+        estadisticas = _estadisticas_cache['ordenes'] = _calcular_estadisticas_ordenes(db)
+    return dict(estadisticas)
+
+
+def _calcular_estadisticas_ordenes(db: Session) -> dict:
+    """Calcular estadísticas de órdenes de compra (un único GROUP BY por estado)"""
+    conteos = dict(
+        db.query(OrdenesCompra.estado, func.count(OrdenesCompra.id)).group_by(OrdenesCompra.estado).all()
+    )
     
     return {
-        'total': total,
-        'borradores': borradores,
-        'cotizados': cotizados,
-        'confirmados': confirmados,
-        'completados': completados
+        'total': sum(conteos.values()),
+        'borradores': conteos.get('borrador', 0),
+        'cotizados': conteos.get('cotizado', 0),
+        'confirmados': conteos.get('confirmado', 0),
+        'completados': conteos.get('completado', 0)
     }
 
 
 # === FUNCIONES PRIVADAS ===
 
-def _validar_cambio_estado(estado_actual: str, nuevo_estado: str) -> bool:
-    """Validar que el cambio de estado es válido"""
-    transiciones_validas = {
-        'borrador': ['cotizado'],
-        'cotizado': ['confirmado'],
-        'confirmado': ['completado'],
-        'completado': []  # No se puede cambiar desde completado
-    }
+def _ensure_repuesto(db: Session, db_item: ItemsOrdenCompra, orden: OrdenesCompra, cantidad_recibida: int,
+                     repuestos_por_codigo: dict) -> Optional[Repuestos]:
+    """Sumar la cantidad recibida al repuesto del item, creándolo y vinculándolo si no existe.
+
+    Los repuestos nuevos solo se agregan a la sesión; sus IDs se asignan en el
+    flush del commit. Devuelve None si el item no puede asociarse a un repuesto.
+    """
+    if db_item.es_item_manual:
+        # Para items manuales, crear nuevo repuesto o buscar existente por código
+        if not db_item.codigo_manual or not db_item.nombre_manual:
+            logger.error(
+                "Item manual %s no tiene código (%s) o nombre (%s)",
+                db_item.id, db_item.codigo_manual, db_item.nombre_manual
+            )
+            return None
+        repuesto = repuestos_por_codigo.get(db_item.codigo_manual)
+        datos_nuevo = dict(
+            codigo=db_item.codigo_manual,
+            nombre=db_item.nombre_manual,
+            detalle=db_item.detalle_manual or '',
+            cantidad_minima=db_item.cantidad_minima_manual
+        )
+    elif db_item.repuesto_id:
+        # Para items con repuesto existente
+        repuesto = db_item.repuesto
+        if not repuesto:
+            logger.warning("Repuesto con ID %s no encontrado", db_item.repuesto_id)
+            return None
+        datos_nuevo = None
+    else:
+        # Item sin repuesto_id y no manual - crear repuesto automáticamente
+        logger.warning("Item %s no tiene repuesto_id ni es manual - creando repuesto automático", db_item.id)
+        repuesto = None
+        
+        # El par (orden, item) ya es único; la restricción UNIQUE de repuestos.codigo lo garantiza en la base
+        codigo_generado = f"AUTO-{orden.id}-{db_item.id}"
+        
+        # Usar descripción aduana si existe, sino crear nombre genérico
+        nombre_repuesto = f"Item de orden {orden.id}"
+        detalle_repuesto = f"Creado automáticamente desde orden {orden.id}, item {db_item.id}"
+        if db_item.descripcion_aduana:
+            nombre_repuesto = db_item.descripcion_aduana
+            detalle_repuesto += f" - Descripción: {db_item.descripcion_aduana}"
+        
+        datos_nuevo = dict(codigo=codigo_generado, nombre=nombre_repuesto, detalle=detalle_repuesto)
     
-    return nuevo_estado in transiciones_validas.get(estado_actual, [])
\ No newline at end of file
+    if repuesto:
+        repuesto.cantidad += cantidad_recibida
+        logger.debug("Agregando %s unidades al repuesto %s", cantidad_recibida, repuesto.codigo)
+        return repuesto
+    
+    nuevo_repuesto = Repuestos(
+        **datos_nuevo,
+        cantidad=cantidad_recibida,
+        proveedor_id=orden.proveedor_id,
+        descripcion_aduana=db_item.descripcion_aduana  # Guardar descripción de aduana
+    )
+    db.add(nuevo_repuesto)
+    repuestos_por_codigo[nuevo_repuesto.codigo] = nuevo_repuesto
+    
+    # Vincular el item con el nuevo repuesto (el ID se asigna en el flush)
+    db_item.repuesto = nuevo_repuesto
+    logger.debug(
+        "Creado y vinculado repuesto %s, Nombre:%s con %s unidades",
+        nuevo_repuesto.codigo, nuevo_repuesto.nombre, cantidad_recibida
+    )
+    return nuevo_repuesto
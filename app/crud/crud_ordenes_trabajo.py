@@ -1,12 +1,14 @@
 """
 CRUD operations for ordenes de trabajo de mantenimiento
 """
-from typing import List, Optional, Dict, Any
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import and_, or_, desc, asc, text
-from datetime import datetime, date
+from typing import List, Optional, Dict, Any, Tuple
+from cachetools import TTLCache
+from sqlalchemy.orm import Session, joinedload, noload, raiseload, selectinload, undefer
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy import and_, or_, desc, asc, delete, exists, func, select, tuple_, update
+from datetime import date
 
-from models.models import OrdenesTrabajoMantenimiento, ComentariosOT, Maquinas, Usuarios, ArchivosOT, ArchivosComentarioOT
+from models.models import OrdenesTrabajoMantenimiento, ComentariosOT, ContadoresOT, Maquinas, Usuarios, ArchivosOT, ArchivosComentarioOT
 from schemas.schemas import (
     OrdenTrabajoCreate, 
     OrdenTrabajoUpdate,
@@ -14,18 +16,75 @@ from schemas.schemas import (
 )
 
 
+# Estadísticas del tablero: se invalidan al crear, modificar o eliminar una OT
+_stats_cache = TTLCache(maxsize=1, ttl=30)
+
+# Relaciones de la OT: JOIN solo para las relaciones a-uno; las colecciones van en
+# consultas IN separadas para no multiplicar filas (comentarios x archivos)
+OPCIONES_CARGA_OT = (
+    joinedload(OrdenesTrabajoMantenimiento.maquina).joinedload(Maquinas.modelo),
+    joinedload(OrdenesTrabajoMantenimiento.usuario_asignado),
+    joinedload(OrdenesTrabajoMantenimiento.usuario_creador),
+    selectinload(OrdenesTrabajoMantenimiento.comentarios).joinedload(ComentariosOT.usuario),
+    selectinload(OrdenesTrabajoMantenimiento.comentarios).selectinload(ComentariosOT.archivos).joinedload(ArchivosComentarioOT.usuario),
+    selectinload(OrdenesTrabajoMantenimiento.archivos).joinedload(ArchivosOT.usuario),
+    undefer(OrdenesTrabajoMantenimiento.n_comentarios),
+    # Cualquier otra relación de la OT falla en lugar de hacer una carga perezosa (N+1)
+    raiseload('*')
+)
+
+# Listados: solo relaciones a-uno y la cantidad de comentarios (subconsulta en la misma consulta)
+OPCIONES_RESUMEN_OT = (
+    joinedload(OrdenesTrabajoMantenimiento.maquina).joinedload(Maquinas.modelo),
+    joinedload(OrdenesTrabajoMantenimiento.usuario_asignado),
+    joinedload(OrdenesTrabajoMantenimiento.usuario_creador),
+    noload(OrdenesTrabajoMantenimiento.comentarios),
+    noload(OrdenesTrabajoMantenimiento.archivos),
+    undefer(OrdenesTrabajoMantenimiento.n_comentarios),
+    raiseload('*')
+)
+
+# Comentario con su autor y archivos (el resto de relaciones no se carga de forma perezosa)
+OPCIONES_CARGA_COMENTARIO = (
+    joinedload(ComentariosOT.usuario),
+    selectinload(ComentariosOT.archivos).joinedload(ArchivosComentarioOT.usuario),
+    raiseload('*')
+)
+
+# Valores contados en las estadísticas
+ESTADOS_OT = ("pendiente", "en_proceso", "completada", "cancelada")
+CRITICIDADES_OT = ("baja", "media", "alta", "critica")
+
+
+def _ordenar_keyset(query, columna, order_direction: str, after: Optional[Tuple[Any, int]]):
+    """Ordenar por (columna, id) y, si hay cursor, continuar después de after = (valor, id).
+
+    La condición (columna, id) < after recorre el índice compuesto como un rango,
+    sin descartar filas como OFFSET.
+    """
+    clave = tuple_(columna, OrdenesTrabajoMantenimiento.id)
+    if order_direction == "desc":
+        if after is not None:
+            query = query.filter(clave < tuple_(*after))
+        return query.order_by(desc(columna), desc(OrdenesTrabajoMantenimiento.id))
+    if after is not None:
+        query = query.filter(clave > tuple_(*after))
+    return query.order_by(asc(columna), asc(OrdenesTrabajoMantenimiento.id))
+
+
+def _filtro_vencidas():
+    """Condición de OT vencida: fecha programada pasada y aún abierta"""
+    return and_(
+        OrdenesTrabajoMantenimiento.fecha_programada < date.today(),
+        OrdenesTrabajoMantenimiento.estado.in_(["pendiente", "en_proceso"])
+    )
+
+
 class CRUDOrdenTrabajo:
     def get(self, db: Session, id: int) -> Optional[OrdenesTrabajoMantenimiento]:
         """Obtener una orden de trabajo por ID con relaciones cargadas"""
         return db.query(OrdenesTrabajoMantenimiento)\
-            .options(
-                joinedload(OrdenesTrabajoMantenimiento.maquina).joinedload(Maquinas.modelo),
-                joinedload(OrdenesTrabajoMantenimiento.usuario_asignado),
-                joinedload(OrdenesTrabajoMantenimiento.usuario_creador),
-                joinedload(OrdenesTrabajoMantenimiento.comentarios).joinedload(ComentariosOT.usuario),
-                joinedload(OrdenesTrabajoMantenimiento.comentarios).joinedload(ComentariosOT.archivos).joinedload(ArchivosComentarioOT.usuario),
-                joinedload(OrdenesTrabajoMantenimiento.archivos).joinedload(ArchivosOT.usuario)
-            )\
+            .options(*OPCIONES_CARGA_OT)\
             .filter(OrdenesTrabajoMantenimiento.id == id)\
             .first()
 
@@ -43,23 +102,22 @@ class CRUDOrdenTrabajo:
         fecha_inicio: Optional[date] = None,
         fecha_fin: Optional[date] = None,
         order_by: str = "fecha_creacion",
-        order_direction: str = "desc"
+        order_direction: str = "desc",
+        after: Optional[Tuple[Any, int]] = None,
+        opciones: tuple = OPCIONES_CARGA_OT
     ) -> List[OrdenesTrabajoMantenimiento]:
-        """Obtener múltiples órdenes de trabajo con filtros"""
+        """Obtener múltiples órdenes de trabajo con filtros.
+
+        Con order_by por fecha, after = (fecha, id) del último elemento de la página
+        anterior activa la paginación por cursor (keyset) y se ignora skip.
+        """
         
         query = db.query(OrdenesTrabajoMantenimiento)\
-            .options(
-                joinedload(OrdenesTrabajoMantenimiento.maquina).joinedload(Maquinas.modelo),
-                joinedload(OrdenesTrabajoMantenimiento.usuario_asignado),
-                joinedload(OrdenesTrabajoMantenimiento.usuario_creador),
-                joinedload(OrdenesTrabajoMantenimiento.comentarios).joinedload(ComentariosOT.usuario),
-                joinedload(OrdenesTrabajoMantenimiento.comentarios).joinedload(ComentariosOT.archivos).joinedload(ArchivosComentarioOT.usuario),
-                joinedload(OrdenesTrabajoMantenimiento.archivos).joinedload(ArchivosOT.usuario)
-            )
+            .options(*opciones)
         
         # Filtro de búsqueda por título o descripción
         if search:
-            search_filter = f"%{search.lower()}%"
+            search_filter = f"%{search}%"
             query = query.filter(
                 or_(
                     OrdenesTrabajoMantenimiento.titulo.ilike(search_filter),
@@ -95,61 +153,48 @@ class CRUDOrdenTrabajo:
             query = query.filter(OrdenesTrabajoMantenimiento.fecha_programada <= fecha_fin)
         
         # Ordenamiento
-        if order_direction == "desc":
-            if order_by == "fecha_creacion":
-                query = query.order_by(desc(OrdenesTrabajoMantenimiento.fecha_creacion))
-            elif order_by == "fecha_programada":
-                query = query.order_by(desc(OrdenesTrabajoMantenimiento.fecha_programada))
-            elif order_by == "nivel_criticidad":
-                # Ordenar por criticidad: critica > alta > media > baja
-                query = query.order_by(
-                    desc(text("CASE WHEN nivel_criticidad = 'critica' THEN 4 "
-                             "WHEN nivel_criticidad = 'alta' THEN 3 "
-                             "WHEN nivel_criticidad = 'media' THEN 2 "
-                             "WHEN nivel_criticidad = 'baja' THEN 1 "
-                             "ELSE 0 END"))
-                )
-        else:
-            if order_by == "fecha_creacion":
-                query = query.order_by(asc(OrdenesTrabajoMantenimiento.fecha_creacion))
-            elif order_by == "fecha_programada":
-                query = query.order_by(asc(OrdenesTrabajoMantenimiento.fecha_programada))
-            elif order_by == "nivel_criticidad":
-                query = query.order_by(
-                    asc(text("CASE WHEN nivel_criticidad = 'baja' THEN 1 "
-                            "WHEN nivel_criticidad = 'media' THEN 2 "
-                            "WHEN nivel_criticidad = 'alta' THEN 3 "
-                            "WHEN nivel_criticidad = 'critica' THEN 4 "
-                            "ELSE 5 END"))
-                )
+        if order_by in ("fecha_creacion", "fecha_programada"):
+            columna = getattr(OrdenesTrabajoMantenimiento, order_by)
+            query = _ordenar_keyset(query, columna, order_direction, after)
+            if after is not None:
+                return query.limit(limit).all()
+        elif order_by == "nivel_criticidad":
+            # Ordenar por criticidad (critica > alta > media > baja) con la columna generada indexada
+            query = _ordenar_keyset(query, OrdenesTrabajoMantenimiento.criticidad_orden, order_direction, None)
         
         return query.offset(skip).limit(limit).all()
 
+    def get_multi_summary(self, db: Session, **filtros) -> List[OrdenesTrabajoMantenimiento]:
+        """Obtener órdenes de trabajo para listados: sin comentarios ni archivos, con n_comentarios.
+
+        Acepta los mismos filtros que get_multi; el detalle (get) mantiene todas las relaciones.
+        """
+        return self.get_multi(db, opciones=OPCIONES_RESUMEN_OT, **filtros)
+
     def get_by_user(
         self,
         db: Session,
         usuario_id: int,
         estado: Optional[str] = None,
         skip: int = 0,
-        limit: int = 100
+        limit: int = 100,
+        after: Optional[Tuple[Any, int]] = None
     ) -> List[OrdenesTrabajoMantenimiento]:
-        """Obtener órdenes de trabajo asignadas a un usuario específico"""
+        """Obtener órdenes de trabajo asignadas a un usuario específico.
+
+        after = (fecha_programada, id) del último elemento recibido pagina por cursor e ignora skip.
+        """
         
         query = db.query(OrdenesTrabajoMantenimiento)\
-            .options(
-                joinedload(OrdenesTrabajoMantenimiento.maquina).joinedload(Maquinas.modelo),
-                joinedload(OrdenesTrabajoMantenimiento.usuario_creador),
-                joinedload(OrdenesTrabajoMantenimiento.usuario_asignado),
-                joinedload(OrdenesTrabajoMantenimiento.comentarios).joinedload(ComentariosOT.usuario),
-                joinedload(OrdenesTrabajoMantenimiento.comentarios).joinedload(ComentariosOT.archivos).joinedload(ArchivosComentarioOT.usuario),
-                joinedload(OrdenesTrabajoMantenimiento.archivos).joinedload(ArchivosOT.usuario)
-            )\
+            .options(*OPCIONES_CARGA_OT)\
             .filter(OrdenesTrabajoMantenimiento.usuario_asignado_id == usuario_id)
         
         if estado:
             query = query.filter(OrdenesTrabajoMantenimiento.estado == estado)
         
-        query = query.order_by(desc(OrdenesTrabajoMantenimiento.fecha_programada))
+        query = _ordenar_keyset(query, OrdenesTrabajoMantenimiento.fecha_programada, "desc", after)
+        if after is not None:
+            return query.limit(limit).all()
         
         return query.offset(skip).limit(limit).all()
 
@@ -174,12 +219,18 @@ class CRUDOrdenTrabajo:
             estado="pendiente"
         )
         
+        # El INSERT devuelve con RETURNING el id y los valores calculados por la base
+        # (fecha_creacion, criticidad_orden); con expire_on_commit=False no hace falta refresh
         db.add(db_obj)
         db.commit()
-        db.refresh(db_obj)
+        _stats_cache.clear()
         
-        # Cargar relaciones
-        return self.get(db, id=db_obj.id)
+        # Una OT recién creada no tiene comentarios ni archivos: no hace falta consultarlos.
+        # Máquina y usuarios (a-uno, por clave primaria) se cargan al serializar la respuesta
+        set_committed_value(db_obj, 'comentarios', [])
+        set_committed_value(db_obj, 'archivos', [])
+        set_committed_value(db_obj, 'n_comentarios', 0)
+        return db_obj
 
     def update(
         self, 
@@ -190,69 +241,108 @@ class CRUDOrdenTrabajo:
     ) -> OrdenesTrabajoMantenimiento:
         """Actualizar una orden de trabajo"""
         
-        update_data = obj_in.dict(exclude_unset=True)
+        update_data = obj_in.model_dump(exclude_unset=True)
         
-        # Manejar cambio de estado con timestamps
+        # Manejar cambio de estado con timestamps (hora de la base de datos, como fecha_creacion)
         if "estado" in update_data:
             nuevo_estado = update_data["estado"]
             if nuevo_estado == "en_proceso" and db_obj.fecha_inicio is None:
-                update_data["fecha_inicio"] = datetime.utcnow()
+                update_data["fecha_inicio"] = func.now()
             elif nuevo_estado == "completada" and db_obj.fecha_finalizacion is None:
-                update_data["fecha_finalizacion"] = datetime.utcnow()
-        
-        for field, value in update_data.items():
-            setattr(db_obj, field, value)
+                update_data["fecha_finalizacion"] = func.now()
+        
+        # UPDATE directo solo con las columnas recibidas (sin pasar por el flush de la sesión);
+        # RETURNING devuelve la fila con los valores de la base (func.now(), criticidad_orden)
+        fila = None
+        if update_data:
+            fila = db.execute(
+                update(OrdenesTrabajoMantenimiento)
+                .where(OrdenesTrabajoMantenimiento.id == db_obj.id)
+                .values(**update_data)
+                .returning(*OrdenesTrabajoMantenimiento.__table__.c)
+                .execution_options(synchronize_session=False)
+            ).first()
         
-        db.add(db_obj)
         db.commit()
-        db.refresh(db_obj)
+        if fila is not None:
+            for columna, valor in fila._mapping.items():
+                set_committed_value(db_obj, columna, valor)
+            self._recargar_relaciones(db, db_obj, update_data)
+        _stats_cache.clear()
         
-        return self.get(db, id=db_obj.id)
+        return db_obj
 
-    def delete(self, db: Session, *, id: int) -> OrdenesTrabajoMantenimiento:
-        """Eliminar una orden de trabajo"""
-        obj = db.query(OrdenesTrabajoMantenimiento).get(id)
-        db.delete(obj)
+    def _recargar_relaciones(self, db: Session, db_obj: OrdenesTrabajoMantenimiento, update_data: Dict[str, Any]) -> None:
+        """Actualizar las relaciones a-uno cuyas claves foráneas cambiaron en el UPDATE"""
+        if "maquina_id" in update_data:
+            maquina = db.get(Maquinas, db_obj.maquina_id, options=[joinedload(Maquinas.modelo)])
+            set_committed_value(db_obj, 'maquina', maquina)
+        if "usuario_asignado_id" in update_data:
+            set_committed_value(db_obj, 'usuario_asignado', db.get(Usuarios, db_obj.usuario_asignado_id))
+
+    def delete(self, db: Session, *, id: int) -> bool:
+        """Eliminar una orden de trabajo con sus comentarios y archivos (sin cargarlos)"""
+        comentarios_ot = select(ComentariosOT.id).where(ComentariosOT.orden_trabajo_id == id)
+        db.execute(delete(ArchivosComentarioOT).where(ArchivosComentarioOT.comentario_id.in_(comentarios_ot)))
+        db.execute(delete(ComentariosOT).where(ComentariosOT.orden_trabajo_id == id))
+        db.execute(delete(ArchivosOT).where(ArchivosOT.orden_trabajo_id == id))
+        eliminado = db.execute(
+            delete(OrdenesTrabajoMantenimiento)
+            .where(OrdenesTrabajoMantenimiento.id == id)
+            .returning(OrdenesTrabajoMantenimiento.id)
+        ).first()
+        if not eliminado:
+            db.rollback()
+            return False
         db.commit()
-        return obj
+        _stats_cache.clear()
+        return True
 
     def get_stats(self, db: Session) -> Dict[str, Any]:
-        """Obtener estadísticas de órdenes de trabajo"""
-        
-        stats = {}
-        
-        # Contar por estado
-        estados = ["pendiente", "en_proceso", "completada", "cancelada"]
-        for estado in estados:
-            count = db.query(OrdenesTrabajoMantenimiento)\
-                .filter(OrdenesTrabajoMantenimiento.estado == estado)\
-                .count()
-            stats[f"total_{estado}"] = count
-        
-        # Contar por criticidad
-        criticidades = ["baja", "media", "alta", "critica"]
-        for criticidad in criticidades:
-            count = db.query(OrdenesTrabajoMantenimiento)\
-                .filter(OrdenesTrabajoMantenimiento.nivel_criticidad == criticidad)\
-                .count()
-            stats[f"total_{criticidad}"] = count
-        
-        # Total general
-        stats["total_general"] = db.query(OrdenesTrabajoMantenimiento).count()
-        
-        # OTs vencidas (fecha programada pasada y no completadas)
-        from datetime import date
-        hoy = date.today()
-        stats["total_vencidas"] = db.query(OrdenesTrabajoMantenimiento)\
-            .filter(
-                and_(
-                    OrdenesTrabajoMantenimiento.fecha_programada < hoy,
-                    OrdenesTrabajoMantenimiento.estado.in_(["pendiente", "en_proceso"])
-                )
-            ).count()
+        """Obtener estadísticas de órdenes de trabajo (cacheadas hasta 30 segundos)"""
+        stats = _stats_cache.get('stats')
+        if stats is None:
+            stats = _stats_cache['stats'] = self._calcular_stats(db)
+        return dict(stats)
+
+    def _calcular_stats(self, db: Session) -> Dict[str, Any]:
+        """Calcular estadísticas: conteos desde ot_contadores (trigger) y vencidas por índice parcial"""
+        
+        contadores = dict(db.execute(select(ContadoresOT.clave, ContadoresOT.valor)).all())
+        if "total" not in contadores:
+            # Sin trigger/recálculo (create_ot_counters no se ejecutó o falló): contar desde la tabla
+            contadores = self._contar_desde_tabla(db)
+        stats = {f"total_{estado}": contadores.get(f"estado:{estado}", 0) for estado in ESTADOS_OT}
+        stats.update({
+            f"total_{criticidad}": contadores.get(f"criticidad:{criticidad}", 0)
+            for criticidad in CRITICIDADES_OT
+        })
+        stats["total_general"] = contadores.get("total", 0)
+        
+        # OTs vencidas (fecha programada pasada y no completadas): depende del día, no se
+        # puede mantener con el trigger; usa el índice parcial ix_ot_abiertas_fecha_programada
+        stats["total_vencidas"] = db.query(func.count(OrdenesTrabajoMantenimiento.id)).filter(
+            _filtro_vencidas()
+        ).scalar()
         
         return stats
 
+    def _contar_desde_tabla(self, db: Session) -> Dict[str, int]:
+        """Contadores con las mismas claves que ot_contadores, agregados en una única consulta"""
+        OT = OrdenesTrabajoMantenimiento
+        columnas = [func.count().label("total")] + [
+            func.count().filter(OT.estado == estado).label(f"estado:{estado}")
+            for estado in ESTADOS_OT
+        ] + [
+            func.count().filter(OT.nivel_criticidad == criticidad).label(f"criticidad:{criticidad}")
+            for criticidad in CRITICIDADES_OT
+        ]
+        return dict(db.query(*columnas).select_from(OT).one()._mapping)
+
+    def has_vencidas(self, db: Session) -> bool:
+        """Indicar si existe alguna OT vencida (EXISTS se detiene en la primera fila)"""
+        return db.query(exists().where(_filtro_vencidas())).scalar()
+
 
 class CRUDComentarioOT:
     def create(
@@ -270,28 +360,19 @@ class CRUDComentarioOT:
             comentario=obj_in.comentario
         )
         
+        # id y fecha_creacion vuelven en el RETURNING del INSERT (sin refresh)
         db.add(db_obj)
         db.commit()
-        db.refresh(db_obj)
         
-        # Cargar relaciones con usuario y archivos
-        db_obj = db.query(ComentariosOT)\
-            .options(
-                joinedload(ComentariosOT.usuario),
-                joinedload(ComentariosOT.archivos).joinedload(ArchivosComentarioOT.usuario)
-            )\
-            .filter(ComentariosOT.id == db_obj.id)\
-            .first()
+        # Un comentario recién creado no tiene archivos; el autor se carga por clave primaria
+        set_committed_value(db_obj, 'archivos', [])
         
         return db_obj
 
     def get(self, db: Session, id: int) -> Optional[ComentariosOT]:
         """Obtener un comentario por ID"""
         return db.query(ComentariosOT)\
-            .options(
-                joinedload(ComentariosOT.usuario),
-                joinedload(ComentariosOT.archivos).joinedload(ArchivosComentarioOT.usuario)
-            )\
+            .options(*OPCIONES_CARGA_COMENTARIO)\
             .filter(ComentariosOT.id == id)\
             .first()
 
@@ -303,10 +384,7 @@ class CRUDComentarioOT:
         """Obtener comentarios de una orden de trabajo"""
         
         return db.query(ComentariosOT)\
-            .options(
-                joinedload(ComentariosOT.usuario),
-                joinedload(ComentariosOT.archivos).joinedload(ArchivosComentarioOT.usuario)
-            )\
+            .options(*OPCIONES_CARGA_COMENTARIO)\
             .filter(ComentariosOT.orden_trabajo_id == orden_trabajo_id)\
             .order_by(desc(ComentariosOT.fecha_creacion))\
             .all()
@@ -2,8 +2,9 @@
 Operaciones CRUD para Proveedores
 """
 from typing import List, Optional
+from sqlalchemy import delete, func, update
 from sqlalchemy.orm import Session
-from models.models import Proveedores
+from models.models import Proveedores, Repuestos
 from schemas.schemas import ProveedorCreate, ProveedorUpdate
 
 
@@ -18,8 +19,8 @@ def get_proveedor(db: Session, proveedor_id: int) -> Optional[Proveedores]:
 
 
 def get_proveedor_by_nombre(db: Session, nombre: str) -> Optional[Proveedores]:
-    """Obtener proveedor por nombre"""
-    return db.query(Proveedores).filter(Proveedores.nombre == nombre).first()
+    """Obtener proveedor por nombre (sin distinguir mayúsculas, usa el índice sobre lower(nombre))"""
+    return db.query(Proveedores).filter(func.lower(Proveedores.nombre) == nombre.lower()).first()
 
 
 def create_proveedor(db: Session, proveedor: ProveedorCreate) -> Proveedores:
@@ -45,9 +46,18 @@ def update_proveedor(db: Session, proveedor_id: int, proveedor: ProveedorUpdate)
 
 def delete_proveedor(db: Session, proveedor_id: int) -> bool:
     """Eliminar proveedor"""
-    db_proveedor = db.query(Proveedores).filter(Proveedores.id == proveedor_id).first()
-    if db_proveedor:
-        db.delete(db_proveedor)
-        db.commit()
-        return True
-    return False
\ No newline at end of file
+    # Desvincular repuestos del proveedor (lo que hacía el ORM al eliminar) y borrar en un solo DELETE
+    db.execute(
+        update(Repuestos)
+        .where(Repuestos.proveedor_id == proveedor_id)
+        .values(proveedor_id=None)
+        .execution_options(synchronize_session=False)
+    )
+    eliminado = db.execute(
+        delete(Proveedores).where(Proveedores.id == proveedor_id).returning(Proveedores.id)
+    ).first()
+    if not eliminado:
+        db.rollback()
+        return False
+    db.commit()
+    return True
\ No newline at end of file
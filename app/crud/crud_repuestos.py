@@ -1,9 +1,10 @@
 """
 Operaciones CRUD para Repuestos
 """
-from typing import List, Optional
+from typing import Iterator, List, Optional
+from sqlalchemy import delete, func, literal, update
 from sqlalchemy.orm import Session, joinedload
-from models.models import Repuestos
+from models.models import ItemsOrdenCompra, Repuestos
 from schemas.schemas import RepuestoCreate, RepuestoUpdate
 
 
@@ -28,29 +29,23 @@ def get_repuesto_by_codigo(db: Session, codigo: str) -> Optional[Repuestos]:
     return db.query(Repuestos).filter(Repuestos.codigo == codigo).first()
 
 
-def get_repuestos_by_proveedor(db: Session, proveedor_id: int) -> List[Repuestos]:
-    """Obtener repuestos por proveedor"""
-    return db.query(Repuestos).options(
+def get_repuestos_by_proveedor(db: Session, proveedor_id: int, batch_size: int = 500) -> Iterator[Repuestos]:
+    """Recorrer repuestos por proveedor en lotes (cursor del servidor)"""
+    yield from db.query(Repuestos).options(
         joinedload(Repuestos.proveedor),
         joinedload(Repuestos.almacenamiento)
-    ).filter(Repuestos.proveedor_id == proveedor_id).all()
+    ).filter(Repuestos.proveedor_id == proveedor_id).yield_per(batch_size)
 
 
-def get_repuestos_bajo_stock(db: Session, cantidad_minima_default: int = 10) -> List[Repuestos]:
-    """Obtener repuestos con stock bajo usando cantidad mínima personalizada o default"""
-    from sqlalchemy import case, or_
-    
-    return db.query(Repuestos).options(
+def get_repuestos_bajo_stock(db: Session, cantidad_minima_default: int = 10, batch_size: int = 500) -> Iterator[Repuestos]:
+    """Recorrer en lotes los repuestos con stock bajo usando cantidad mínima personalizada o default"""
+    # cantidad <= COALESCE(cantidad_minima, default): el default se escribe como literal en el SQL
+    # para que coincida con el predicado del índice parcial ix_repuestos_bajo_stock (default 10)
+    umbral = func.coalesce(Repuestos.cantidad_minima, literal(cantidad_minima_default, literal_execute=True))
+    yield from db.query(Repuestos).options(
         joinedload(Repuestos.proveedor),
         joinedload(Repuestos.almacenamiento)
-    ).filter(
-        or_(
-            # Usar cantidad_minima personalizada si está definida
-            (Repuestos.cantidad_minima.isnot(None)) & (Repuestos.cantidad <= Repuestos.cantidad_minima),
-            # Usar cantidad_minima_default si no hay personalizada
-            (Repuestos.cantidad_minima.is_(None)) & (Repuestos.cantidad <= cantidad_minima_default)
-        )
-    ).all()
+    ).filter(Repuestos.cantidad <= umbral).yield_per(batch_size)
 
 
 def create_repuesto(db: Session, repuesto: RepuestoCreate) -> Repuestos:
@@ -86,9 +81,18 @@ def actualizar_stock(db: Session, repuesto_id: int, nueva_cantidad: int) -> Opti
 
 def delete_repuesto(db: Session, repuesto_id: int) -> bool:
     """Eliminar repuesto"""
-    db_repuesto = db.query(Repuestos).filter(Repuestos.id == repuesto_id).first()
-    if db_repuesto:
-        db.delete(db_repuesto)
-        db.commit()
-        return True
-    return False
\ No newline at end of file
+    # Desvincular items de órdenes de compra (lo que hacía el ORM al eliminar) y borrar en un solo DELETE
+    db.execute(
+        update(ItemsOrdenCompra)
+        .where(ItemsOrdenCompra.repuesto_id == repuesto_id)
+        .values(repuesto_id=None)
+        .execution_options(synchronize_session=False)
+    )
+    eliminado = db.execute(
+        delete(Repuestos).where(Repuestos.id == repuesto_id).returning(Repuestos.id)
+    ).first()
+    if not eliminado:
+        db.rollback()
+        return False
+    db.commit()
+    return True
\ No newline at end of file
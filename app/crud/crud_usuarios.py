@@ -1,38 +1,171 @@
 """
 Operaciones CRUD para gestión de usuarios, roles, permisos y páginas
 """
-from typing import Optional, List
+import asyncio
+import functools
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Tuple
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
-from sqlalchemy import or_, and_
+import bcrypt
+from cachetools import TTLCache
+from sqlalchemy.orm import Session, joinedload, load_only, selectinload
+from sqlalchemy import or_, and_, bindparam, case, func, insert, select, tuple_, update
 from passlib.context import CryptContext
 
-from models.models import Usuarios, Roles, Permisos, Paginas
+from models.models import Usuarios, Roles, Permisos, Paginas, roles_permisos, usuarios_paginas
 from schemas.schemas import (
     UsuarioCreate, UsuarioUpdate, 
     RolCreate, RolUpdate,
     PermisoCreate, PermisoUpdate,
     PaginaCreate, PaginaUpdate
 )
+from crud.cache import adjuntar, copia_desacoplada
+
+logger = logging.getLogger(__name__)
+# passlib 1.7.4 busca bcrypt.__about__ (eliminado en bcrypt 4.1) y registra el error como
+# advertencia aunque el backend funciona: silenciarlo para no ensuciar los logs
+logging.getLogger("passlib.handlers.bcrypt").setLevel(logging.ERROR)
+
+# Versión mínima del paquete bcrypt (backend nativo en Rust con las optimizaciones actuales)
+BCRYPT_VERSION_MINIMA = (4, 1)
+
+# Costo bcrypt mínimo: la calibración solo puede subirlo, nunca bajarlo
+BCRYPT_ROUNDS_MINIMO = 12
+
+def _calibrar_rounds(contexto: CryptContext, minimo: int = BCRYPT_ROUNDS_MINIMO, maximo: int = 14) -> int:
+    """Elegir el costo bcrypt más alto cuyo hash tarde como máximo BCRYPT_TARGET_MS en este servidor"""
+    objetivo_ms = float(os.getenv("BCRYPT_TARGET_MS", "250"))
+    inicio = time.perf_counter()
+    contexto.handler("bcrypt").using(rounds=minimo).hash("x")
+    duracion_ms = (time.perf_counter() - inicio) * 1000
+    # Cada round adicional duplica el tiempo: se extrapola en vez de medir cada costo
+    rounds = minimo
+    while rounds < maximo and duracion_ms * 2 <= objetivo_ms:
+        duracion_ms *= 2
+        rounds += 1
+    return rounds
+
+
+@functools.lru_cache(maxsize=1)
+def _pwd_ctx() -> CryptContext:
+    """Contexto para hash de contraseñas; se construye y calibra al arrancar la app (preparar_hash_passwords)"""
+    contexto = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__ident="2b")
+    
+    # Exigir el backend nativo (paquete bcrypt): el Blowfish en Python puro de passlib es
+    # órdenes de magnitud más lento y cada login/cambio de contraseña pagaría ese costo
+    backend = contexto.handler("bcrypt").get_backend()
+    if backend == "builtin":
+        raise RuntimeError("passlib está usando el backend bcrypt en Python puro; instale el paquete bcrypt")
+    version = tuple(int(parte) for parte in bcrypt.__version__.split(".")[:2])
+    if version < BCRYPT_VERSION_MINIMA:
+        logger.warning(
+            "bcrypt %s es anterior a la versión mínima %s; actualice el paquete bcrypt",
+            bcrypt.__version__, ".".join(map(str, BCRYPT_VERSION_MINIMA))
+        )
+    
+    # Costo calibrado (nunca menor a BCRYPT_ROUNDS_MINIMO) para hashes nuevos; los hashes con
+    # menos rounds se rehashean al hacer login
+    rounds = max(_calibrar_rounds(contexto), BCRYPT_ROUNDS_MINIMO)
+    contexto.update(bcrypt__default_rounds=rounds, bcrypt__min_rounds=rounds)
+    logger.info("Backend bcrypt: %s (bcrypt %s), costo calibrado: %s rounds", backend, bcrypt.__version__, rounds)
+    return contexto
+
+
+@functools.lru_cache(maxsize=1)
+def _dummy_hash() -> str:
+    """Hash de relleno: si el usuario no existe se verifica igual contra él para que el
+    tiempo de respuesta del login no revele qué usernames existen"""
+    return _pwd_ctx().hash("__dummy__")
+
+
+def preparar_hash_passwords() -> None:
+    """Calibrar bcrypt y generar el hash de relleno al iniciar, fuera de cualquier request de login"""
+    _pwd_ctx()
+    _dummy_hash()
+
+
+# Cachés por ID de datos de referencia (roles, permisos, páginas); se invalidan al escribir
+_rol_cache = TTLCache(maxsize=1024, ttl=60)
+_permiso_cache = TTLCache(maxsize=1024, ttl=60)
+_pagina_cache = TTLCache(maxsize=1024, ttl=60)
+# IDs de páginas visibles por usuario (ruta de autorización más consultada); se vacía ante
+# cambios de asignación, del usuario o de cualquier página
+_paginas_usuario_cache = TTLCache(maxsize=1024, ttl=60)
+
+
+def _get_cacheado(db: Session, cache: TTLCache, modelo, obj_id: int):
+    """Obtener por ID desde la caché en memoria o, si no está, desde la base de datos"""
+    cacheado = cache.get(obj_id)
+    if cacheado is not None:
+        return adjuntar(db, cacheado)
+    obj = db.get(modelo, obj_id)
+    if obj:
+        cache[obj_id] = copia_desacoplada(obj)
+    return obj
+
+
+def _paginar_por_id(query, modelo, skip: int, limit: int, after_id: Optional[int]):
+    """Ordenar por id y paginar por cursor (id > after_id, recorre el índice de la PK) o por skip"""
+    query = query.order_by(modelo.id)
+    if after_id is not None:
+        query = query.filter(modelo.id > after_id)
+    else:
+        query = query.offset(skip)
+    return query.limit(limit)
 
-# Configuración para hash de contraseñas
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+def _actualizar(db: Session, modelo, obj_id: int, valores: dict, commit: bool = True):
+    """UPDATE ... RETURNING por ID: la fila actualizada vuelve en el mismo viaje (None si no existe)"""
+    if valores:
+        obj = db.execute(
+            update(modelo).where(modelo.id == obj_id).values(**valores).returning(modelo)
+        ).scalar_one_or_none()
+    else:
+        obj = db.get(modelo, obj_id)
+    if obj is not None and commit:
+        db.commit()
+    return obj
 
 # === UTILIDADES DE CONTRASEÑAS ===
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verifica una contraseña en texto plano contra su hash"""
-    return pwd_context.verify(plain_password, hashed_password)
+    return _pwd_ctx().verify(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
     """Genera el hash de una contraseña"""
-    return pwd_context.hash(password)
+    return _pwd_ctx().hash(password)
+
+# Pool de hilos para bcrypt: el backend nativo libera el GIL, así que los hashes
+# corren en paralelo sin bloquear el event loop de los endpoints async
+_BCRYPT_POOL = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="bcrypt")
+
+async def _en_pool_bcrypt(func, *args):
+    """Ejecuta una función bloqueante en el pool de bcrypt"""
+    return await asyncio.get_running_loop().run_in_executor(_BCRYPT_POOL, func, *args)
+
+async def averify_password(plain_password: str, hashed_password: str) -> bool:
+    """Versión async de verify_password"""
+    return await _en_pool_bcrypt(verify_password, plain_password, hashed_password)
+
+async def aget_password_hash(password: str) -> str:
+    """Versión async de get_password_hash"""
+    return await _en_pool_bcrypt(get_password_hash, password)
 
 # === CRUD USUARIOS ===
 
+# Relaciones que serializa UsuarioResponse (rol con permisos y páginas permitidas)
+OPCIONES_CARGA_USUARIO = (
+    joinedload(Usuarios.rol).selectinload(Roles.permisos),
+    selectinload(Usuarios.paginas_permitidas),
+)
+
 def get_usuario(db: Session, usuario_id: int) -> Optional[Usuarios]:
-    """Obtiene un usuario por ID"""
-    return db.query(Usuarios).filter(Usuarios.id == usuario_id).first()
+    """Obtiene un usuario por ID (sin consulta si ya está en la sesión)"""
+    return db.get(Usuarios, usuario_id)
 
 def get_usuario_by_username(db: Session, username: str) -> Optional[Usuarios]:
     """Obtiene un usuario por username"""
@@ -42,56 +175,99 @@ def get_usuario_by_email(db: Session, email: str) -> Optional[Usuarios]:
     """Obtiene un usuario por email"""
     return db.query(Usuarios).filter(Usuarios.email == email).first()
 
-def get_usuarios(db: Session, skip: int = 0, limit: int = 100) -> List[Usuarios]:
-    """Obtiene lista de usuarios con paginación"""
-    return db.query(Usuarios).offset(skip).limit(limit).all()
+def get_usuarios(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None) -> List[Usuarios]:
+    """Obtiene lista de usuarios con paginación (por cursor after_id o, sin él, por skip)"""
+    return _paginar_por_id(db.query(Usuarios), Usuarios, skip, limit, after_id).all()
 
 def create_usuario(db: Session, usuario: UsuarioCreate) -> Usuarios:
     """Crea un nuevo usuario"""
-    hashed_password = get_password_hash(usuario.password)
-    db_usuario = Usuarios(
-        username=usuario.username,
-        email=usuario.email,
-        hashed_password=hashed_password,
-        nombre_completo=usuario.nombre_completo,
-        activo=usuario.activo,
-        es_admin=usuario.es_admin,
-        rol_id=usuario.rol_id,
-        debe_cambiar_password=usuario.debe_cambiar_password,
-        fecha_cambio_password=datetime.now()
-    )
-    db.add(db_usuario)
+    return _insertar_usuario(db, usuario, get_password_hash(usuario.password))
+
+def _insertar_usuario(db: Session, usuario: UsuarioCreate, hashed_password: str) -> Usuarios:
+    """Inserta el usuario con la contraseña ya hasheada"""
+    # INSERT ... RETURNING: el registro completo (id, fecha_creacion) vuelve en el mismo viaje
+    db_usuario = db.execute(
+        insert(Usuarios).values(
+            username=usuario.username,
+            email=usuario.email,
+            hashed_password=hashed_password,
+            nombre_completo=usuario.nombre_completo,
+            activo=usuario.activo,
+            es_admin=usuario.es_admin,
+            rol_id=usuario.rol_id,
+            debe_cambiar_password=usuario.debe_cambiar_password,
+            fecha_cambio_password=datetime.now()
+        ).returning(Usuarios)
+    ).scalar_one()
     db.commit()
-    db.refresh(db_usuario)
     return db_usuario
 
+def bulk_create_usuarios(db: Session, usuarios: List[UsuarioCreate]) -> List[int]:
+    """Crea varios usuarios: hashes en paralelo y un único INSERT múltiple; devuelve los IDs"""
+    if not usuarios:
+        return []
+    
+    # Validar todo el lote antes de hashear: un duplicado haría fallar el INSERT completo
+    usernames = [u.username for u in usuarios]
+    emails = [u.email for u in usuarios]
+    if len(set(usernames)) != len(usernames) or len(set(emails)) != len(emails):
+        raise ValueError("La importación contiene usernames o emails repetidos")
+    existentes = db.scalars(
+        select(Usuarios.username).where(or_(Usuarios.username.in_(usernames), Usuarios.email.in_(emails)))
+    ).all()
+    if existentes:
+        raise ValueError(f"Usuarios ya registrados (username o email): {', '.join(existentes)}")
+    roles_ids = {u.rol_id for u in usuarios if u.rol_id}
+    if roles_ids and len(db.scalars(select(Roles.id).where(Roles.id.in_(roles_ids))).all()) != len(roles_ids):
+        raise ValueError("Alguno de los roles especificados no existe")
+    
+    # bcrypt es el único paso costoso: el pool de hilos lo reparte entre los núcleos
+    hashes = list(_BCRYPT_POOL.map(get_password_hash, [u.password for u in usuarios]))
+    ahora = datetime.now()
+    filas = [
+        {
+            "username": u.username,
+            "email": u.email,
+            "hashed_password": hashed_password,
+            "nombre_completo": u.nombre_completo,
+            "activo": u.activo,
+            "es_admin": u.es_admin,
+            "rol_id": u.rol_id,
+            "debe_cambiar_password": u.debe_cambiar_password,
+            "fecha_cambio_password": ahora,
+        }
+        for u, hashed_password in zip(usuarios, hashes)
+    ]
+    ids = list(db.scalars(insert(Usuarios).returning(Usuarios.id, sort_by_parameter_order=True), filas))
+    db.commit()
+    return ids
+
 def update_usuario(db: Session, usuario_id: int, usuario: UsuarioUpdate) -> Optional[Usuarios]:
     """Actualiza un usuario existente"""
-    db_usuario = get_usuario(db, usuario_id)
-    if db_usuario:
-        for key, value in usuario.dict(exclude_unset=True).items():
-            setattr(db_usuario, key, value)
-        db.commit()
-        db.refresh(db_usuario)
+    db_usuario = _actualizar(db, Usuarios, usuario_id, usuario.model_dump(exclude_unset=True))
+    # es_admin cambia qué páginas ve
+    _paginas_usuario_cache.pop(usuario_id, None)
     return db_usuario
 
 def delete_usuario(db: Session, usuario_id: int) -> bool:
-    """Elimina un usuario (lo desactiva)"""
-    db_usuario = get_usuario(db, usuario_id)
-    if db_usuario:
-        db_usuario.activo = False
-        db.commit()
-        return True
-    return False
+    """Elimina un usuario (lo desactiva con un UPDATE directo, sin cargarlo)"""
+    desactivados = db.query(Usuarios).filter(Usuarios.id == usuario_id).update({"activo": False})
+    db.commit()
+    _paginas_usuario_cache.pop(usuario_id, None)
+    return desactivados > 0
+
+def _guardar_password(db_usuario: Usuarios, hashed_password: str, debe_cambiar_password: bool) -> None:
+    """Asigna el nuevo hash y resetea los intentos fallidos (el commit lo hace quien llama)"""
+    db_usuario.hashed_password = hashed_password
+    db_usuario.debe_cambiar_password = debe_cambiar_password
+    db_usuario.fecha_cambio_password = datetime.now()
+    db_usuario.intentos_fallidos = 0  # Resetear intentos fallidos
 
 def change_password(db: Session, usuario_id: int, current_password: str, new_password: str) -> bool:
     """Cambia la contraseña de un usuario"""
     db_usuario = get_usuario(db, usuario_id)
     if db_usuario and verify_password(current_password, db_usuario.hashed_password):
-        db_usuario.hashed_password = get_password_hash(new_password)
-        db_usuario.debe_cambiar_password = False
-        db_usuario.fecha_cambio_password = datetime.now()
-        db_usuario.intentos_fallidos = 0  # Resetear intentos fallidos
+        _guardar_password(db_usuario, get_password_hash(new_password), False)
         db.commit()
         return True
     return False
@@ -100,44 +276,123 @@ def reset_password(db: Session, usuario_id: int, new_password: str, force_change
     """Resetea la contraseña de un usuario (solo admin)"""
     db_usuario = get_usuario(db, usuario_id)
     if db_usuario:
-        db_usuario.hashed_password = get_password_hash(new_password)
-        db_usuario.debe_cambiar_password = force_change
-        db_usuario.fecha_cambio_password = datetime.now()
-        db_usuario.intentos_fallidos = 0
+        _guardar_password(db_usuario, get_password_hash(new_password), force_change)
         db_usuario.bloqueado_hasta = None
         db.commit()
         return True
     return False
 
+def _usuario_para_login(db: Session, username: str) -> Optional[Usuarios]:
+    """Usuario con solo las columnas que usa la verificación; el login exitoso lo recarga completo"""
+    return db.query(Usuarios).options(
+        load_only(
+            Usuarios.id, Usuarios.hashed_password, Usuarios.intentos_fallidos,
+            Usuarios.bloqueado_hasta, Usuarios.ultima_conexion, Usuarios.activo
+        )
+    ).filter(Usuarios.username == username).first()
+
+def _esta_bloqueado(user: Usuarios) -> bool:
+    """Indica si el usuario está bloqueado por intentos fallidos"""
+    return bool(user.bloqueado_hasta and user.bloqueado_hasta > datetime.now())
+
+def _registrar_login_fallido(db: Session, usuario_id: int) -> None:
+    """Incrementar intentos fallidos de forma atómica (dos fallos simultáneos no se pisan)
+    y bloquear por 30 minutos al llegar a 5; el SET ve los valores previos de la fila"""
+    intentos = func.coalesce(Usuarios.intentos_fallidos, 0) + 1
+    db.execute(
+        update(Usuarios)
+        .where(Usuarios.id == usuario_id)
+        .values(
+            intentos_fallidos=intentos,
+            bloqueado_hasta=case(
+                (intentos >= 5, datetime.now() + timedelta(minutes=30)),
+                else_=Usuarios.bloqueado_hasta
+            )
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+def _registrar_login_exitoso(db: Session, usuario_id: int, nuevo_hash: Optional[str]) -> Usuarios:
+    """Resetear intentos fallidos y actualizar última conexión (y el hash si se rehasheó) en un UPDATE"""
+    valores = {"intentos_fallidos": 0, "bloqueado_hasta": None, "ultima_conexion": datetime.now()}
+    if nuevo_hash is not None:
+        valores["hashed_password"] = nuevo_hash
+    db.execute(
+        update(Usuarios)
+        .where(Usuarios.id == usuario_id)
+        .values(**valores)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    
+    # El login devuelve el usuario con rol y páginas: recargarlos juntos tras el commit
+    # (populate_existing: el UPDATE anterior no sincronizó el objeto en la sesión)
+    return db.query(Usuarios).options(*OPCIONES_CARGA_USUARIO)\
+        .filter(Usuarios.id == usuario_id).populate_existing().one()
+
 def authenticate_user(db: Session, username: str, password: str) -> Optional[Usuarios]:
     """Autentica un usuario y maneja intentos fallidos"""
-    user = get_usuario_by_username(db, username)
+    user = _usuario_para_login(db, username)
     if not user:
+        verify_password(password, _dummy_hash())
         return None
     
     # Verificar si está bloqueado
-    if user.bloqueado_hasta and user.bloqueado_hasta > datetime.now():
+    if _esta_bloqueado(user):
         return None
     
     # Verificar contraseña
     if not verify_password(password, user.hashed_password):
-        # Incrementar intentos fallidos
-        user.intentos_fallidos = (user.intentos_fallidos or 0) + 1
-        
-        # Bloquear si superó 5 intentos (por 30 minutos)
-        if user.intentos_fallidos >= 5:
-            user.bloqueado_hasta = datetime.now() + timedelta(minutes=30)
-        
-        db.commit()
+        _registrar_login_fallido(db, user.id)
         return None
     
-    # Login exitoso - resetear intentos fallidos y actualizar última conexión
-    user.intentos_fallidos = 0
-    user.bloqueado_hasta = None
-    user.ultima_conexion = datetime.now()
-    db.commit()
+    # Rehashear con el costo calibrado si el hash guardado es más débil
+    nuevo_hash = get_password_hash(password) if _pwd_ctx().needs_update(user.hashed_password) else None
+    return _registrar_login_exitoso(db, user.id, nuevo_hash)
+
+# Variantes async: solo bcrypt va al pool; las consultas y el commit quedan en el hilo
+# que atiende la petición, así las esperas de la base de datos no ocupan hilos de bcrypt
+
+async def aauthenticate_user(db: Session, username: str, password: str) -> Optional[Usuarios]:
+    """Versión async de authenticate_user"""
+    user = _usuario_para_login(db, username)
+    if not user:
+        await averify_password(password, await _en_pool_bcrypt(_dummy_hash))
+        return None
     
-    return user
+    if _esta_bloqueado(user):
+        return None
+    
+    if not await averify_password(password, user.hashed_password):
+        _registrar_login_fallido(db, user.id)
+        return None
+    
+    nuevo_hash = await aget_password_hash(password) if _pwd_ctx().needs_update(user.hashed_password) else None
+    return _registrar_login_exitoso(db, user.id, nuevo_hash)
+
+async def acreate_usuario(db: Session, usuario: UsuarioCreate) -> Usuarios:
+    """Versión async de create_usuario"""
+    return _insertar_usuario(db, usuario, await aget_password_hash(usuario.password))
+
+async def achange_password(db: Session, usuario_id: int, current_password: str, new_password: str) -> bool:
+    """Versión async de change_password"""
+    db_usuario = get_usuario(db, usuario_id)
+    if db_usuario and await averify_password(current_password, db_usuario.hashed_password):
+        _guardar_password(db_usuario, await aget_password_hash(new_password), False)
+        db.commit()
+        return True
+    return False
+
+async def areset_password(db: Session, usuario_id: int, new_password: str, force_change: bool = True) -> bool:
+    """Versión async de reset_password"""
+    db_usuario = get_usuario(db, usuario_id)
+    if db_usuario:
+        _guardar_password(db_usuario, await aget_password_hash(new_password), force_change)
+        db_usuario.bloqueado_hasta = None
+        db.commit()
+        return True
+    return False
 
 def asignar_paginas_usuario(db: Session, usuario_id: int, paginas_ids: List[int]) -> bool:
     """Asigna páginas específicas a un usuario"""
@@ -145,174 +400,193 @@ def asignar_paginas_usuario(db: Session, usuario_id: int, paginas_ids: List[int]
     if not db_usuario:
         return False
     
-    # Limpiar páginas actuales
-    db_usuario.paginas_permitidas.clear()
-    
-    # Asignar nuevas páginas
-    paginas = db.query(Paginas).filter(Paginas.id.in_(paginas_ids)).all()
-    for pagina in paginas:
-        db_usuario.paginas_permitidas.append(pagina)
+    # Reemplazar la asignación con un DELETE y un INSERT múltiple sobre la tabla de asociación
+    db.execute(usuarios_paginas.delete().where(usuarios_paginas.c.usuario_id == usuario_id))
+    _insertar_asociacion(db, usuarios_paginas, "usuario_id", usuario_id, "pagina_id", paginas_ids)
+    # La colección pudo quedar cargada en la sesión: se recarga en el próximo acceso
+    db.expire(db_usuario, ["paginas_permitidas"])
     
     db.commit()
+    _paginas_usuario_cache.pop(usuario_id, None)
     return True
 
+
+def _insertar_asociacion(db: Session, tabla, columna_padre: str, padre_id: int, columna_hijo: str, ids: List[int]) -> None:
+    """Insertar filas en una tabla de asociación (executemany; la FK rechaza IDs inexistentes)"""
+    ids_unicos = list(dict.fromkeys(ids))
+    if ids_unicos:
+        db.execute(tabla.insert(), [{columna_padre: padre_id, columna_hijo: i} for i in ids_unicos])
+
 # === CRUD ROLES ===
 
 def get_rol(db: Session, rol_id: int) -> Optional[Roles]:
-    """Obtiene un rol por ID"""
-    return db.query(Roles).filter(Roles.id == rol_id).first()
+    """Obtiene un rol por ID (con caché en memoria)"""
+    return _get_cacheado(db, _rol_cache, Roles, rol_id)
 
-def get_roles(db: Session, skip: int = 0, limit: int = 100) -> List[Roles]:
-    """Obtiene lista de roles con paginación"""
-    return db.query(Roles).offset(skip).limit(limit).all()
+def get_roles(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None) -> List[Roles]:
+    """Obtiene lista de roles con paginación (por cursor after_id o, sin él, por skip)"""
+    return _paginar_por_id(db.query(Roles), Roles, skip, limit, after_id).all()
 
 def create_rol(db: Session, rol: RolCreate) -> Roles:
     """Crea un nuevo rol"""
-    db_rol = Roles(
-        nombre=rol.nombre,
-        descripcion=rol.descripcion,
-        activo=rol.activo
-    )
-    db.add(db_rol)
-    db.flush()  # Para obtener el ID antes del commit
+    db_rol = db.execute(
+        insert(Roles).values(
+            nombre=rol.nombre,
+            descripcion=rol.descripcion,
+            activo=rol.activo
+        ).returning(Roles)
+    ).scalar_one()
     
     # Asignar permisos si se especificaron
     if rol.permisos_ids:
-        permisos = db.query(Permisos).filter(Permisos.id.in_(rol.permisos_ids)).all()
-        for permiso in permisos:
-            db_rol.permisos.append(permiso)
+        _insertar_asociacion(db, roles_permisos, "rol_id", db_rol.id, "permiso_id", rol.permisos_ids)
     
     db.commit()
-    db.refresh(db_rol)
     return db_rol
 
 def update_rol(db: Session, rol_id: int, rol: RolUpdate) -> Optional[Roles]:
     """Actualiza un rol existente"""
-    db_rol = get_rol(db, rol_id)
+    db_rol = _actualizar(db, Roles, rol_id, rol.model_dump(exclude_unset=True, exclude={'permisos_ids'}), commit=False)
     if db_rol:
-        # Actualizar campos básicos
-        update_data = rol.dict(exclude_unset=True, exclude={'permisos_ids'})
-        for key, value in update_data.items():
-            setattr(db_rol, key, value)
-        
         # Actualizar permisos si se especificaron
         if rol.permisos_ids is not None:
-            db_rol.permisos.clear()
-            permisos = db.query(Permisos).filter(Permisos.id.in_(rol.permisos_ids)).all()
-            for permiso in permisos:
-                db_rol.permisos.append(permiso)
-        
+            db.execute(roles_permisos.delete().where(roles_permisos.c.rol_id == rol_id))
+            _insertar_asociacion(db, roles_permisos, "rol_id", rol_id, "permiso_id", rol.permisos_ids)
+            db.expire(db_rol, ["permisos"])
         db.commit()
-        db.refresh(db_rol)
+        _rol_cache.pop(rol_id, None)
     return db_rol
 
 def delete_rol(db: Session, rol_id: int) -> bool:
-    """Elimina un rol (lo desactiva)"""
-    db_rol = get_rol(db, rol_id)
-    if db_rol:
-        db_rol.activo = False
-        db.commit()
-        return True
-    return False
+    """Elimina un rol (lo desactiva con un UPDATE directo, sin cargarlo)"""
+    desactivados = db.query(Roles).filter(Roles.id == rol_id).update({"activo": False})
+    db.commit()
+    _rol_cache.pop(rol_id, None)
+    return desactivados > 0
 
 # === CRUD PERMISOS ===
 
 def get_permiso(db: Session, permiso_id: int) -> Optional[Permisos]:
-    """Obtiene un permiso por ID"""
-    return db.query(Permisos).filter(Permisos.id == permiso_id).first()
+    """Obtiene un permiso por ID (con caché en memoria)"""
+    return _get_cacheado(db, _permiso_cache, Permisos, permiso_id)
 
-def get_permisos(db: Session, skip: int = 0, limit: int = 100) -> List[Permisos]:
-    """Obtiene lista de permisos con paginación"""
-    return db.query(Permisos).offset(skip).limit(limit).all()
+def get_permisos(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None) -> List[Permisos]:
+    """Obtiene lista de permisos con paginación (por cursor after_id o, sin él, por skip)"""
+    return _paginar_por_id(db.query(Permisos), Permisos, skip, limit, after_id).all()
 
 def create_permiso(db: Session, permiso: PermisoCreate) -> Permisos:
     """Crea un nuevo permiso"""
-    db_permiso = Permisos(
-        nombre=permiso.nombre,
-        descripcion=permiso.descripcion,
-        recurso=permiso.recurso,
-        accion=permiso.accion,
-        activo=permiso.activo
-    )
-    db.add(db_permiso)
+    db_permiso = db.execute(
+        insert(Permisos).values(
+            nombre=permiso.nombre,
+            descripcion=permiso.descripcion,
+            recurso=permiso.recurso,
+            accion=permiso.accion,
+            activo=permiso.activo
+        ).returning(Permisos)
+    ).scalar_one()
     db.commit()
-    db.refresh(db_permiso)
     return db_permiso
 
 def update_permiso(db: Session, permiso_id: int, permiso: PermisoUpdate) -> Optional[Permisos]:
     """Actualiza un permiso existente"""
-    db_permiso = get_permiso(db, permiso_id)
-    if db_permiso:
-        for key, value in permiso.dict(exclude_unset=True).items():
-            setattr(db_permiso, key, value)
-        db.commit()
-        db.refresh(db_permiso)
+    db_permiso = _actualizar(db, Permisos, permiso_id, permiso.model_dump(exclude_unset=True))
+    _permiso_cache.pop(permiso_id, None)
     return db_permiso
 
 def delete_permiso(db: Session, permiso_id: int) -> bool:
-    """Elimina un permiso (lo desactiva)"""
-    db_permiso = get_permiso(db, permiso_id)
-    if db_permiso:
-        db_permiso.activo = False
-        db.commit()
-        return True
-    return False
+    """Elimina un permiso (lo desactiva con un UPDATE directo, sin cargarlo)"""
+    desactivados = db.query(Permisos).filter(Permisos.id == permiso_id).update({"activo": False})
+    db.commit()
+    _permiso_cache.pop(permiso_id, None)
+    return desactivados > 0
 
 # === CRUD PÁGINAS ===
 
-def get_pagina(db: Session, pagina_id: int) -> Optional[Paginas]:
-    """Obtiene una página por ID"""
-    return db.query(Paginas).filter(Paginas.id == pagina_id).first()
+# Sentencia construida una sola vez: cada llamada reutiliza el objeto y su clave de caché
+_PAGINAS_ACTIVAS = select(Paginas).where(Paginas.activa == True).order_by(Paginas.orden)
+_PAGINAS_ASIGNADAS_ACTIVAS = select(Paginas).join(
+    usuarios_paginas, usuarios_paginas.c.pagina_id == Paginas.id
+).where(
+    usuarios_paginas.c.usuario_id == bindparam('usuario_id'),
+    Paginas.activa == True
+).order_by(Paginas.orden)
 
-def get_paginas(db: Session, skip: int = 0, limit: int = 100) -> List[Paginas]:
-    """Obtiene lista de páginas con paginación"""
-    return db.query(Paginas).order_by(Paginas.orden).offset(skip).limit(limit).all()
+def get_pagina(db: Session, pagina_id: int) -> Optional[Paginas]:
+    """Obtiene una página por ID (con caché en memoria)"""
+    return _get_cacheado(db, _pagina_cache, Paginas, pagina_id)
+
+def get_paginas(
+    db: Session, skip: int = 0, limit: int = 100, after: Optional[Tuple[int, int]] = None
+) -> List[Paginas]:
+    """Obtiene lista de páginas ordenadas por (orden, id); after = (orden, id) del último recibido"""
+    query = db.query(Paginas).order_by(Paginas.orden, Paginas.id)
+    if after is not None:
+        query = query.filter(tuple_(Paginas.orden, Paginas.id) > tuple_(*after))
+    else:
+        query = query.offset(skip)
+    return query.limit(limit).all()
 
 def get_paginas_usuario(db: Session, usuario_id: int) -> List[Paginas]:
-    """Obtiene las páginas permitidas para un usuario"""
-    usuario = get_usuario(db, usuario_id)
+    """Obtiene las páginas permitidas para un usuario (IDs cacheados en memoria)"""
+    ids = _paginas_usuario_cache.get(usuario_id)
+    if ids is None:
+        paginas = _calcular_paginas_usuario(db, usuario_id)
+        for pagina in paginas:
+            _pagina_cache[pagina.id] = copia_desacoplada(pagina)
+        _paginas_usuario_cache[usuario_id] = tuple(p.id for p in paginas)
+        return paginas
+    
+    # Las páginas salen de su propia caché; las que no estén se leen en un único IN
+    faltantes = [i for i in ids if i not in _pagina_cache]
+    if faltantes:
+        for pagina in db.scalars(select(Paginas).where(Paginas.id.in_(faltantes))):
+            _pagina_cache[pagina.id] = copia_desacoplada(pagina)
+    cacheadas = [_pagina_cache.get(i) for i in ids]
+    return [adjuntar(db, p) for p in cacheadas if p is not None]
+
+def _calcular_paginas_usuario(db: Session, usuario_id: int) -> List[Paginas]:
+    """Resolver desde la base de datos las páginas permitidas para un usuario"""
+    usuario = db.execute(select(Usuarios.es_admin).where(Usuarios.id == usuario_id)).first()
     if not usuario:
         return []
     
     if usuario.es_admin:
         # Admin ve todas las páginas activas
-        return db.query(Paginas).filter(Paginas.activa == True).order_by(Paginas.orden).all()
+        return db.scalars(_PAGINAS_ACTIVAS).all()
     else:
-        # Usuario normal solo ve sus páginas asignadas
-        return [p for p in usuario.paginas_permitidas if p.activa]
+        # Usuario normal solo ve sus páginas asignadas (las inactivas se descartan en SQL)
+        return db.scalars(_PAGINAS_ASIGNADAS_ACTIVAS, {"usuario_id": usuario_id}).all()
 
 def create_pagina(db: Session, pagina: PaginaCreate) -> Paginas:
     """Crea una nueva página"""
-    db_pagina = Paginas(
-        nombre=pagina.nombre,
-        ruta=pagina.ruta,
-        titulo=pagina.titulo,
-        descripcion=pagina.descripcion,
-        icono=pagina.icono,
-        orden=pagina.orden,
-        activa=pagina.activa,
-        solo_admin=pagina.solo_admin
-    )
-    db.add(db_pagina)
+    db_pagina = db.execute(
+        insert(Paginas).values(
+            nombre=pagina.nombre,
+            ruta=pagina.ruta,
+            titulo=pagina.titulo,
+            descripcion=pagina.descripcion,
+            icono=pagina.icono,
+            orden=pagina.orden,
+            activa=pagina.activa,
+            solo_admin=pagina.solo_admin
+        ).returning(Paginas)
+    ).scalar_one()
     db.commit()
-    db.refresh(db_pagina)
+    _paginas_usuario_cache.clear()
     return db_pagina
 
 def update_pagina(db: Session, pagina_id: int, pagina: PaginaUpdate) -> Optional[Paginas]:
     """Actualiza una página existente"""
-    db_pagina = get_pagina(db, pagina_id)
-    if db_pagina:
-        for key, value in pagina.dict(exclude_unset=True).items():
-            setattr(db_pagina, key, value)
-        db.commit()
-        db.refresh(db_pagina)
+    db_pagina = _actualizar(db, Paginas, pagina_id, pagina.model_dump(exclude_unset=True))
+    _pagina_cache.pop(pagina_id, None)
+    _paginas_usuario_cache.clear()
     return db_pagina
 
 def delete_pagina(db: Session, pagina_id: int) -> bool:
-    """Elimina una página (la desactiva)"""
-    db_pagina = get_pagina(db, pagina_id)
-    if db_pagina:
-        db_pagina.activa = False
-        db.commit()
-        return True
-    return False
\ No newline at end of file
+    """Elimina una página (la desactiva con un UPDATE directo, sin cargarla)"""
+    desactivados = db.query(Paginas).filter(Paginas.id == pagina_id).update({"activa": False})
+    db.commit()
+    _pagina_cache.pop(pagina_id, None)
+    _paginas_usuario_cache.clear()
+    return desactivados > 0
\ No newline at end of file
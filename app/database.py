@@ -5,6 +5,7 @@ import os
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 
 # URL de la base de datos desde variables de entorno
 DATABASE_URL = os.getenv('DATABASE_URL')
@@ -12,11 +13,57 @@ DATABASE_URL = os.getenv('DATABASE_URL')
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable is not set")
 
-# Crear engine
-engine = create_engine(DATABASE_URL)
+# Entorno de ejecución (development, production)
+ENV_STATE = os.getenv('ENV_STATE', 'development')
 
-# Crear SessionLocal
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Tamaño del pool configurable por despliegue (workers x pool_size no debe superar max_connections)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 20))
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 30))
+# Segundos para establecer una conexión nueva: un servidor colgado falla rápido en vez de bloquear
+DB_CONNECT_TIMEOUT = int(os.getenv('DB_CONNECT_TIMEOUT', 5))
+
+# Crear engine (singleton del módulo) con pool de conexiones explícito
+engine = create_engine(
+    DATABASE_URL,
+    poolclass=QueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_pre_ping=True,
+    pool_recycle=1800,
+    connect_args={"connect_timeout": DB_CONNECT_TIMEOUT},
+    # LIFO: se reutilizan las conexiones recientes y las sobrantes quedan ociosas hasta reciclarse
+    pool_use_lifo=True,
+    # Caché de sentencias compiladas compartida por todas las consultas del proceso
+    query_cache_size=1200
+)
+
+# Crear SessionLocal; expire_on_commit=False: los objetos devueltos tras un commit no
+# vuelven a consultarse al leer sus atributos (las recargas necesarias son explícitas)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+# Réplica de lectura opcional para consultas de tablero (estadísticas); sin ella se usa el primario
+DATABASE_READ_URL = os.getenv('DATABASE_READ_URL')
+
+engine_ro = create_engine(
+    DATABASE_READ_URL,
+    poolclass=QueuePool,
+    pool_size=5,
+    max_overflow=10,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_pre_ping=True,
+    pool_recycle=1800,
+    connect_args={"connect_timeout": DB_CONNECT_TIMEOUT},
+    pool_use_lifo=True,
+    query_cache_size=1200
+) if DATABASE_READ_URL else engine
+
+# Sesiones de solo lectura: las transacciones se abren READ ONLY (se restablece al devolver la conexión)
+SessionLocalRO = sessionmaker(
+    autocommit=False, autoflush=False, expire_on_commit=False,
+    bind=engine_ro.execution_options(postgresql_readonly=True)
+)
 
 # Base para los modelos ORM
 Base = declarative_base()
@@ -29,4 +76,14 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def get_db_ro():
+    """
+    Dependency para obtener sesión de solo lectura (réplica si DATABASE_READ_URL está definida)
+    """
+    db = SessionLocalRO()
+    try:
+        yield db
+    finally:
+        db.close()
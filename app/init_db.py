@@ -3,39 +3,36 @@
 Script completo para inicializar la base de datos desde cero
 Funciona correctamente con contenedores Docker
 """
-import os
+import re
 import sys
 import time
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import func, insert, literal, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.exc import SQLAlchemyError
-from passlib.context import CryptContext
 
-# Importar modelos existentes
-from models.models import (
-    Base, Usuarios, Roles, Permisos, Paginas, Proveedores, ModelosMaquinas,
-    Almacenamientos, Maquinas, Repuestos, HistorialRepuestos, OrdenesCompra,
-    ItemsOrdenCompra, DocumentosOrden, OrdenesTrabajoMantenimiento,
-    ComentariosOT, ArchivosOT, ArchivosComentarioOT
-)
-from database import engine
+# Los modelos se importan dentro de cada función: así wait_for_db empieza a
+# reintentar sin pagar antes la carga de todos los modelos
+from database import engine, SessionLocal
 
-# Configuración de encriptación
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hash bcrypt (2b, coste 12) precalculado de la contraseña inicial "admin123": evita el
+# hash en cada arranque; se cambia en el primer login (debe_cambiar_password=True)
+ADMIN_PASSWORD_HASH = "$2b$12$Lh42yzZulT9FSDSLxWPrHeaolNjqdkvQ.EWArg.wEcRvcTlSVvKCy"
 
 def wait_for_db(engine, max_retries=30):
-    """Esperar a que la base de datos esté disponible"""
+    """Esperar a que la base de datos esté disponible (reintentos con espera exponencial)"""
+    delay = 0.1
     for i in range(max_retries):
         try:
-            with engine.connect() as connection:
-                result = connection.execute(text("SELECT 1"))
-                result.fetchone()
+            # Abrir la conexión ya confirma que el servidor acepta clientes; queda en el pool
+            with engine.connect():
+                pass
             print("✅ Base de datos disponible")
             return True
-        except Exception as e:
+        except Exception:
             if i < 5 or i % 10 == 0:
                 print(f"⏳ Esperando base de datos... intento {i+1}/{max_retries}")
-            time.sleep(2)
+            time.sleep(delay)
+            delay = min(delay * 1.7, 2.0)
     
     print("❌ Base de datos no disponible después de esperar")
     return False
@@ -44,7 +41,9 @@ def create_tables():
     """Crear todas las tablas definidas en los modelos"""
     try:
         print("📋 Creando tablas...")
-        Base.metadata.create_all(bind=engine)
+        # Importar los modelos registra todas las tablas en su metadata
+        from models import models
+        models.Base.metadata.create_all(bind=engine)
         print("✅ Tablas creadas exitosamente")
         return True
     except SQLAlchemyError as e:
@@ -68,37 +67,49 @@ def init_database(engine):
 
 def migrate_database(engine):
     """Ejecutar migraciones de base de datos"""
+    from models.models import CRITICIDAD_ORDEN_SQL
+    
     try:
         with engine.connect() as conn:
             print("🔄 Ejecutando migraciones...")
             
-            # Verificar y agregar columnas que puedan faltar
-            result = conn.execute(text("""
-                SELECT table_name 
-                FROM information_schema.tables 
+            # Verificar y agregar columnas que puedan faltar: una sola consulta de columnas
+            # (sin filas = la tabla repuestos no existe)
+            existing_columns = set(conn.execute(text("""
+                SELECT column_name 
+                FROM information_schema.columns 
                 WHERE table_schema = 'public' AND table_name = 'repuestos'
+            """)).scalars())
+            
+            if existing_columns:
+                faltantes = [
+                    (columna, tipo) for columna, tipo in (("tipo", "VARCHAR(50)"), ("descripcion_aduana", "TEXT"))
+                    if columna not in existing_columns
+                ]
+                if faltantes:
+                    # Un único ALTER TABLE para todas las columnas faltantes
+                    conn.execute(text("ALTER TABLE repuestos " + ", ".join(
+                        f"ADD COLUMN IF NOT EXISTS {columna} {tipo}" for columna, tipo in faltantes
+                    )))
+                    conn.commit()
+                    for columna, _ in faltantes:
+                        print(f"✅ Columna '{columna}' agregada a repuestos")
+            
+            # Columna generada para ordenar por criticidad con índice
+            result = conn.execute(text("""
+                SELECT column_name 
+                FROM information_schema.columns 
+                WHERE table_name = 'ordenes_trabajo_mantenimiento' 
+                AND column_name = 'criticidad_orden'
             """))
             
-            if result.fetchone():
-                # La tabla repuestos existe, verificar columnas opcionales
-                result = conn.execute(text("""
-                    SELECT column_name 
-                    FROM information_schema.columns 
-                    WHERE table_name = 'repuestos' 
-                    AND column_name IN ('tipo', 'descripcion_aduana')
-                """))
-                
-                existing_columns = [row[0] for row in result.fetchall()]
-                
-                if 'tipo' not in existing_columns:
-                    conn.execute(text("ALTER TABLE repuestos ADD COLUMN tipo VARCHAR(50)"))
-                    print("✅ Columna 'tipo' agregada a repuestos")
-                
-                if 'descripcion_aduana' not in existing_columns:
-                    conn.execute(text("ALTER TABLE repuestos ADD COLUMN descripcion_aduana TEXT"))
-                    print("✅ Columna 'descripcion_aduana' agregada a repuestos")
-                
+            if not result.fetchone():
+                conn.execute(text(
+                    "ALTER TABLE ordenes_trabajo_mantenimiento ADD COLUMN criticidad_orden SMALLINT "
+                    f"GENERATED ALWAYS AS ({CRITICIDAD_ORDEN_SQL}) STORED"
+                ))
                 conn.commit()
+                print("✅ Columna 'criticidad_orden' agregada a ordenes_trabajo_mantenimiento")
             
             print("✅ Migraciones completadas")
             
@@ -108,242 +119,402 @@ def migrate_database(engine):
     
     return True
 
+# Índices de rendimiento que no se pueden declarar en los modelos
+# (requieren extensiones u operator classes específicas de PostgreSQL)
+PERFORMANCE_INDEXES = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    # Búsqueda ILIKE '%term%' en almacenamientos (un índice por columna para el OR)
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_almacenamientos_codigo_trgm ON almacenamientos USING gin (codigo gin_trgm_ops)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_almacenamientos_nombre_trgm ON almacenamientos USING gin (nombre gin_trgm_ops)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_almacenamientos_descripcion_trgm ON almacenamientos USING gin (descripcion gin_trgm_ops)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_almacenamientos_ubicacion_fisica_trgm ON almacenamientos USING gin (ubicacion_fisica gin_trgm_ops)",
+    # Filtro por rango de fechas y orden descendente del historial
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_historial_repuestos_fecha_desc ON historial_repuestos (fecha DESC)",
+    # Estadísticas de órdenes de compra agrupadas por estado (index=True en el modelo)
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_ordenes_compra_estado ON ordenes_compra (estado)",
+    # Unicidad de códigos manuales por orden (ON CONFLICT en add_item_orden; __table_args__ en el modelo)
+    "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ix_items_orden_manual_codigo ON items_orden_compra (orden_id, codigo_manual) WHERE es_item_manual = true",
+    # Conteo de documentos por orden (documentos_count)
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_documentos_orden_orden_id ON documentos_orden (orden_id)",
+    # Paginación por cursor de órdenes de trabajo: (columna de orden, id)
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_ot_fecha_creacion_id ON ordenes_trabajo_mantenimiento (fecha_creacion DESC, id DESC)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_ot_fecha_programada_id ON ordenes_trabajo_mantenimiento (fecha_programada DESC, id DESC)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_ot_usuario_fecha_programada_id ON ordenes_trabajo_mantenimiento (usuario_asignado_id, fecha_programada DESC, id DESC)",
+    # Carga por lotes (selectinload) de comentarios y archivos de OTs; el índice compuesto de
+    # comentarios también cubre el conteo n_comentarios
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_comentarios_ot_orden_fecha ON comentarios_ot (orden_trabajo_id, fecha_creacion DESC)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_archivos_ot_orden_trabajo_id ON archivos_ot (orden_trabajo_id)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_archivos_comentario_ot_comentario_id ON archivos_comentario_ot (comentario_id)",
+    # Búsqueda ILIKE '%term%' en órdenes de trabajo por título o descripción
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_ot_titulo_trgm ON ordenes_trabajo_mantenimiento USING gin (titulo gin_trgm_ops)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_ot_descripcion_trgm ON ordenes_trabajo_mantenimiento USING gin (descripcion gin_trgm_ops)",
+    # Orden por criticidad (columna generada criticidad_orden)
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_ot_criticidad_orden_id ON ordenes_trabajo_mantenimiento (criticidad_orden DESC, id DESC)",
+    # Listado de OTs filtrado por estado y ordenado por fecha de creación
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_ot_estado_fecha_creacion ON ordenes_trabajo_mantenimiento (estado, fecha_creacion DESC, id DESC) INCLUDE (titulo, nivel_criticidad, usuario_asignado_id)",
+    # OTs abiertas por fecha programada (total_vencidas en get_stats)
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_ot_abiertas_fecha_programada ON ordenes_trabajo_mantenimiento (fecha_programada) WHERE estado IN ('pendiente', 'en_proceso')",
+    # Repuestos con stock bajo (get_repuestos_bajo_stock con el umbral por defecto)
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_repuestos_bajo_stock ON repuestos ((cantidad - COALESCE(cantidad_minima, 10))) WHERE cantidad <= COALESCE(cantidad_minima, 10)",
+    # Búsqueda de proveedor por nombre sin distinguir mayúsculas
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_proveedores_nombre_lower ON proveedores (lower(nombre))",
+]
+
+def _nombre_indice(statement):
+    """Nombre del índice en una sentencia CREATE INDEX ... IF NOT EXISTS <nombre>"""
+    return re.search(r"IF NOT EXISTS (\w+)", statement).group(1)
+
+def create_performance_indexes(engine):
+    """Crear los índices de rendimiento que falten (CONCURRENTLY requiere autocommit)"""
+    print("📈 Creando índices de rendimiento...")
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        # Una sola consulta al catálogo: en un reinicio con todo creado no se ejecuta ningún DDL
+        existentes = set(conn.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema()"
+        )).scalars())
+        for statement in PERFORMANCE_INDEXES:
+            if _nombre_indice(statement) in existentes:
+                continue
+            try:
+                conn.execute(text(statement))
+            except SQLAlchemyError as e:
+                print(f"⚠️ Advertencia creando índice: {e}")
+    print("✅ Índices de rendimiento verificados")
+    return True
+
+# Trigger que mantiene ot_contadores al insertar, eliminar o cambiar estado/criticidad de una OT
+OT_COUNTERS_DDL = [
+    """
+    CREATE OR REPLACE FUNCTION ot_contadores_actualizar() RETURNS trigger AS $$
+    DECLARE
+        estado_viejo TEXT;
+        criticidad_vieja TEXT;
+        estado_nuevo TEXT;
+        criticidad_nueva TEXT;
+        delta_total INTEGER := 0;
+    BEGIN
+        IF TG_OP = 'UPDATE' THEN
+            -- UPDATE que reescribe los mismos valores: no hay nada que contar
+            IF OLD.estado IS NOT DISTINCT FROM NEW.estado
+               AND OLD.nivel_criticidad IS NOT DISTINCT FROM NEW.nivel_criticidad THEN
+                RETURN NULL;
+            END IF;
+        ELSE
+            -- 'total' solo cambia al insertar o eliminar (en UPDATE el neto es 0)
+            delta_total := CASE TG_OP WHEN 'INSERT' THEN 1 ELSE -1 END;
+        END IF;
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            estado_viejo := 'estado:' || COALESCE(OLD.estado, '');
+            criticidad_vieja := 'criticidad:' || COALESCE(OLD.nivel_criticidad, '');
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            estado_nuevo := 'estado:' || COALESCE(NEW.estado, '');
+            criticidad_nueva := 'criticidad:' || COALESCE(NEW.nivel_criticidad, '');
+        END IF;
+        -- Una sola sentencia que bloquea las filas en orden de clave (sin interbloqueos entre
+        -- OTs concurrentes) y omite las claves cuyo neto es 0
+        INSERT INTO ot_contadores (clave, valor)
+        SELECT clave, SUM(delta)
+        FROM (VALUES
+            ('total', delta_total),
+            (estado_viejo, -1), (criticidad_vieja, -1),
+            (estado_nuevo, 1), (criticidad_nueva, 1)
+        ) AS d (clave, delta)
+        WHERE clave IS NOT NULL
+        GROUP BY clave
+        HAVING SUM(delta) <> 0
+        ORDER BY clave
+        ON CONFLICT (clave) DO UPDATE SET valor = ot_contadores.valor + EXCLUDED.valor;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS tr_ot_contadores ON ordenes_trabajo_mantenimiento",
+    """
+    CREATE TRIGGER tr_ot_contadores
+    AFTER INSERT OR DELETE OR UPDATE OF estado, nivel_criticidad ON ordenes_trabajo_mantenimiento
+    FOR EACH ROW EXECUTE FUNCTION ot_contadores_actualizar()
+    """,
+]
+
+def create_ot_counters(engine):
+    """Crear el trigger de contadores de OTs y, la primera vez, calcular los contadores desde la tabla"""
+    print("🔢 Configurando contadores de órdenes de trabajo...")
+    try:
+        with engine.begin() as conn:
+            instalado = conn.execute(text(
+                "SELECT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'tr_ot_contadores')"
+            )).scalar()
+            if instalado:
+                # El trigger mantiene los contadores desde su instalación: solo se actualiza
+                # el cuerpo de la función, sin bloquear la tabla ni recalcular
+                conn.execute(text(OT_COUNTERS_DDL[0]))
+                print("✅ Contadores de órdenes de trabajo ya configurados")
+                return True
+            # Bloquear escrituras de OTs mientras se instala el trigger y se calcula el punto de partida
+            conn.execute(text("LOCK TABLE ordenes_trabajo_mantenimiento IN SHARE ROW EXCLUSIVE MODE"))
+            for statement in OT_COUNTERS_DDL:
+                conn.execute(text(statement))
+            conn.execute(text("DELETE FROM ot_contadores"))
+            conn.execute(text("""
+                INSERT INTO ot_contadores (clave, valor)
+                SELECT 'total', COUNT(*) FROM ordenes_trabajo_mantenimiento
+                UNION ALL
+                SELECT 'estado:' || COALESCE(estado, ''), COUNT(*) FROM ordenes_trabajo_mantenimiento GROUP BY 1
+                UNION ALL
+                SELECT 'criticidad:' || COALESCE(nivel_criticidad, ''), COUNT(*) FROM ordenes_trabajo_mantenimiento GROUP BY 1
+            """))
+        print("✅ Contadores de órdenes de trabajo inicializados")
+        return True
+    except SQLAlchemyError as e:
+        print(f"⚠️ Advertencia configurando contadores: {e}")
+        return False
+
+# Roles básicos
+ROLES_BASICOS = [
+    {"nombre": "admin", "descripcion": "Administrador del sistema con acceso completo", "activo": True},
+    {"nombre": "user", "descripcion": "Usuario estándar del sistema", "activo": True},
+]
+
+# Permisos esenciales: (nombre, descripción, recurso, acción)
+PERMISOS_BASICOS = [
+    # Repuestos
+    ("repuestos_leer", "Ver repuestos", "repuestos", "leer"),
+    ("repuestos_crear", "Crear repuestos", "repuestos", "crear"),
+    ("repuestos_editar", "Editar repuestos", "repuestos", "editar"),
+    ("repuestos_eliminar", "Eliminar repuestos", "repuestos", "eliminar"),
+    
+    # Máquinas
+    ("maquinas_leer", "Ver máquinas", "maquinas", "leer"),
+    ("maquinas_crear", "Crear máquinas", "maquinas", "crear"),
+    ("maquinas_editar", "Editar máquinas", "maquinas", "editar"),
+    
+    # Órdenes de trabajo
+    ("ordenes_trabajo_leer", "Ver órdenes de trabajo", "ordenes_trabajo", "leer"),
+    ("ordenes_trabajo_crear", "Crear órdenes de trabajo", "ordenes_trabajo", "crear"),
+    ("ordenes_trabajo_editar", "Editar órdenes de trabajo", "ordenes_trabajo", "editar"),
+    
+    # Órdenes de compra
+    ("ordenes_compra_leer", "Ver órdenes de compra", "ordenes_compra", "leer"),
+    ("ordenes_compra_crear", "Crear órdenes de compra", "ordenes_compra", "crear"),
+    ("ordenes_compra_editar", "Editar órdenes de compra", "ordenes_compra", "editar"),
+    
+    # Administración
+    ("admin_usuarios", "Administrar usuarios", "administracion", "admin"),
+    ("admin_sistema", "Administrar sistema", "administracion", "admin"),
+]
+
+# Páginas del sistema
+PAGINAS_SISTEMA = [
+    {
+        "nombre": "repuestos",
+        "ruta": "/repuestos",
+        "titulo": "Repuestos",
+        "descripcion": "Gestión de inventario de repuestos",
+        "icono": "Package",
+        "orden": 1,
+        "activa": True,
+        "solo_admin": False
+    },
+    {
+        "nombre": "proveedores",
+        "ruta": "/proveedores",
+        "titulo": "Proveedores",
+        "descripcion": "Administrar proveedores y contactos",
+        "icono": "Users",
+        "orden": 2,
+        "activa": True,
+        "solo_admin": False
+    },
+    {
+        "nombre": "ordenes_compra",
+        "ruta": "/ordenes-compra",
+        "titulo": "Órdenes de Compra",
+        "descripcion": "Gestión de pedidos de repuestos",
+        "icono": "ShoppingCart",
+        "orden": 3,
+        "activa": True,
+        "solo_admin": False
+    },
+    {
+        "nombre": "maquinas", 
+        "ruta": "/maquinas",
+        "titulo": "Máquinas",
+        "descripcion": "Gestión de máquinas y equipos",
+        "icono": "Cpu",
+        "orden": 4,
+        "activa": True,
+        "solo_admin": False
+    },
+    {
+        "nombre": "modelos_maquinas",
+        "ruta": "/modelos-maquinas",
+        "titulo": "Modelos",
+        "descripcion": "Gestión de modelos de máquinas",
+        "icono": "Settings",
+        "orden": 5,
+        "activa": True,
+        "solo_admin": False
+    },
+    {
+        "nombre": "plan_mantenimiento",
+        "ruta": "/plan-mantenimiento", 
+        "titulo": "Plan de Mantenimiento",
+        "descripcion": "Planificación de mantenimientos preventivos",
+        "icono": "Calendar",
+        "orden": 6,
+        "activa": True,
+        "solo_admin": False
+    },
+    {
+        "nombre": "ordenes_trabajo",
+        "ruta": "/ordenes-trabajo",
+        "titulo": "Generar OT",
+        "descripcion": "Gestión de órdenes de trabajo",
+        "icono": "Wrench",
+        "orden": 7,
+        "activa": True,
+        "solo_admin": False
+    },
+    {
+        "nombre": "mis_ordenes_trabajo",
+        "ruta": "/mis-ordenes-trabajo",
+        "titulo": "OTs Asignadas",
+        "descripcion": "Órdenes de trabajo asignadas al usuario",
+        "icono": "ClipboardList",
+        "orden": 8,
+        "activa": True,
+        "solo_admin": False
+    },
+    {
+        "nombre": "analytics_ia",
+        "ruta": "/analytics-ia",
+        "titulo": "Analytics IA",
+        "descripcion": "Análisis predictivo con inteligencia artificial",
+        "icono": "Brain",
+        "orden": 9,
+        "activa": True,
+        "solo_admin": False
+    },
+    {
+        "nombre": "dashboard_metricas",
+        "ruta": "/dashboard-metricas",
+        "titulo": "Dashboard Métricas",
+        "descripcion": "Métricas y KPIs del sistema",
+        "icono": "BarChart3",
+        "orden": 10,
+        "activa": True,
+        "solo_admin": False
+    },
+    {
+        "nombre": "historial",
+        "ruta": "/historial",
+        "titulo": "Historial de Consumo",
+        "descripcion": "Historial de consumo de repuestos",
+        "icono": "History",
+        "orden": 11,
+        "activa": True,
+        "solo_admin": False
+    },
+    {
+        "nombre": "usuarios",
+        "ruta": "/admin/usuarios",
+        "titulo": "Usuarios",
+        "descripcion": "Administración de usuarios del sistema",
+        "icono": "Shield",
+        "orden": 12,
+        "activa": True,
+        "solo_admin": True
+    },
+    {
+        "nombre": "admin",
+        "ruta": "/admin",
+        "titulo": "Administración",
+        "descripcion": "Panel de administración del sistema",
+        "icono": "Settings",
+        "orden": 13,
+        "activa": True,
+        "solo_admin": True
+    }
+]
+
+def is_initialized(engine):
+    """Comprobar en una sola consulta si los datos esenciales y el usuario admin ya existen.
+    Solo cuentan los nombres sembrados: los creados por administradores no completan el umbral"""
+    try:
+        with engine.connect() as conn:
+            roles, permisos, paginas, admin = conn.execute(text("""
+                SELECT (SELECT count(*) FROM roles WHERE nombre = ANY(:roles)),
+                       (SELECT count(*) FROM permisos WHERE nombre = ANY(:permisos)),
+                       (SELECT count(*) FROM paginas WHERE nombre = ANY(:paginas)),
+                       EXISTS (SELECT 1 FROM usuarios WHERE username = 'admin')
+            """), {
+                "roles": [r["nombre"] for r in ROLES_BASICOS],
+                "permisos": [p[0] for p in PERMISOS_BASICOS],
+                "paginas": [p["nombre"] for p in PAGINAS_SISTEMA],
+            }).one()
+    except SQLAlchemyError:
+        return False
+    
+    return bool(admin) and (
+        roles == len(ROLES_BASICOS) and permisos == len(PERMISOS_BASICOS) and paginas == len(PAGINAS_SISTEMA)
+    )
+
 def create_essential_data():
-    """Crear datos esenciales: roles, permisos básicos, páginas del sistema"""
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    """Crear datos esenciales: roles, permisos básicos, páginas del sistema.
+    Devuelve el id del rol admin (None si falla)"""
+    from models.models import Roles, Permisos, Paginas, roles_permisos
+    
     db = SessionLocal()
     
     try:
         print("📊 Creando datos esenciales...")
         
         # 1. Crear roles básicos
-        admin_role = db.query(Roles).filter(Roles.nombre == 'admin').first()
-        if not admin_role:
-            admin_role = Roles(
-                nombre='admin',
-                descripcion='Administrador del sistema con acceso completo',
-                activo=True
-            )
-            db.add(admin_role)
-            print("   ➤ Rol admin creado")
-        
-        user_role = db.query(Roles).filter(Roles.nombre == 'user').first()
-        if not user_role:
-            user_role = Roles(
-                nombre='user',
-                descripcion='Usuario estándar del sistema',
-                activo=True
-            )
-            db.add(user_role)
-            print("   ➤ Rol user creado")
+        # ON CONFLICT DO NOTHING: idempotente y sin carreras entre contenedores que arrancan a la vez
+        roles_creados = db.scalars(
+            pg_insert(Roles).values(ROLES_BASICOS).on_conflict_do_nothing(index_elements=["nombre"]).returning(Roles.nombre)
+        ).all()
+        for nombre in roles_creados:
+            print(f"   ➤ Rol {nombre} creado")
         
-        db.flush()
+        admin_role = db.query(Roles).filter(Roles.nombre == 'admin').one()
         
         # 2. Crear permisos esenciales
-        permisos_basicos = [
-            # Repuestos
-            ("repuestos_leer", "Ver repuestos", "repuestos", "leer"),
-            ("repuestos_crear", "Crear repuestos", "repuestos", "crear"),
-            ("repuestos_editar", "Editar repuestos", "repuestos", "editar"),
-            ("repuestos_eliminar", "Eliminar repuestos", "repuestos", "eliminar"),
-            
-            # Máquinas
-            ("maquinas_leer", "Ver máquinas", "maquinas", "leer"),
-            ("maquinas_crear", "Crear máquinas", "maquinas", "crear"),
-            ("maquinas_editar", "Editar máquinas", "maquinas", "editar"),
-            
-            # Órdenes de trabajo
-            ("ordenes_trabajo_leer", "Ver órdenes de trabajo", "ordenes_trabajo", "leer"),
-            ("ordenes_trabajo_crear", "Crear órdenes de trabajo", "ordenes_trabajo", "crear"),
-            ("ordenes_trabajo_editar", "Editar órdenes de trabajo", "ordenes_trabajo", "editar"),
-            
-            # Órdenes de compra
-            ("ordenes_compra_leer", "Ver órdenes de compra", "ordenes_compra", "leer"),
-            ("ordenes_compra_crear", "Crear órdenes de compra", "ordenes_compra", "crear"),
-            ("ordenes_compra_editar", "Editar órdenes de compra", "ordenes_compra", "editar"),
-            
-            # Administración
-            ("admin_usuarios", "Administrar usuarios", "administracion", "admin"),
-            ("admin_sistema", "Administrar sistema", "administracion", "admin"),
-        ]
-        
-        for codigo, descripcion, modulo, accion in permisos_basicos:
-            permiso_existente = db.query(Permisos).filter(Permisos.nombre == codigo).first()
-            if not permiso_existente:
-                nuevo_permiso = Permisos(
-                    nombre=codigo,
-                    descripcion=descripcion,
-                    recurso=modulo,
-                    accion=accion
-                )
-                db.add(nuevo_permiso)
-        
-        db.flush()
+        # Una sola sentencia: los permisos que ya existen se omiten en el servidor
+        db.execute(pg_insert(Permisos).values([
+            {"nombre": codigo, "descripcion": descripcion, "recurso": modulo, "accion": accion}
+            for codigo, descripcion, modulo, accion in PERMISOS_BASICOS
+        ]).on_conflict_do_nothing(index_elements=["nombre"]))
         print("   ➤ Permisos básicos creados")
         
         # 3. Crear páginas del sistema
-        paginas_sistema = [
-            {
-                "nombre": "repuestos",
-                "ruta": "/repuestos",
-                "titulo": "Repuestos",
-                "descripcion": "Gestión de inventario de repuestos",
-                "icono": "Package",
-                "orden": 1,
-                "activa": True,
-                "solo_admin": False
-            },
-            {
-                "nombre": "proveedores",
-                "ruta": "/proveedores",
-                "titulo": "Proveedores",
-                "descripcion": "Administrar proveedores y contactos",
-                "icono": "Users",
-                "orden": 2,
-                "activa": True,
-                "solo_admin": False
-            },
-            {
-                "nombre": "ordenes_compra",
-                "ruta": "/ordenes-compra",
-                "titulo": "Órdenes de Compra",
-                "descripcion": "Gestión de pedidos de repuestos",
-                "icono": "ShoppingCart",
-                "orden": 3,
-                "activa": True,
-                "solo_admin": False
-            },
-            {
-                "nombre": "maquinas", 
-                "ruta": "/maquinas",
-                "titulo": "Máquinas",
-                "descripcion": "Gestión de máquinas y equipos",
-                "icono": "Cpu",
-                "orden": 4,
-                "activa": True,
-                "solo_admin": False
-            },
-            {
-                "nombre": "modelos_maquinas",
-                "ruta": "/modelos-maquinas",
-                "titulo": "Modelos",
-                "descripcion": "Gestión de modelos de máquinas",
-                "icono": "Settings",
-                "orden": 5,
-                "activa": True,
-                "solo_admin": False
-            },
-            {
-                "nombre": "plan_mantenimiento",
-                "ruta": "/plan-mantenimiento", 
-                "titulo": "Plan de Mantenimiento",
-                "descripcion": "Planificación de mantenimientos preventivos",
-                "icono": "Calendar",
-                "orden": 6,
-                "activa": True,
-                "solo_admin": False
-            },
-            {
-                "nombre": "ordenes_trabajo",
-                "ruta": "/ordenes-trabajo",
-                "titulo": "Generar OT",
-                "descripcion": "Gestión de órdenes de trabajo",
-                "icono": "Wrench",
-                "orden": 7,
-                "activa": True,
-                "solo_admin": False
-            },
-            {
-                "nombre": "mis_ordenes_trabajo",
-                "ruta": "/mis-ordenes-trabajo",
-                "titulo": "OTs Asignadas",
-                "descripcion": "Órdenes de trabajo asignadas al usuario",
-                "icono": "ClipboardList",
-                "orden": 8,
-                "activa": True,
-                "solo_admin": False
-            },
-            {
-                "nombre": "analytics_ia",
-                "ruta": "/analytics-ia",
-                "titulo": "Analytics IA",
-                "descripcion": "Análisis predictivo con inteligencia artificial",
-                "icono": "Brain",
-                "orden": 9,
-                "activa": True,
-                "solo_admin": False
-            },
-            {
-                "nombre": "dashboard_metricas",
-                "ruta": "/dashboard-metricas",
-                "titulo": "Dashboard Métricas",
-                "descripcion": "Métricas y KPIs del sistema",
-                "icono": "BarChart3",
-                "orden": 10,
-                "activa": True,
-                "solo_admin": False
-            },
-            {
-                "nombre": "historial",
-                "ruta": "/historial",
-                "titulo": "Historial de Consumo",
-                "descripcion": "Historial de consumo de repuestos",
-                "icono": "History",
-                "orden": 11,
-                "activa": True,
-                "solo_admin": False
-            },
-            {
-                "nombre": "usuarios",
-                "ruta": "/admin/usuarios",
-                "titulo": "Usuarios",
-                "descripcion": "Administración de usuarios del sistema",
-                "icono": "Shield",
-                "orden": 12,
-                "activa": True,
-                "solo_admin": True
-            },
-            {
-                "nombre": "admin",
-                "ruta": "/admin",
-                "titulo": "Administración",
-                "descripcion": "Panel de administración del sistema",
-                "icono": "Settings",
-                "orden": 13,
-                "activa": True,
-                "solo_admin": True
-            }
-        ]
-        
-        for pagina_data in paginas_sistema:
-            pagina_existente = db.query(Paginas).filter(Paginas.nombre == pagina_data["nombre"]).first()
-            if not pagina_existente:
-                nueva_pagina = Paginas(**pagina_data)
-                db.add(nueva_pagina)
-        
-        db.flush()
+        db.execute(pg_insert(Paginas).values(PAGINAS_SISTEMA).on_conflict_do_nothing(index_elements=["nombre"]))
         print("   ➤ Páginas del sistema creadas")
         
-        # 4. Asignar permisos al rol admin
-        todos_los_permisos = db.query(Permisos).all()
-        admin_role.permisos.clear()
-        for permiso in todos_los_permisos:
-            admin_role.permisos.append(permiso)
+        # 4. Asignar permisos al rol admin: copia de ids en el servidor (dos sentencias
+        # sin importar cuántos permisos haya)
+        db.execute(roles_permisos.delete().where(roles_permisos.c.rol_id == admin_role.id))
+        db.execute(pg_insert(roles_permisos).from_select(
+            ["rol_id", "permiso_id"],
+            select(literal(admin_role.id), Permisos.id)
+        ).on_conflict_do_nothing())
         
         db.commit()
         print("✅ Datos esenciales creados exitosamente")
-        return True
+        return admin_role.id
         
     except SQLAlchemyError as e:
         print(f"❌ Error creando datos esenciales: {e}")
         db.rollback()
-        return False
+        return None
     finally:
         db.close()
 
 def create_sample_data():
     """Crear datos de ejemplo para el sistema"""
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    from models.models import Almacenamientos, Proveedores
+    
     db = SessionLocal()
     
     try:
@@ -380,9 +551,6 @@ def create_sample_data():
             ),
         ]
         
-        for almacenamiento in almacenamientos:
-            db.add(almacenamiento)
-        
         # Crear proveedores de ejemplo
         proveedores = [
             Proveedores(
@@ -405,9 +573,8 @@ def create_sample_data():
             ),
         ]
         
-        for proveedor in proveedores:
-            db.add(proveedor)
-        
+        # Inserción por lotes sin el seguimiento de la unidad de trabajo
+        db.bulk_save_objects([*almacenamientos, *proveedores])
         db.commit()
         print("✅ Datos de ejemplo creados")
         db.close()
@@ -420,9 +587,10 @@ def create_sample_data():
             db.close()
         return False
 
-def create_admin_user():
-    """Crear usuario administrador con acceso completo"""
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def create_admin_user(admin_role_id=None):
+    """Crear usuario administrador con acceso completo (admin_role_id evita volver a buscar el rol)"""
+    from models.models import Usuarios, Roles, Paginas, usuarios_paginas
+    
     db = SessionLocal()
     
     try:
@@ -432,49 +600,55 @@ def create_admin_user():
         admin_user = db.query(Usuarios).filter(Usuarios.username == 'admin').first()
         if admin_user:
             print("   ➤ Usuario admin ya existe")
-            # Asegurar que tenga todas las páginas asignadas
-            todas_las_paginas = db.query(Paginas).all()
-            admin_user.paginas_permitidas.clear()
-            for pagina in todas_las_paginas:
-                admin_user.paginas_permitidas.append(pagina)
+            # Asegurar que tenga todas las páginas asignadas: insertar solo las
+            # que falten sin cargar la colección ni las páginas en memoria
+            asignadas = select(usuarios_paginas.c.pagina_id).where(usuarios_paginas.c.usuario_id == admin_user.id)
+            db.execute(insert(usuarios_paginas).from_select(
+                ["usuario_id", "pagina_id"],
+                select(literal(admin_user.id), Paginas.id).where(Paginas.id.not_in(asignadas))
+            ))
             db.commit()
-            print(f"   📄 {len(todas_las_paginas)} páginas asignadas")
+            paginas_count = db.scalar(
+                select(func.count()).select_from(usuarios_paginas).where(usuarios_paginas.c.usuario_id == admin_user.id)
+            )
+            print(f"   📄 {paginas_count} páginas asignadas")
             db.close()
             return True
         
-        # Obtener rol admin
-        admin_role = db.query(Roles).filter(Roles.nombre == 'admin').first()
-        if not admin_role:
+        # Obtener rol admin (si no lo pasó create_essential_data)
+        if admin_role_id is None:
+            admin_role_id = db.scalar(select(Roles.id).where(Roles.nombre == 'admin'))
+        if admin_role_id is None:
             print("❌ Rol admin no encontrado")
             return False
         
         # Crear usuario admin
-        hashed_password = pwd_context.hash("admin123")
         admin_user = Usuarios(
             username="admin",
             email="admin@mantia.com",
-            hashed_password=hashed_password,
+            hashed_password=ADMIN_PASSWORD_HASH,
             nombre_completo="Administrador del Sistema",
             activo=True,
             es_admin=True,
-            rol_id=admin_role.id,
+            rol_id=admin_role_id,
             debe_cambiar_password=True
         )
         
         db.add(admin_user)
         db.flush()
         
-        # Asignar todas las páginas al admin
-        todas_las_paginas = db.query(Paginas).all()
-        for pagina in todas_las_paginas:
-            admin_user.paginas_permitidas.append(pagina)
+        # Asignar todas las páginas al admin en una sola sentencia INSERT ... SELECT
+        paginas_count = db.execute(insert(usuarios_paginas).from_select(
+            ["usuario_id", "pagina_id"],
+            select(literal(admin_user.id), Paginas.id)
+        )).rowcount
         
         db.commit()
         
         print("✅ Usuario administrador creado:")
         print("   📧 Usuario: admin")
         print("   🔑 Contraseña: admin123")
-        print(f"   📄 Páginas asignadas: {len(todas_las_paginas)}")
+        print(f"   📄 Páginas asignadas: {paginas_count}")
         print("   ⚠️  IMPORTANTE: Cambiar contraseña en primer login")
         
         return True
@@ -510,8 +684,22 @@ def main():
         if not migrate_database(engine):
             print("⚠️ Advertencia en migraciones (continuando)")
         
+        # 4b. Crear índices de rendimiento (solo los que falten)
+        if not create_performance_indexes(engine):
+            print("⚠️ Advertencia creando índices (continuando)")
+        
+        # 4c. Contadores de órdenes de trabajo (trigger; el recálculo solo en la instalación)
+        if not create_ot_counters(engine):
+            print("⚠️ Advertencia configurando contadores (continuando)")
+        
+        # Reinicio en caliente: los datos iniciales ya están cargados, no repetir la siembra
+        if is_initialized(engine):
+            print("✅ Base de datos ya inicializada, se omite la carga de datos")
+            return
+        
         # 5. Crear datos esenciales
-        if not create_essential_data():
+        admin_role_id = create_essential_data()
+        if admin_role_id is None:
             print("❌ Error creando datos esenciales")
             sys.exit(1)
         
@@ -521,7 +709,7 @@ def main():
             sys.exit(1)
         
         # 7. Crear usuario admin
-        if not create_admin_user():
+        if not create_admin_user(admin_role_id):
             print("❌ Error creando usuario admin")
             sys.exit(1)
         
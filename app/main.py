@@ -1,7 +1,10 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic_settings import BaseSettings
 
+from crud import crud_usuarios
 from routers import proveedores, modelos_maquinas, maquinas, repuestos, historial, almacenamientos, auth, usuarios, admin, ordenes_compra, ordenes_trabajo
 
 
@@ -15,10 +18,19 @@ class Settings(BaseSettings):
 
 settings = Settings()
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Calibrar bcrypt al arrancar: el primer login no paga la medición
+    crud_usuarios.preparar_hash_passwords()
+    yield
+
+
 app = FastAPI(
     title="Sistema de Gestión de Repuestos SMT",
     description="API para gestión de repuestos y mantenimiento de máquinas SMT",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configurar CORS
@@ -1,8 +1,8 @@
 """
 Modelos ORM SQLAlchemy para el sistema de gestión de repuestos SMT
 """
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, TIMESTAMP, func, Boolean, Table
-from sqlalchemy.orm import relationship
+from sqlalchemy import BigInteger, Column, Integer, SmallInteger, String, Text, ForeignKey, TIMESTAMP, func, Boolean, Table, Index, Computed, select, text
+from sqlalchemy.orm import column_property, relationship
 from database import Base
 
 
@@ -243,7 +243,7 @@ class OrdenesCompra(Base):
     numero_requisicion = Column(String, unique=True, nullable=True, index=True)
     proveedor_id = Column(Integer, ForeignKey('proveedores.id'), nullable=False)
     legajo = Column(String, nullable=True)
-    estado = Column(String, default='borrador')  # borrador, cotizado, confirmado, completado
+    estado = Column(String, default='borrador', index=True)  # borrador, cotizado, confirmado, completado
     fecha_creacion = Column(TIMESTAMP, default=func.now())
     fecha_actualizacion = Column(TIMESTAMP, default=func.now(), onupdate=func.now())
     observaciones = Column(Text)
@@ -283,6 +283,14 @@ class ItemsOrdenCompra(Base):
     # Relaciones
     orden = relationship("OrdenesCompra", back_populates="items")
     repuesto = relationship("Repuestos", back_populates="items_orden")
+    
+    __table_args__ = (
+        # Un código manual no puede repetirse dentro de la misma orden
+        Index(
+            'ix_items_orden_manual_codigo', 'orden_id', 'codigo_manual',
+            unique=True, postgresql_where=text("es_item_manual = true")
+        ),
+    )
 
 
 class DocumentosOrden(Base):
@@ -294,7 +302,7 @@ class DocumentosOrden(Base):
     __tablename__ = 'documentos_orden'
     
     id = Column(Integer, primary_key=True, autoincrement=True, index=True)
-    orden_id = Column(Integer, ForeignKey('ordenes_compra.id'), nullable=False)
+    orden_id = Column(Integer, ForeignKey('ordenes_compra.id'), nullable=False, index=True)
     nombre_archivo = Column(String, nullable=False)
     ruta_archivo = Column(String, nullable=False)
     tipo_archivo = Column(String, nullable=False)
@@ -307,6 +315,24 @@ class DocumentosOrden(Base):
     usuario_subida = relationship("Usuarios")
 
 
+# Cantidad de documentos por orden como subconsulta correlacionada (diferida: solo se
+# calcula cuando la consulta la pide con undefer)
+OrdenesCompra.documentos_count = column_property(
+    select(func.count(DocumentosOrden.id))
+    .where(DocumentosOrden.orden_id == OrdenesCompra.id)
+    .correlate_except(DocumentosOrden)
+    .scalar_subquery(),
+    deferred=True
+)
+
+
+# Peso numérico de la criticidad para ordenar (columna generada en la base de datos)
+CRITICIDAD_ORDEN_SQL = (
+    "CASE nivel_criticidad WHEN 'critica' THEN 4 WHEN 'alta' THEN 3 "
+    "WHEN 'media' THEN 2 WHEN 'baja' THEN 1 ELSE 0 END"
+)
+
+
 class OrdenesTrabajoMantenimiento(Base):
     """Modelo para órdenes de trabajo de mantenimiento.
     
@@ -323,6 +349,7 @@ class OrdenesTrabajoMantenimiento(Base):
     usuario_creador_id = Column(Integer, ForeignKey('usuarios.id'), nullable=False)
     tipo_mantenimiento = Column(String, nullable=False, default='correctivo')  # preventivo, predictivo, correctivo
     nivel_criticidad = Column(String, nullable=False)  # baja, media, alta, critica
+    criticidad_orden = Column(SmallInteger, Computed(CRITICIDAD_ORDEN_SQL, persisted=True))
     estado = Column(String, default='pendiente')  # pendiente, en_proceso, completada, cancelada
     fecha_programada = Column(TIMESTAMP, nullable=False)
     fecha_creacion = Column(TIMESTAMP, default=func.now())
@@ -358,6 +385,28 @@ class ComentariosOT(Base):
     archivos = relationship("ArchivosComentarioOT", back_populates="comentario", cascade="all, delete-orphan")
 
 
+class ContadoresOT(Base):
+    """Contadores de órdenes de trabajo mantenidos por un trigger de la base de datos.
+
+    Claves: 'total', 'estado:<estado>' y 'criticidad:<nivel>'. El trigger y el
+    recálculo inicial se crean en init_db (create_ot_counters).
+    """
+    __tablename__ = 'ot_contadores'
+    
+    clave = Column(String, primary_key=True)
+    valor = Column(BigInteger, nullable=False, default=0)
+
+
+# Cantidad de comentarios por OT para los listados (diferida, se pide con undefer)
+OrdenesTrabajoMantenimiento.n_comentarios = column_property(
+    select(func.count(ComentariosOT.id))
+    .where(ComentariosOT.orden_trabajo_id == OrdenesTrabajoMantenimiento.id)
+    .correlate_except(ComentariosOT)
+    .scalar_subquery(),
+    deferred=True
+)
+
+
 class ArchivosOT(Base):
     """Modelo para archivos adjuntos en órdenes de trabajo.
     
@@ -367,7 +416,7 @@ class ArchivosOT(Base):
     __tablename__ = 'archivos_ot'
     
     id = Column(Integer, primary_key=True, autoincrement=True, index=True)
-    orden_trabajo_id = Column(Integer, ForeignKey('ordenes_trabajo_mantenimiento.id'), nullable=False)
+    orden_trabajo_id = Column(Integer, ForeignKey('ordenes_trabajo_mantenimiento.id'), nullable=False, index=True)
     usuario_id = Column(Integer, ForeignKey('usuarios.id'), nullable=False)
     nombre_archivo = Column(String, nullable=False)  # Nombre original del archivo
     nombre_archivo_sistema = Column(String, nullable=False)  # Nombre único en el sistema
@@ -390,7 +439,7 @@ class ArchivosComentarioOT(Base):
     __tablename__ = 'archivos_comentario_ot'
     
     id = Column(Integer, primary_key=True, autoincrement=True, index=True)
-    comentario_id = Column(Integer, ForeignKey('comentarios_ot.id'), nullable=False)
+    comentario_id = Column(Integer, ForeignKey('comentarios_ot.id'), nullable=False, index=True)
     usuario_id = Column(Integer, ForeignKey('usuarios.id'), nullable=False)
     nombre_archivo = Column(String, nullable=False)  # Nombre original del archivo
     nombre_archivo_sistema = Column(String, nullable=False)  # Nombre único en el sistema
@@ -1,7 +1,7 @@
 """
 Router para gestión administrativa: roles, permisos y páginas (solo admin)
 """
-from typing import List, Annotated
+from typing import List, Annotated, Optional
 
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.orm import Session
@@ -25,11 +25,12 @@ router = APIRouter(prefix="/admin", tags=["administración"])
 async def list_roles(
     skip: int = Query(0, ge=0, description="Número de registros a omitir"),
     limit: int = Query(100, ge=1, le=1000, description="Número máximo de registros a devolver"),
+    after_id: Optional[int] = Query(None, description="Cursor: id del último elemento recibido (reemplaza skip)"),
     current_admin: Annotated[Usuarios, Depends(get_current_admin_user)] = None,
     db: Session = Depends(get_db)
 ):
     """Lista todos los roles (solo admin)"""
-    roles = crud_usuarios.get_roles(db, skip=skip, limit=limit)
+    roles = crud_usuarios.get_roles(db, skip=skip, limit=limit, after_id=after_id)
     return roles
 
 
@@ -159,11 +160,12 @@ async def delete_rol(
 async def list_permisos(
     skip: int = Query(0, ge=0, description="Número de registros a omitir"),
     limit: int = Query(100, ge=1, le=1000, description="Número máximo de registros a devolver"),
+    after_id: Optional[int] = Query(None, description="Cursor: id del último elemento recibido (reemplaza skip)"),
     current_admin: Annotated[Usuarios, Depends(get_current_admin_user)] = None,
     db: Session = Depends(get_db)
 ):
     """Lista todos los permisos (solo admin)"""
-    permisos = crud_usuarios.get_permisos(db, skip=skip, limit=limit)
+    permisos = crud_usuarios.get_permisos(db, skip=skip, limit=limit, after_id=after_id)
     return permisos
 
 
@@ -265,11 +267,16 @@ async def delete_permiso(
 async def list_paginas(
     skip: int = Query(0, ge=0, description="Número de registros a omitir"),
     limit: int = Query(100, ge=1, le=1000, description="Número máximo de registros a devolver"),
+    after_orden: Optional[int] = Query(None, description="Cursor: orden del último elemento recibido"),
+    after_id: Optional[int] = Query(None, description="Cursor: id del último elemento recibido (reemplaza skip)"),
     current_admin: Annotated[Usuarios, Depends(get_current_admin_user)] = None,
     db: Session = Depends(get_db)
 ):
     """Lista todas las páginas (solo admin)"""
-    paginas = crud_usuarios.get_paginas(db, skip=skip, limit=limit)
+    paginas = crud_usuarios.get_paginas(
+        db, skip=skip, limit=limit,
+        after=(after_orden, after_id) if after_orden is not None and after_id is not None else None
+    )
     return paginas
 
 
@@ -15,7 +15,7 @@ router = APIRouter(prefix="/almacenamientos", tags=["almacenamientos"])
 def read_almacenamientos(
     skip: int = Query(0, ge=0, description="Número de registros a saltar"),
     limit: int = Query(100, ge=1, le=100, description="Número máximo de registros a devolver"),
-    search: str = Query("", description="Término de búsqueda"),
+    search: str = Query("", description="Término de búsqueda (terminar en '*' para buscar por prefijo de código)"),
     db: Session = Depends(get_db)
 ):
     """
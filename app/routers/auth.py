@@ -104,7 +104,7 @@ async def login_for_access_token(
     db: Session = Depends(get_db)
 ):
     """Endpoint para login de usuarios"""
-    user = crud_usuarios.authenticate_user(db, form_data.username, form_data.password)
+    user = await crud_usuarios.aauthenticate_user(db, form_data.username, form_data.password)
     
     if not user:
         raise HTTPException(
@@ -168,7 +168,7 @@ async def change_password(
         )
     
     # Cambiar contraseña
-    success = crud_usuarios.change_password(
+    success = await crud_usuarios.achange_password(
         db, 
         current_user.id, 
         password_data.password_actual, 
@@ -201,7 +201,7 @@ async def reset_password(
         )
     
     # Resetear contraseña
-    success = crud_usuarios.reset_password(
+    success = await crud_usuarios.areset_password(
         db, 
         reset_data.usuario_id, 
         reset_data.password_nueva,
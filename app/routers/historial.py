@@ -9,6 +9,7 @@ from sqlalchemy.orm import Session
 from database import get_db
 from schemas.schemas import HistorialRepuestoResponse, HistorialRepuestoCreate, HistorialRepuestoUpdate
 from crud import crud_historial, crud_repuestos, crud_maquinas
+from routers.streaming import json_array_stream
 
 router = APIRouter(prefix="/historial", tags=["Historial de Repuestos"])
 
@@ -96,6 +97,24 @@ def listar_historial_por_fecha(
     return historial
 
 
+@router.get("/fecha/rango/exportar", response_model=List[HistorialRepuestoResponse])
+def exportar_historial_por_fecha(
+    fecha_inicio: date = Query(..., description="Fecha de inicio (YYYY-MM-DD)"),
+    fecha_fin: date = Query(..., description="Fecha de fin (YYYY-MM-DD)")
+):
+    """Exportar historial por rango de fechas sin límite de filas (se transmite por lotes)"""
+    if fecha_inicio > fecha_fin:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="La fecha de inicio no puede ser posterior a la fecha de fin"
+        )
+    
+    return json_array_stream(
+        lambda db: crud_historial.iter_historial_by_fecha_rango(db, fecha_inicio=fecha_inicio, fecha_fin=fecha_fin),
+        HistorialRepuestoResponse
+    )
+
+
 @router.post("/", response_model=HistorialRepuestoResponse, status_code=status.HTTP_201_CREATED)
 def crear_historial(
     historial: HistorialRepuestoCreate,
@@ -134,6 +153,29 @@ def crear_historial(
         )
 
 
+@router.post("/lote", status_code=status.HTTP_201_CREATED)
+def crear_historial_lote(
+    historial: List[HistorialRepuestoCreate],
+    db: Session = Depends(get_db)
+):
+    """Crear registros de historial en lote (p. ej. carga de consumo de fin de turno)"""
+    if any(h.cantidad_usada <= 0 for h in historial):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="La cantidad usada debe ser mayor a cero"
+        )
+    
+    try:
+        creados = crud_historial.create_historial_repuestos_bulk(db=db, items=historial)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    
+    return {"registros_creados": creados}
+
+
 @router.put("/{historial_id}", response_model=HistorialRepuestoResponse)
 def actualizar_historial(
     historial_id: int,
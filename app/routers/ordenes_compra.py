@@ -3,10 +3,12 @@ Endpoints para gestión de Órdenes de Compra
 """
 from typing import List, Optional
 import os
-from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile
+from fastapi import APIRouter, Depends, HTTPException, Query, status, File, UploadFile
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 
-from database import get_db
+from database import get_db, get_db_ro
 from schemas.schemas import (
     OrdenCompraResponse, 
     OrdenCompraCreate, 
@@ -20,7 +22,7 @@ from schemas.schemas import (
 )
 from crud import crud_ordenes_compra
 from routers.auth import get_current_user
-from models.models import Usuarios, DocumentosOrden
+from models.models import Usuarios
 
 router = APIRouter(prefix="/ordenes-compra", tags=["Órdenes de Compra"])
 
@@ -39,17 +41,27 @@ def listar_ordenes_compra(
     skip: int = 0,
     limit: int = 100,
     estado: Optional[str] = None,
+    fields: Optional[str] = Query(None, description="Campos a devolver separados por coma, con puntos para las relaciones: id,estado,proveedor.nombre,items.cantidad_pedida (por defecto la orden con proveedor e items)"),
     db: Session = Depends(get_db),
     current_user: Usuarios = Depends(get_current_user)
 ):
     """Obtener lista de órdenes de compra con filtros opcionales"""
-    ordenes = crud_ordenes_compra.get_ordenes_compra(db, skip=skip, limit=limit, estado=estado)
+    try:
+        ordenes = crud_ordenes_compra.get_ordenes_compra(db, skip=skip, limit=limit, estado=estado, fields=fields)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    if fields:
+        # Solo se cargaron los campos pedidos: se serializan tal cual, sin el esquema completo
+        return JSONResponse(jsonable_encoder(crud_ordenes_compra.proyectar_ordenes(ordenes, fields)))
     return ordenes
 
 
 @router.get("/estadisticas", response_model=dict)
 def obtener_estadisticas_ordenes(
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_db_ro),
     current_user: Usuarios = Depends(get_current_user)
 ):
     """Obtener estadísticas de órdenes de compra"""
@@ -59,16 +71,25 @@ def obtener_estadisticas_ordenes(
 @router.get("/{orden_id}", response_model=OrdenCompraResponse)
 def obtener_orden_compra(
     orden_id: int,
+    fields: Optional[str] = Query(None, description="Campos a devolver separados por coma, con puntos para las relaciones: id,estado,proveedor.nombre,items.cantidad_pedida (por defecto la orden completa)"),
     db: Session = Depends(get_db),
     current_user: Usuarios = Depends(get_current_user)
 ):
     """Obtener orden de compra por ID"""
-    orden = crud_ordenes_compra.get_orden_compra(db, orden_id=orden_id)
+    try:
+        orden = crud_ordenes_compra.get_orden_compra(db, orden_id=orden_id, fields=fields)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     if orden is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Orden de compra no encontrada"
         )
+    if fields:
+        return JSONResponse(jsonable_encoder(crud_ordenes_compra.proyectar_ordenes([orden], fields)[0]))
     return orden
 
 
@@ -293,32 +314,21 @@ def eliminar_documento_orden(
     current_user: Usuarios = Depends(get_current_user)
 ):
     """Eliminar documento de orden"""
-    # Obtener documento para eliminar archivo físico
-    documento = db.query(DocumentosOrden).filter(
-        DocumentosOrden.id == documento_id
-    ).first()
-    
-    if not documento:
+    # Eliminar registro de base de datos (DELETE ... RETURNING devuelve la ruta del archivo)
+    ruta_archivo = crud_ordenes_compra.delete_documento_orden(db, documento_id=documento_id)
+    if ruta_archivo is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Documento no encontrado"
         )
     
-    # Eliminar archivo físico
-    if os.path.exists(documento.ruta_archivo):
-        try:
-            os.remove(documento.ruta_archivo)
-        except:
-            pass  # Continuar aunque falle la eliminación del archivo
+    # Eliminar archivo físico una vez confirmado el borrado
+    try:
+        os.remove(ruta_archivo)
+    except OSError:
+        pass  # Continuar aunque falle la eliminación del archivo
     
-    # Eliminar registro de base de datos
-    if crud_ordenes_compra.delete_documento_orden(db, documento_id=documento_id):
-        return {"message": "Documento eliminado exitosamente"}
-    else:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Documento no encontrado"
-        )
+    return {"message": "Documento eliminado exitosamente"}
 
 
 # === FUNCIONES ESPECIALES ===
@@ -331,10 +341,6 @@ def confirmar_llegada_repuestos(
     current_user: Usuarios = Depends(get_current_user)
 ):
     """Confirmar llegada de repuestos y actualizar inventario"""
-    print(f"=== CONFIRMAR LLEGADA ENDPOINT ===")
-    print(f"Orden ID: {orden_id}")
-    print(f"Items recibidos: {llegada.items_recibidos}")
-    
     try:
         orden_actualizada = crud_ordenes_compra.confirmar_llegada_repuestos(
             db, orden_id=orden_id, llegada=llegada
@@ -344,14 +350,6 @@ def confirmar_llegada_repuestos(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Orden de compra no encontrada"
             )
-        
-        # Debug: mostrar repuestos después de la actualización
-        print("=== REPUESTOS DESPUÉS DE ACTUALIZACIÓN ===")
-        from models.models import Repuestos
-        repuestos_debug = db.query(Repuestos).all()
-        for rep in repuestos_debug[-5:]:  # Últimos 5 repuestos
-            print(f"ID: {rep.id}, Código: {rep.codigo}, Nombre: {rep.nombre}, Cantidad: {rep.cantidad}")
-        
         return orden_actualizada
     except ValueError as e:
         raise HTTPException(
@@ -368,8 +366,7 @@ def reset_estado_orden(
     current_user: Usuarios = Depends(get_current_user)
 ):
     """Endpoint temporal para resetear estado de orden para pruebas"""
-    orden_actualizada = crud_ordenes_compra.reset_orden_estado(db, orden_id=orden_id, nuevo_estado=nuevo_estado)
-    if orden_actualizada is None:
+    if not crud_ordenes_compra.reset_orden_estado(db, orden_id=orden_id, nuevo_estado=nuevo_estado):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Orden de compra no encontrada"
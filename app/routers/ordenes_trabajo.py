@@ -2,20 +2,20 @@
 API Router para órdenes de trabajo de mantenimiento
 """
 from typing import List, Optional
-from datetime import date
+from datetime import date, datetime
 from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File
 from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
 import os
 
-from database import get_db
+from database import get_db, get_db_ro
 from routers.auth import get_current_user
 from models.models import Usuarios
 from schemas.schemas import (
     OrdenTrabajoCreate,
     OrdenTrabajoUpdate,
     OrdenTrabajoResponse,
-    OrdenTrabajoListResponse,
+    OrdenTrabajoResumenResponse,
     ComentarioOTCreate,
     ComentarioOTResponse,
     EstadisticasOT,
@@ -30,7 +30,7 @@ router = APIRouter()
 
 @router.get("/stats", response_model=EstadisticasOT)
 def get_ordenes_trabajo_stats(
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_db_ro),
     current_user: Usuarios = Depends(get_current_user)
 ):
     """Obtener estadísticas de órdenes de trabajo"""
@@ -38,7 +38,16 @@ def get_ordenes_trabajo_stats(
     return EstadisticasOT(**stats)
 
 
-@router.get("/", response_model=List[OrdenTrabajoResponse])
+@router.get("/vencidas/existe")
+def hay_ordenes_trabajo_vencidas(
+    db: Session = Depends(get_db_ro),
+    current_user: Usuarios = Depends(get_current_user)
+):
+    """Indicar si hay alguna OT vencida (para alertas: no cuenta, se detiene en la primera)"""
+    return {"hay_vencidas": crud_orden_trabajo.has_vencidas(db)}
+
+
+@router.get("/", response_model=List[OrdenTrabajoResumenResponse])
 def read_ordenes_trabajo(
     skip: int = Query(0, ge=0),
     limit: int = Query(100, le=1000),
@@ -52,11 +61,13 @@ def read_ordenes_trabajo(
     fecha_fin: Optional[date] = Query(None, description="Filtrar hasta fecha"),
     order_by: str = Query("fecha_creacion", description="Campo de ordenamiento"),
     order_direction: str = Query("desc", description="Dirección del ordenamiento"),
+    after_fecha: Optional[datetime] = Query(None, description="Cursor: fecha (según order_by) del último elemento recibido"),
+    after_id: Optional[int] = Query(None, description="Cursor: id del último elemento recibido (reemplaza skip)"),
     db: Session = Depends(get_db),
     current_user: Usuarios = Depends(get_current_user)
 ):
-    """Obtener lista de órdenes de trabajo con filtros"""
-    ordenes = crud_orden_trabajo.get_multi(
+    """Obtener lista de órdenes de trabajo con filtros (sin comentarios ni archivos; ver n_comentarios)"""
+    ordenes = crud_orden_trabajo.get_multi_summary(
         db=db,
         skip=skip,
         limit=limit,
@@ -69,7 +80,8 @@ def read_ordenes_trabajo(
         fecha_inicio=fecha_inicio,
         fecha_fin=fecha_fin,
         order_by=order_by,
-        order_direction=order_direction
+        order_direction=order_direction,
+        after=(after_fecha, after_id) if after_fecha is not None and after_id is not None else None
     )
     return ordenes
 
@@ -79,6 +91,8 @@ def read_mis_ordenes_trabajo(
     skip: int = Query(0, ge=0),
     limit: int = Query(100, le=1000),
     estado: Optional[str] = Query(None, description="Filtrar por estado"),
+    after_fecha: Optional[datetime] = Query(None, description="Cursor: fecha programada del último elemento recibido"),
+    after_id: Optional[int] = Query(None, description="Cursor: id del último elemento recibido (reemplaza skip)"),
     db: Session = Depends(get_db),
     current_user: Usuarios = Depends(get_current_user)
 ):
@@ -88,7 +102,8 @@ def read_mis_ordenes_trabajo(
         usuario_id=current_user.id,
         estado=estado,
         skip=skip,
-        limit=limit
+        limit=limit,
+        after=(after_fecha, after_id) if after_fecha is not None and after_id is not None else None
     )
     return ordenes
 
@@ -201,11 +216,8 @@ def delete_orden_trabajo(
     current_user: Usuarios = Depends(get_current_user)
 ):
     """Eliminar orden de trabajo"""
-    orden = crud_orden_trabajo.get(db=db, id=id)
-    if not orden:
+    if not crud_orden_trabajo.delete(db=db, id=id):
         raise HTTPException(status_code=404, detail="Orden de trabajo no encontrada")
-    
-    crud_orden_trabajo.delete(db=db, id=id)
     return {"message": "Orden de trabajo eliminada exitosamente"}
 
 
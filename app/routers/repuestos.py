@@ -8,6 +8,7 @@ from sqlalchemy.orm import Session
 from database import get_db
 from schemas.schemas import RepuestoResponse, RepuestoCreate, RepuestoUpdate
 from crud import crud_repuestos, crud_proveedores
+from routers.streaming import json_array_stream
 
 router = APIRouter(prefix="/repuestos", tags=["Repuestos"])
 
@@ -67,8 +68,11 @@ def listar_repuestos_por_proveedor(
             detail="Proveedor no encontrado"
         )
     
-    repuestos = crud_repuestos.get_repuestos_by_proveedor(db, proveedor_id=proveedor_id)
-    return repuestos
+    # Se transmite por lotes: nunca se materializa la lista completa en memoria
+    return json_array_stream(
+        lambda db: crud_repuestos.get_repuestos_by_proveedor(db, proveedor_id=proveedor_id),
+        RepuestoResponse
+    )
 
 
 @router.get("/stock/bajo", response_model=List[RepuestoResponse])
@@ -77,8 +81,10 @@ def listar_repuestos_bajo_stock(
     db: Session = Depends(get_db)
 ):
     """Obtener repuestos con stock bajo usando cantidad mínima personalizada o default"""
-    repuestos = crud_repuestos.get_repuestos_bajo_stock(db, cantidad_minima_default=cantidad_minima_default)
-    return repuestos
+    return json_array_stream(
+        lambda db: crud_repuestos.get_repuestos_bajo_stock(db, cantidad_minima_default=cantidad_minima_default),
+        RepuestoResponse
+    )
 
 
 @router.post("/", response_model=RepuestoResponse, status_code=status.HTTP_201_CREATED)
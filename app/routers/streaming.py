@@ -0,0 +1,29 @@
+"""
+Respuestas JSON transmitidas por lotes para listados grandes
+"""
+from typing import Callable, Iterable, Type
+
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+
+
+def json_array_stream(consulta: Callable[[Session], Iterable], esquema: Type[BaseModel]) -> StreamingResponse:
+    """Transmitir el resultado de `consulta` como un arreglo JSON, serializando fila por fila.
+
+    La sesión se abre dentro del generador: la de Depends(get_db) se cierra antes de que
+    termine de enviarse la respuesta y el cursor por lotes (yield_per) la necesita abierta.
+    """
+    def generar():
+        db = SessionLocal()
+        try:
+            yield "["
+            for i, obj in enumerate(consulta(db)):
+                yield ("," if i else "") + esquema.model_validate(obj).model_dump_json()
+            yield "]"
+        finally:
+            db.close()
+    
+    return StreamingResponse(generar(), media_type="application/json")
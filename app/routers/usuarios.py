@@ -1,7 +1,7 @@
 """
 Router para gestión de usuarios (solo admin)
 """
-from typing import List, Annotated
+from typing import List, Annotated, Optional
 
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.orm import Session
@@ -22,11 +22,12 @@ router = APIRouter(prefix="/usuarios", tags=["gestión de usuarios"])
 async def list_usuarios(
     skip: int = Query(0, ge=0, description="Número de registros a omitir"),
     limit: int = Query(100, ge=1, le=1000, description="Número máximo de registros a devolver"),
+    after_id: Optional[int] = Query(None, description="Cursor: id del último elemento recibido (reemplaza skip)"),
     current_admin: Annotated[Usuarios, Depends(get_current_admin_user)] = None,
     db: Session = Depends(get_db)
 ):
     """Lista todos los usuarios (solo admin)"""
-    usuarios = crud_usuarios.get_usuarios(db, skip=skip, limit=limit)
+    usuarios = crud_usuarios.get_usuarios(db, skip=skip, limit=limit, after_id=after_id)
     return usuarios
 
 
@@ -79,10 +80,33 @@ async def create_usuario(
                 detail="El rol especificado no existe"
             )
     
-    nuevo_usuario = crud_usuarios.create_usuario(db, usuario)
+    nuevo_usuario = await crud_usuarios.acreate_usuario(db, usuario)
     return nuevo_usuario
 
 
+@router.post("/importar")
+def importar_usuarios(
+    usuarios: List[UsuarioCreate],
+    current_admin: Annotated[Usuarios, Depends(get_current_admin_user)] = None,
+    db: Session = Depends(get_db)
+):
+    """Crea varios usuarios en una sola operación (solo admin); devuelve los IDs creados"""
+    if len(usuarios) > 1000:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No se pueden importar más de 1000 usuarios por solicitud"
+        )
+    
+    try:
+        ids = crud_usuarios.bulk_create_usuarios(db, usuarios)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    return {"creados": len(ids), "ids": ids}
+
+
 @router.put("/{usuario_id}", response_model=UsuarioResponse)
 async def update_usuario(
     usuario_id: int,
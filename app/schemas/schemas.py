@@ -400,6 +400,7 @@ class OrdenCompraResponse(OrdenCompraBase):
     proveedor: Optional[ProveedorResponse] = None
     items: List[ItemOrdenResponse] = []
     documentos: List[DocumentoOrdenResponse] = []
+    documentos_count: int = 0
 
     class Config:
         from_attributes = True
@@ -423,8 +424,12 @@ class EstadosOrden:
     COMPLETADO = "completado"
 
 # Para actualización masiva de llegada de repuestos
+class ItemRecibido(BaseModel):
+    item_id: int
+    cantidad_recibida: int = 0
+
 class ConfirmarLlegadaRequest(BaseModel):
-    items_recibidos: List[dict]  # [{"item_id": int, "cantidad_recibida": int}]
+    items_recibidos: List[ItemRecibido]
 
 
 # === ESQUEMAS PARA ÓRDENES DE TRABAJO DE MANTENIMIENTO ===
@@ -536,7 +541,8 @@ class MaquinaBasica(BaseModel):
         from_attributes = True
 
 
-class OrdenTrabajoResponse(OrdenTrabajoBase):
+class OrdenTrabajoResumenResponse(OrdenTrabajoBase):
+    """OT para listados: sin comentarios ni archivos (solo su cantidad en n_comentarios)"""
     id: int
     estado: str
     fecha_creacion: datetime
@@ -547,13 +553,17 @@ class OrdenTrabajoResponse(OrdenTrabajoBase):
     maquina: MaquinaBasica
     usuario_asignado: UsuarioBasico
     usuario_creador: UsuarioBasico
-    comentarios: List[ComentarioOTResponse] = []
-    archivos: List[ArchivoOTResponse] = []
+    n_comentarios: int = 0
 
     class Config:
         from_attributes = True
 
 
+class OrdenTrabajoResponse(OrdenTrabajoResumenResponse):
+    comentarios: List[ComentarioOTResponse] = []
+    archivos: List[ArchivoOTResponse] = []
+
+
 class OrdenTrabajoListResponse(BaseModel):
     id: int
     titulo: str
@@ -34,20 +34,16 @@ done
 cat > /tmp/init_db.py << 'EOF'
 import os
 import sys
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from database import Base
+from database import Base, engine, SessionLocal
 from models.models import Usuarios, Roles
 from passlib.context import CryptContext
 
 try:
     print('📋 Creando tablas...')
-    engine = create_engine(os.environ['DATABASE_URL'])
     Base.metadata.create_all(bind=engine)
     print('✅ Tablas creadas/verificadas')
     
     print('👤 Verificando usuario administrador...')
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
     db = SessionLocal()
     
     # Verificar si ya existe el usuario admin